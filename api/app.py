@@ -1,26 +1,34 @@
 import os
+import sys
+import logging
 import base58
 import base64
 import json
 import asyncio
+import time
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from flask_bcrypt import Bcrypt
 from dotenv import load_dotenv
-from solana.rpc.async_api import AsyncClient
 from solana.rpc.commitment import Processed
 from solana.rpc.types import TxOpts
 from solders.keypair import Keypair
 from solders.message import VersionedTransaction
 from solders.pubkey import Pubkey
-from jupiter_python_sdk.jupiter import Jupiter
-from marshmallow import Schema, fields, ValidationError
+from marshmallow import Schema, fields, validate, ValidationError
 
 from user_manager import UserManager
 
+# Shared BarkBOT modules live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from referral_accrual import ReferralAccrual
+from fee_ledger import DEFAULT_SPLITS, FeeLedger, parse_splits
+from instrumentation import instrument, metrics, start_profiler
+from services import ServiceContainer
+
 # Load environment variables
 load_dotenv()
 
@@ -31,12 +39,39 @@ logging.basicConfig(level=logging.INFO)
 ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY')
 DATABASE_URL = os.getenv('DATABASE_URL')
 JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
-PRIVATE_KEY = base58.b58decode(os.getenv('PRIVATE_KEY'))
+PRIVATE_KEY = os.getenv('PRIVATE_KEY')
 SOLANA_RPC_ENDPOINT_URL = os.getenv('SOLANA_RPC_ENDPOINT_URL')
+PLATFORM_FEE_BPS = int(os.getenv('PLATFORM_FEE_BPS', '20'))
+REFERRAL_REWARD_BPS = int(os.getenv('REFERRAL_REWARD_BPS', '2000'))
+REFERRAL_MIN_PAYOUT = int(os.getenv('REFERRAL_MIN_PAYOUT', '10000000'))
+REFERRAL_SETTLE_INTERVAL = float(os.getenv('REFERRAL_SETTLE_INTERVAL', '86400'))
+FEE_SPLITS = parse_splits(os.getenv('FEE_SPLITS')) if os.getenv('FEE_SPLITS') else DEFAULT_SPLITS
+FEE_AUDIT_LOG = os.getenv('FEE_AUDIT_LOG', 'fee_audit.log')
+BUYBACK_INTERVAL = float(os.getenv('BUYBACK_INTERVAL', '3600'))
+BUYBACK_MIN_AMOUNT = int(os.getenv('BUYBACK_MIN_AMOUNT', '0'))
+BUYBACK_SLIPPAGE_BPS = int(os.getenv('BUYBACK_SLIPPAGE_BPS', '100'))
+SOL_MINT = 'So11111111111111111111111111111111111111112'
+BARK_MINT = os.getenv('BARK_MINT')
+# Jupiter referral account that collects the platform fee; no fee is charged or booked without it
+JUPITER_REFERRAL_ACCOUNT = os.getenv('JUPITER_REFERRAL_ACCOUNT')
+JUPITER_REFERRAL_PROGRAM_ID = 'REFER4ZgmyYx9c6He5XfaTMiGfdLwRnkV4RPp9t9iF3'
+PROFILE_SAMPLE_INTERVAL = os.getenv('PROFILE_SAMPLE_INTERVAL')
+# Client addresses allowed to scrape /metrics; loopback only by default
+METRICS_ALLOWED_IPS = frozenset(ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip())
+JUPITER_API_URL = os.getenv('JUPITER_API_URL')
+TOKEN_CACHE_PATH = os.getenv('TOKEN_CACHE_PATH', 'token_cache.json')
+# Lock file electing the one API process that runs settlement and buybacks
+API_LEADER_LOCK = os.getenv('API_LEADER_LOCK', 'barkbot-api.leader.lock')
+BACKTEST_DATA_DIR = os.getenv('BACKTEST_DATA_DIR', 'price_data')
+BACKTEST_DEFAULT_SERIES = os.getenv('BACKTEST_DEFAULT_SERIES', 'bark_1m.csv')
+BACKTEST_MAX_COMBINATIONS = int(os.getenv('BACKTEST_MAX_COMBINATIONS', '10000'))
+BACKTEST_MAX_CELLS = int(os.getenv('BACKTEST_MAX_CELLS', '50000000'))
+BACKTEST_MAX_RESULTS = int(os.getenv('BACKTEST_MAX_RESULTS', '100'))
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config['JWT_SECRET_KEY'] = JWT_SECRET_KEY
+app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', 'true').lower() != 'false'
 jwt = JWTManager(app)
 bcrypt = Bcrypt(app)
 limiter = Limiter(
@@ -45,19 +80,182 @@ limiter = Limiter(
     default_limits=["200 per day", "50 per hour"]
 )
 
-# Initialize Jupiter
-private_key = Keypair.from_bytes(PRIVATE_KEY)
-async_client = AsyncClient(SOLANA_RPC_ENDPOINT_URL)
-jupiter = Jupiter(async_client, private_key)
+# Services are built on first use so importing the app opens no RPC or
+# database connections; pre-fork servers build them in each worker.
+services = ServiceContainer(leader_lock=API_LEADER_LOCK)
+
+@services.service('private_key')
+def private_key():
+    return Keypair.from_bytes(base58.b58decode(PRIVATE_KEY))
+
+@services.service('solana_client')
+def solana_client():
+    from solana.rpc.async_api import AsyncClient
+    return AsyncClient(SOLANA_RPC_ENDPOINT_URL)
+
+@services.service('async_client')
+def async_client():
+    return instrument(services.get('solana_client'), 'solana_rpc')
+
+@services.service('jupiter')
+def jupiter():
+    from jupiter_python_sdk.jupiter import Jupiter
+    # JUPITER_API_URL points quotes and swaps at a self-hosted or local Jupiter API
+    jupiter_urls = {'quote_api_url': f"{JUPITER_API_URL}/quote?", 'swap_api_url': f"{JUPITER_API_URL}/swap"} if JUPITER_API_URL else {}
+    return instrument(Jupiter(services.get('solana_client'), services.get('private_key'), **jupiter_urls), 'jupiter', nested=('dca',))
+
+@services.service('user_manager')
+def user_manager():
+    return instrument(UserManager(ENCRYPTION_KEY), 'user_manager')
+
+@services.service('token_cache')
+def token_cache():
+    from token_cache import TokenCache
+    return TokenCache(TOKEN_CACHE_PATH, registry=metrics)
+
+@services.service('withdrawal_engine')
+def withdrawal_engine():
+    from solana.rpc.async_api import AsyncClient
+    from withdrawal_engine import WithdrawalEngine
+    # Its own client: the engine's loop thread owns this connection pool, while
+    # async_client is used from a fresh asyncio.run loop per request
+    return WithdrawalEngine(instrument(AsyncClient(SOLANA_RPC_ENDPOINT_URL), 'solana_rpc'), cache=token_cache)
+
+async def fetch_mint_info(mints):
+    # Decimals and owning token program for each mint; RPC reads only on cache misses
+    mint_info = {}
+    for mint in mints:
+        info = await token_cache.mint_info_async(withdrawal_engine.client, mint)
+        mint_info[mint] = (info.decimals, info.program_id)
+    return mint_info
+
+# Referral payouts: rewards are sent from the treasury key, packed many transfers per transaction
+async def execute_referral_payouts(balances, record):
+    from withdrawal_engine import TransferIntent
+    wallets = user_manager.get_public_keys({referrer_id for referrer_id, _ in balances})
+    treasury = services.get('private_key')
+    mint_info = await fetch_mint_info({mint for referrer_id, mint in balances if mint != SOL_MINT and referrer_id in wallets})
+    intents = []
+    for (referrer_id, mint), amount in balances.items():
+        if referrer_id not in wallets:
+            continue
+        if mint == SOL_MINT:
+            intents.append(TransferIntent(treasury, wallets[referrer_id], amount, reference=(referrer_id, mint)))
+        else:
+            decimals, token_program = mint_info[mint]
+            intents.append(TransferIntent(treasury, wallets[referrer_id], amount, mint=mint, decimals=decimals, token_program=token_program, reference=(referrer_id, mint)))
+
+    def record_batch(batch, signature, last_valid_block_height):
+        # The pending payout is committed before the transaction is sent
+        record({intent.reference: intent.amount for intent in batch.intents}, str(signature), last_valid_block_height)
+
+    results = await withdrawal_engine.flush(intents, before_send=record_batch)
+    return {str(result.signature): result.status for result in results if result.signature is not None}
+
+def pay_referral_rewards(balances, record):
+    return withdrawal_engine.run(execute_referral_payouts(balances, record))
+
+# Confirmation checks for pending referral payouts and pending swap fees
+async def fetch_signature_statuses(pending):
+    from solders.signature import Signature
+    by_height = {}
+    for signature, last_valid_block_height in pending.items():
+        by_height.setdefault(last_valid_block_height, []).append(Signature.from_string(signature))
+    statuses = {}
+    for last_valid_block_height, signatures in by_height.items():
+        states = await withdrawal_engine.signature_states(signatures, last_valid_block_height)
+        statuses.update({str(signature): state for signature, state in states.items()})
+    return statuses
+
+def check_signatures(pending):
+    return withdrawal_engine.run(fetch_signature_statuses(pending))
+
+@services.service('referral_accrual')
+def referral_accrual():
+    return ReferralAccrual(
+        user_manager,
+        reward_bps=REFERRAL_REWARD_BPS,
+        settle_interval=REFERRAL_SETTLE_INTERVAL,
+        min_payout=REFERRAL_MIN_PAYOUT,
+        payout=pay_referral_rewards,
+        check_payouts=check_signatures,
+    )
+
+@services.service('fee_ledger')
+def fee_ledger():
+    # Swap fees are booked, and credited to referrers, only once the swap confirms
+    return FeeLedger(
+        FEE_SPLITS,
+        fee_bps=PLATFORM_FEE_BPS,
+        audit_path=FEE_AUDIT_LOG,
+        min_buyback=BUYBACK_MIN_AMOUNT,
+        check_fees=check_signatures,
+        booked=lambda telegram_id, mint, fee: referral_accrual.record_fill(telegram_id, mint, fee),
+    )
+
+# Buybacks: one aggregated swap into BARK per mint per period
+def execute_buyback(mint, amount):
+    if mint == BARK_MINT:
+        # Fees already collected in BARK need no swap
+        return None
+    transaction_id, _, _ = asyncio.run(execute_swap(mint, BARK_MINT, amount, BUYBACK_SLIPPAGE_BPS, collect_fee=False))
+    return transaction_id
+
+# One-time startup: schema check and per-process workers
+@services.on_startup
+def start_services():
+    user_manager.init_schema()
+    # Each process drains its own accrual queue; settlement is a singleton
+    referral_accrual.start(settle=False)
+    fee_ledger.start()
+    if PROFILE_SAMPLE_INTERVAL:
+        start_profiler(float(PROFILE_SAMPLE_INTERVAL))
 
-# Initialize UserManager
-user_manager = UserManager(ENCRYPTION_KEY)
+# Singleton workers: referral settlement, fee confirmation and buybacks, in one process only
+@services.on_leader_startup
+def start_singleton_services():
+    referral_accrual.start(settle=True)
+    fee_ledger.start(execute_buyback if BARK_MINT else None, BUYBACK_INTERVAL, confirm=True)
+
+# Instrumentation
+metrics.register_gauge('barkbot_queue_depth', lambda: referral_accrual.queue_depth() if services.is_built('referral_accrual') else 0, queue='referral_accrual')
+metrics.register_gauge('barkbot_queue_depth', lambda: len(fee_ledger.pending_buyback) if services.is_built('fee_ledger') else 0, queue='fee_buyback')
+metrics.register_gauge('barkbot_queue_depth', lambda: fee_ledger.queue_depth() if services.is_built('fee_ledger') else 0, queue='fee_audit')
+
+@app.before_request
+def start_request_timer():
+    services.startup()
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        metrics.histogram('barkbot_http_request_seconds', route=request.endpoint or 'unknown', status=response.status_code).observe(time.perf_counter() - start)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def metrics_endpoint():
+    # Exempt from rate limiting for scrapers, so it is not public either
+    if request.remote_addr not in METRICS_ALLOWED_IPS:
+        return jsonify({"message": "Forbidden"}), 403
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def record_fill(source, telegram_id, mint, fee, signature=None, last_valid_block_height=None):
+    # fee is what Jupiter will collect into the referral account. With a
+    # signature it stays pending until the transaction confirms, and the
+    # ledger credits the referrer when it books the fee.
+    fee_ledger.record_fee(source, telegram_id, mint, fee, signature, last_valid_block_height)
+    if signature is None:
+        referral_accrual.record_fill(telegram_id, mint, fee)
 
 # Schemas for data validation
 class RegisterSchema(Schema):
     telegram_id = fields.Int(required=True)
     email = fields.Email(required=True)
     password = fields.Str(required=True)
+    referrer_id = fields.Int(load_default=None)
 
 class LoginSchema(Schema):
     email = fields.Email(required=True)
@@ -88,6 +286,12 @@ class CreateDCASchema(Schema):
 class CloseDCASchema(Schema):
     dca_pubkey = fields.Str(required=True)
 
+class BacktestSchema(Schema):
+    strategy = fields.Str(required=True)
+    series = fields.Str(load_default=BACKTEST_DEFAULT_SERIES)
+    parameters = fields.Dict(keys=fields.Str(), values=fields.Raw(), required=True)
+    limit = fields.Int(load_default=10, validate=validate.Range(min=1, max=BACKTEST_MAX_RESULTS))
+
 # Error handling
 @app.errorhandler(ValidationError)
 def handle_validation_error(e):
@@ -113,7 +317,7 @@ def register():
         telegram_id = data['telegram_id']
         password = data['password']
         hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
-        user_manager.create_user(telegram_id, email, hashed_password)
+        user_manager.create_user(telegram_id, email, hashed_password, referrer_id=data['referrer_id'])
         logging.info(f"User registered: {email}")
         return jsonify({"message": "User registered successfully."})
     except ValidationError as err:
@@ -136,23 +340,65 @@ def login():
     except ValidationError as err:
         return jsonify(err.messages), 400
 
-# Asynchronous function to execute swap
-async def execute_swap(input_mint, output_mint, amount, slippage_bps):
+async def platform_fee_account(mint):
+    # The referral program's token account for the mint, if it has been initialized
+    if not JUPITER_REFERRAL_ACCOUNT or not PLATFORM_FEE_BPS:
+        return None
+    address = Pubkey.find_program_address(
+        [b'referral_ati', bytes(Pubkey.from_string(JUPITER_REFERRAL_ACCOUNT)), bytes(Pubkey.from_string(mint))],
+        Pubkey.from_string(JUPITER_REFERRAL_PROGRAM_ID),
+    )[0]
+    if not token_cache.account_exists(address):
+        if (await async_client.get_account_info(address)).value is None:
+            return None
+        token_cache.mark_exists(address)
+    return address
+
+async def fetch_swap_transaction(input_mint, output_mint, amount, slippage_bps, fee_account):
+    # The SDK's quote and swap take no platform fee, so fee-collecting swaps
+    # call the same endpoints directly. Returns the transaction, the fee
+    # Jupiter will collect in the output mint and the last block height at
+    # which the transaction can land.
+    import httpx
+    quote_params = {
+        'inputMint': input_mint, 'outputMint': output_mint, 'amount': amount,
+        'slippageBps': slippage_bps, 'platformFeeBps': PLATFORM_FEE_BPS,
+    }
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        quote = (await client.get(jupiter.ENDPOINT_APIS_URL['QUOTE'].rstrip('?'), params=quote_params)).json()
+        if 'routePlan' not in quote:
+            raise Exception(quote.get('error', 'No route found'))
+        swap_request = {
+            'quoteResponse': quote, 'userPublicKey': str(private_key.pubkey()),
+            'wrapAndUnwrapSol': True, 'feeAccount': str(fee_account),
+        }
+        transaction_data = (await client.post(jupiter.ENDPOINT_APIS_URL['SWAP'], json=swap_request)).json()
+    fee = int((quote.get('platformFee') or {}).get('amount') or 0)
+    return transaction_data['swapTransaction'], fee, transaction_data['lastValidBlockHeight']
+
+# Asynchronous function to execute swap; returns the transaction id, the platform fee and the last valid block height
+async def execute_swap(input_mint, output_mint, amount, slippage_bps, collect_fee=True):
     try:
-        transaction_data = await jupiter.swap(
-            input_mint=input_mint,
-            output_mint=output_mint,
-            amount=amount,
-            slippage_bps=slippage_bps,
-        )
-        raw_transaction = VersionedTransaction.from_bytes(base64.b64decode(transaction_data))
-        signature = private_key.sign_message(raw_transaction.message.to_bytes_versioned())
-        signed_txn = VersionedTransaction.populate(raw_transaction.message, [signature])
+        fee_account = await platform_fee_account(output_mint) if collect_fee else None
+        if fee_account is None:
+            transaction_data = await jupiter.swap(
+                input_mint=input_mint,
+                output_mint=output_mint,
+                amount=amount,
+                slippage_bps=slippage_bps,
+            )
+            fee, last_valid_block_height = 0, None
+        else:
+            transaction_data, fee, last_valid_block_height = await fetch_swap_transaction(input_mint, output_mint, amount, slippage_bps, fee_account)
+        with metrics.span('barkbot_call_seconds', service='signer', method='sign_swap'):
+            raw_transaction = VersionedTransaction.from_bytes(base64.b64decode(transaction_data))
+            signature = private_key.sign_message(raw_transaction.message.to_bytes_versioned())
+            signed_txn = VersionedTransaction.populate(raw_transaction.message, [signature])
         opts = TxOpts(skip_preflight=False, preflight_commitment=Processed)
         result = await async_client.send_raw_transaction(txn=bytes(signed_txn), opts=opts)
         transaction_id = json.loads(result.to_json())['result']
         logging.info(f"Transaction sent: {transaction_id}")
-        return transaction_id
+        return transaction_id, fee, last_valid_block_height
     except Exception as e:
         logging.error(f"Error in execute_swap: {e}")
         raise
@@ -168,7 +414,9 @@ def swap():
         output_mint = data['output_mint']
         amount = data['amount']
         slippage_bps = data['slippage_bps']
-        transaction_id = asyncio.run(execute_swap(input_mint, output_mint, amount, slippage_bps))
+        transaction_id, fee, last_valid_block_height = asyncio.run(execute_swap(input_mint, output_mint, amount, slippage_bps))
+        # ExactIn swaps take the platform fee from the output; it is booked once the swap confirms
+        record_fill('swap', telegram_id, output_mint, fee, transaction_id, last_valid_block_height)
         return jsonify({"message": f"Transaction sent: https://explorer.solana.com/tx/{transaction_id}", "transaction_id": transaction_id})
     except ValidationError as err:
         return jsonify(err.messages), 400
@@ -184,9 +432,10 @@ async def execute_limit_order(input_mint, output_mint, in_amount, out_amount):
             in_amount=in_amount,
             out_amount=out_amount,
         )
-        raw_transaction = VersionedTransaction.from_bytes(base64.b64decode(transaction_data['transaction_data']))
-        signature = private_key.sign_message(raw_transaction.message.to_bytes_versioned())
-        signed_txn = VersionedTransaction.populate(raw_transaction.message, [signature, transaction_data['signature2']])
+        with metrics.span('barkbot_call_seconds', service='signer', method='sign_limit_order'):
+            raw_transaction = VersionedTransaction.from_bytes(base64.b64decode(transaction_data['transaction_data']))
+            signature = private_key.sign_message(raw_transaction.message.to_bytes_versioned())
+            signed_txn = VersionedTransaction.populate(raw_transaction.message, [signature, transaction_data['signature2']])
         opts = TxOpts(skip_preflight=False, preflight_commitment=Processed)
         result = await async_client.send_raw_transaction(txn=bytes(signed_txn), opts=opts)
         transaction_id = json.loads(result.to_json())['result']
@@ -207,6 +456,8 @@ def limit_order():
         output_mint = data['output_mint']
         in_amount = data['in_amount']
         out_amount = data['out_amount']
+        # Limit orders go through the SDK's createOrder, which takes no
+        # platform fee, so there is no fee to book
         transaction_id = asyncio.run(execute_limit_order(input_mint, output_mint, in_amount, out_amount))
         return jsonify({"message": f"Transaction sent: https://explorer.solana.com/tx/{transaction_id}", "transaction_id": transaction_id})
     except ValidationError as err:
@@ -248,6 +499,7 @@ def create_dca():
         min_out_amount_per_cycle = data['min_out_amount_per_cycle']
         max_out_amount_per_cycle = data['max_out_amount_per_cycle']
         start = data['start']
+        # The DCA program charges no integrator fee, so there is no fee to book
         dca_account = asyncio.run(execute_create_dca(input_mint, output_mint, total_in_amount, in_amount_per_cycle, cycle_frequency, min_out_amount_per_cycle, max_out_amount_per_cycle, start))
         return jsonify(dca_account)
     except ValidationError as err:
@@ -282,6 +534,28 @@ def close_dca():
     except Exception as e:
         return jsonify({"message": f"Error closing DCA account: {str(e)}"}), 500
 
+# Strategy backtests over stored price history
+@app.route('/backtest', methods=['POST'])
+@jwt_required()
+@limiter.limit("10 per minute")
+def run_backtest():
+    # numpy is only loaded by processes that actually run backtests
+    from backtester import backtest, resolve_series
+    try:
+        data = BacktestSchema().load(request.json)
+        path = resolve_series(BACKTEST_DATA_DIR, data['series'])
+        with metrics.span('barkbot_backtest_seconds'):
+            report = backtest(path, data['strategy'], data['parameters'], BACKTEST_MAX_COMBINATIONS, data['limit'], BACKTEST_MAX_CELLS)
+        return jsonify(report)
+    except ValidationError as err:
+        return jsonify(err.messages), 400
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error running backtest: {e}")
+        return jsonify({"message": f"Error running backtest: {str(e)}"}), 500
+
 # Running the Flask app
 if __name__ == '__main__':
+    services.startup()
     app.run(debug=True)
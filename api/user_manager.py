@@ -1,5 +1,7 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Boolean
+from contextlib import contextmanager
+from sqlalchemy import create_engine, inspect, text, Column, Integer, BigInteger, String, Boolean
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from cryptography.fernet import Fernet
@@ -22,15 +24,63 @@ class User(Base):
     rpc = Column(String)
     slippage = Column(String)
     priority = Column(String)
+    referrer_id = Column(Integer, index=True)
+
+class ReferralBalance(Base):
+    __tablename__ = 'referral_balances'
+    referrer_id = Column(Integer, primary_key=True)
+    mint = Column(String, primary_key=True)
+    accrued = Column(BigInteger, nullable=False, default=0)
+    # Includes pending payouts, so an in-flight transfer is never paid twice
+    paid = Column(BigInteger, nullable=False, default=0)
+
+class ReferralPayout(Base):
+    __tablename__ = 'referral_payouts'
+    id = Column(Integer, primary_key=True)
+    referrer_id = Column(Integer, nullable=False)
+    mint = Column(String, nullable=False)
+    amount = Column(BigInteger, nullable=False)
+    signature = Column(String, nullable=False, index=True)
+    last_valid_block_height = Column(BigInteger, nullable=False)
+    status = Column(String, nullable=False, default='pending', index=True)
+
+# Columns added to existing tables since their first release; create_all
+# only creates missing tables, so these are added with ALTER TABLE
+ADDED_COLUMNS = {
+    'users': [('referrer_id', 'INTEGER')],
+}
+ADDED_INDEXES = [
+    ('ix_users_referrer_id', 'users', 'referrer_id'),
+]
+
+# pg_try_advisory_lock key held by the one process settling referral payouts
+REFERRAL_SETTLEMENT_LOCK = 0x4241524b
 
 class UserManager:
     def __init__(self, encryption_key):
         self.cipher_suite = Fernet(encryption_key)
         self.engine = create_engine(os.getenv('DATABASE_URL'))
-        Base.metadata.create_all(self.engine)
         self.Session = sessionmaker(bind=self.engine)
 
-    def create_user(self, telegram_id, email, password):
+    def init_schema(self):
+        # Run once at startup rather than on every construction
+        Base.metadata.create_all(self.engine)
+        self.migrate_schema()
+
+    def migrate_schema(self):
+        postgres = self.engine.dialect.name == 'postgresql'
+        inspector = inspect(self.engine)
+        with self.engine.begin() as connection:
+            for table, columns in ADDED_COLUMNS.items():
+                existing = {column['name'] for column in inspector.get_columns(table)}
+                for name, column_type in columns:
+                    if name not in existing:
+                        # IF NOT EXISTS where supported, for processes migrating concurrently
+                        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {'IF NOT EXISTS ' if postgres else ''}{name} {column_type}"))
+            for name, table, column in ADDED_INDEXES:
+                connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})"))
+
+    def create_user(self, telegram_id, email, password, referrer_id=None):
         session = self.Session()
         user = User(
             telegram_id=telegram_id,
@@ -40,6 +90,25 @@ class UserManager:
         session.add(user)
         session.commit()
         session.close()
+        if referrer_id is not None:
+            self.set_referrer(telegram_id, referrer_id)
+
+    def set_referrer(self, telegram_id, referrer_id):
+        # First referrer wins; returns False if the user is unknown, already
+        # referred, or the referrer does not exist
+        if referrer_id == telegram_id:
+            return False
+        session = self.Session()
+        try:
+            if not session.query(User.id).filter_by(telegram_id=referrer_id).first():
+                return False
+            updated = session.query(User).filter(
+                User.telegram_id == telegram_id, User.referrer_id.is_(None)
+            ).update({User.referrer_id: referrer_id})
+            session.commit()
+            return bool(updated)
+        finally:
+            session.close()
 
     def get_user_by_email(self, email):
         session = self.Session()
@@ -140,11 +209,129 @@ class UserManager:
             return self.cipher_suite.decrypt(user.private_key.encode()).decode()
         return None
 
+    def get_public_keys(self, telegram_ids):
+        session = self.Session()
+        rows = session.query(User.telegram_id, User.public_key).filter(User.telegram_id.in_(telegram_ids)).all()
+        session.close()
+        return {telegram_id: public_key for telegram_id, public_key in rows if public_key}
+
+    def get_referrers(self, telegram_ids):
+        session = self.Session()
+        rows = session.query(User.telegram_id, User.referrer_id).filter(
+            User.telegram_id.in_(telegram_ids), User.referrer_id.isnot(None)
+        ).all()
+        session.close()
+        return dict(rows)
+
+    def upsert_referral_balances(self, balances):
+        # One INSERT ... ON CONFLICT statement for the whole batch
+        rows = [
+            {'referrer_id': referrer_id, 'mint': mint, 'accrued': amount, 'paid': 0}
+            for (referrer_id, mint), amount in balances.items()
+        ]
+        insert = sqlite.insert if self.engine.dialect.name == 'sqlite' else postgresql.insert
+        statement = insert(ReferralBalance).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[ReferralBalance.referrer_id, ReferralBalance.mint],
+            set_={'accrued': ReferralBalance.accrued + statement.excluded.accrued},
+        )
+        session = self.Session()
+        session.execute(statement)
+        session.commit()
+        session.close()
+
+    def get_referral_balances(self, min_amount=0):
+        session = self.Session()
+        owed = ReferralBalance.accrued - ReferralBalance.paid
+        rows = session.query(ReferralBalance.referrer_id, ReferralBalance.mint, owed).filter(
+            owed > 0, owed >= min_amount
+        ).all()
+        session.close()
+        return {(referrer_id, mint): amount for referrer_id, mint, amount in rows}
+
+    @contextmanager
+    def settlement_lock(self):
+        # Held by one process at a time; the others skip the settlement round.
+        # A session-level lock on a dedicated connection is released if the
+        # holder dies.
+        if self.engine.dialect.name != 'postgresql':
+            yield True
+            return
+        with self.engine.connect() as connection:
+            acquired = connection.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': REFERRAL_SETTLEMENT_LOCK}).scalar()
+            connection.commit()
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': REFERRAL_SETTLEMENT_LOCK})
+                    connection.commit()
+
+    def record_referral_payouts(self, payouts, signature, last_valid_block_height):
+        # Called before the transfer is sent: the pending payout rows and the
+        # paid increment commit together, and a balance that no longer covers
+        # the amount aborts the whole batch
+        session = self.Session()
+        try:
+            for (referrer_id, mint), amount in payouts.items():
+                session.add(ReferralPayout(
+                    referrer_id=referrer_id, mint=mint, amount=amount, signature=signature,
+                    last_valid_block_height=last_valid_block_height, status='pending',
+                ))
+                updated = session.query(ReferralBalance).filter(
+                    ReferralBalance.referrer_id == referrer_id, ReferralBalance.mint == mint,
+                    ReferralBalance.accrued - ReferralBalance.paid >= amount,
+                ).update({ReferralBalance.paid: ReferralBalance.paid + amount}, synchronize_session=False)
+                if not updated:
+                    raise ValueError(f"Referral balance of {referrer_id} in {mint} does not cover {amount}")
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def get_pending_referral_payouts(self):
+        session = self.Session()
+        rows = session.query(ReferralPayout.signature, ReferralPayout.last_valid_block_height).filter_by(status='pending').distinct().all()
+        session.close()
+        return dict(rows)
+
+    def resolve_referral_payouts(self, statuses):
+        # Confirmed payouts stay paid; failed ones are released back to the
+        # balance in the same transaction. Returns the confirmed amounts.
+        signatures = [signature for signature, status in statuses.items() if status in ('confirmed', 'failed')]
+        if not signatures:
+            return {}
+        confirmed = {}
+        session = self.Session()
+        try:
+            payouts = session.query(ReferralPayout).filter(
+                ReferralPayout.signature.in_(signatures), ReferralPayout.status == 'pending'
+            ).with_for_update().all()
+            for payout in payouts:
+                payout.status = statuses[payout.signature]
+                key = (payout.referrer_id, payout.mint)
+                if payout.status == 'confirmed':
+                    confirmed[key] = confirmed.get(key, 0) + payout.amount
+                else:
+                    session.query(ReferralBalance).filter_by(referrer_id=payout.referrer_id, mint=payout.mint).update(
+                        {ReferralBalance.paid: ReferralBalance.paid - payout.amount}, synchronize_session=False
+                    )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        return confirmed
+
 # Example usage
 if __name__ == "__main__":
     # Replace this with your actual encryption key
     encryption_key = Fernet.generate_key()
     user_manager = UserManager(encryption_key)
+    user_manager.init_schema()
 
     # Create a new user
     user_manager.create_user(123456, "user@example.com", "password")
@@ -0,0 +1,347 @@
+import csv
+import logging
+import os
+import time
+
+import numpy as np
+
+# Strategy backtester for Jupiter DCA schedules and limit/stop orders. A price
+# series (input-token price of one output token, e.g. SOL per BARK) is loaded
+# once and memory-mapped; each strategy is then evaluated for a whole
+# parameter grid with array operations. Cycles of every DCA combination that
+# shares a frequency and start read the same gathered price slice, and order
+# triggers are found with binary search on running minima/maxima, so cost
+# grows with the number of distinct schedules rather than combinations.
+
+TIMESTAMP_COLUMNS = ('timestamp', 'time', 'ts', 'date')
+PRICE_COLUMNS = ('price', 'close', 'c')
+# Band-filtered DCA combinations are evaluated in blocks of at most this many cells
+MAX_BLOCK_CELLS = 4000000
+# Cycles a DCA schedule may run; beyond this total_in_amount / per_cycle is clipped
+MAX_CYCLES_PER_SCHEDULE = 10000000
+# Default bound on the price cells one backtest may touch: a year of 1m prices
+# is ~525k cells per DCA schedule or per distinct order start
+MAX_WORK_CELLS = 50000000
+
+series_cache = {}
+
+
+class PriceSeries:
+    def __init__(self, timestamps, prices, path=None):
+        if len(timestamps) != len(prices) or not len(prices):
+            raise ValueError("A price series needs matching, non-empty timestamp and price columns")
+        self.timestamps = timestamps
+        self.prices = prices
+        self.path = path
+
+    def __len__(self):
+        return len(self.prices)
+
+    @property
+    def final_price(self):
+        return float(self.prices[-1])
+
+    @property
+    def step(self):
+        # Typical spacing of the series in seconds
+        if not hasattr(self, 'median_step'):
+            self.median_step = float(np.median(np.diff(self.timestamps))) if len(self) > 1 else 0.0
+        return self.median_step
+
+    def index_at(self, times):
+        # Index of the last price at or before each time
+        return np.clip(np.searchsorted(self.timestamps, times, side='right') - 1, 0, len(self) - 1)
+
+
+def find_column(names, candidates):
+    lowered = [name.strip().lower() for name in names]
+    for candidate in candidates:
+        if candidate in lowered:
+            return lowered.index(candidate)
+    raise ValueError(f"None of the columns {', '.join(names)} is one of {', '.join(candidates)}")
+
+
+def read_csv_columns(path):
+    with open(path, newline='') as source:
+        header = next(csv.reader(source))
+    columns = (find_column(header, TIMESTAMP_COLUMNS), find_column(header, PRICE_COLUMNS))
+    data = np.loadtxt(path, delimiter=',', skiprows=1, usecols=columns, dtype=np.float64, ndmin=2)
+    return data[:, 0], data[:, 1]
+
+
+def read_parquet_columns(path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Reading Parquet price series requires pyarrow")
+    table = pq.read_table(path, memory_map=True)
+    names = table.column_names
+    timestamps = table.column(names[find_column(names, TIMESTAMP_COLUMNS)])
+    prices = table.column(names[find_column(names, PRICE_COLUMNS)])
+    if str(timestamps.type).startswith('timestamp'):
+        timestamps = timestamps.cast('int64')
+    return timestamps.to_numpy().astype(np.float64), prices.to_numpy().astype(np.float64)
+
+
+def load_price_series(path):
+    # CSV and Parquet files are parsed once into a sibling .npy cache, which
+    # is memory-mapped from then on; a year of 1m data maps in milliseconds
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+    cached = series_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    if path.endswith('.npy'):
+        data = np.load(path, mmap_mode='r')
+    else:
+        cache_path = path + '.npy'
+        if not os.path.exists(cache_path) or os.path.getmtime(cache_path) < mtime:
+            reader = read_parquet_columns if path.endswith('.parquet') else read_csv_columns
+            timestamps, prices = reader(path)
+            order = np.argsort(timestamps, kind='stable')
+            data = np.column_stack([timestamps[order], prices[order]])
+            try:
+                np.save(cache_path, data)
+            except OSError as e:
+                logging.warning(f"Could not write price cache {cache_path}: {e}")
+                series = PriceSeries(data[:, 0], data[:, 1], path)
+                series_cache[path] = (mtime, series)
+                return series
+        data = np.load(cache_path, mmap_mode='r')
+    timestamps = data[:, 0]
+    if len(timestamps) and timestamps[-1] > 1e11:
+        # Millisecond epochs
+        timestamps = timestamps / 1000
+    series = PriceSeries(timestamps, data[:, 1], path)
+    series_cache[path] = (mtime, series)
+    return series
+
+
+def parameter_grid(**values):
+    # Cartesian product of the given value lists as aligned 1-D arrays
+    names = list(values)
+    mesh = np.meshgrid(*(np.asarray(values[name], dtype=np.float64) for name in names), indexing='ij')
+    return {name: axis.ravel() for name, axis in zip(names, mesh)}
+
+
+def summarize(spent, received, fills, final_price):
+    spent = np.asarray(spent, dtype=np.float64)
+    received = np.asarray(received, dtype=np.float64)
+    average_entry = np.divide(spent, received, out=np.full_like(spent, np.nan), where=received > 0)
+    pnl = received * final_price - spent
+    pnl_pct = np.divide(pnl, spent, out=np.zeros_like(spent), where=spent > 0)
+    return {
+        'fills': np.asarray(fills, dtype=np.int64),
+        'spent': spent,
+        'received': received,
+        'average_entry': average_entry,
+        'pnl': pnl,
+        'pnl_pct': pnl_pct,
+    }
+
+
+def check_work(cells, max_cells):
+    if max_cells is not None and cells > max_cells:
+        raise ValueError(f"Backtest would scan {cells} price cells; the limit is {max_cells}")
+
+
+def backtest_dca(series, cycle_frequency, in_amount_per_cycle, total_in_amount,
+                 min_out_amount_per_cycle=0, max_out_amount_per_cycle=0, start=0, max_cells=None):
+    # Parameters mirror /create_dca and broadcast against each other. Times
+    # are seconds (start is an offset from the first price); a cycle only
+    # fills when its output lands inside [min_out, max_out], 0 meaning no bound.
+    # Each schedule scans one price per cycle, plus one per cycle for every
+    # banded combination on it; max_cells bounds the total.
+    frequency, per_cycle, total, min_out, max_out, start = np.broadcast_arrays(*(
+        np.atleast_1d(np.asarray(value, dtype=np.float64))
+        for value in (cycle_frequency, in_amount_per_cycle, total_in_amount,
+                      min_out_amount_per_cycle, max_out_amount_per_cycle, start)
+    ))
+    if np.any(frequency <= 0) or np.any(per_cycle <= 0):
+        raise ValueError("Cycle frequency and per-cycle amount must be positive")
+    if np.any(frequency < series.step):
+        # Several cycles would read the same price
+        raise ValueError(f"Cycle frequency must be at least the series step of {series.step:g} seconds")
+    count = frequency.size
+    # The tolerance keeps 0.3 / 0.1 from flooring to 2 cycles
+    cycles = np.minimum(np.floor(total / per_cycle * (1 + 1e-12)), MAX_CYCLES_PER_SCHEDULE).astype(np.int64)
+    # A cycle fills while its price is inside [per_cycle / max_out, per_cycle / min_out]
+    low = np.divide(per_cycle, max_out, out=np.zeros(count), where=max_out > 0)
+    high = np.divide(per_cycle, min_out, out=np.full(count, np.inf), where=min_out > 0)
+    banded = (low > 0) | np.isfinite(high)
+
+    fills = np.zeros(count, dtype=np.int64)
+    received = np.zeros(count)
+    first = float(series.timestamps[0])
+    span = float(series.timestamps[-1]) - first
+    schedules = np.stack([frequency, start], axis=1)
+    unique_schedules, schedule_of = np.unique(schedules, axis=0, return_inverse=True)
+    schedule_of = schedule_of.ravel()
+    steps, offsets = unique_schedules[:, 0], unique_schedules[:, 1]
+    lengths = np.where(offsets <= span, np.floor(np.maximum(span - offsets, 0.0) / steps) + 1, 0).astype(np.int64)
+    longest = np.zeros(len(unique_schedules), dtype=np.int64)
+    np.maximum.at(longest, schedule_of, cycles)
+    lengths = np.minimum(lengths, longest)
+    banded_rows = np.bincount(schedule_of, weights=banded, minlength=len(unique_schedules))
+    check_work(int((lengths * (1 + banded_rows)).sum()), max_cells)
+    for schedule, (step, offset) in enumerate(unique_schedules):
+        members = np.flatnonzero(schedule_of == schedule)
+        length = int(lengths[schedule])
+        if length <= 0:
+            continue
+        prices = np.asarray(series.prices)[series.index_at(first + offset + step * np.arange(length))]
+        inverse = 1.0 / prices
+
+        plain = members[~banded[members]]
+        if plain.size:
+            # Unbounded cycles: every scheduled cycle fills, so prefix sums suffice
+            prefix = np.concatenate([[0.0], np.cumsum(inverse)])
+            taken = np.minimum(cycles[plain], length)
+            fills[plain] = taken
+            received[plain] = per_cycle[plain] * prefix[taken]
+
+        bounded = members[banded[members]]
+        block = max(1, MAX_BLOCK_CELLS // length)
+        for i in range(0, bounded.size, block):
+            rows = bounded[i:i + block]
+            scheduled = np.arange(length)[None, :] < np.minimum(cycles[rows], length)[:, None]
+            inside = scheduled & (prices[None, :] >= low[rows, None]) & (prices[None, :] <= high[rows, None])
+            fills[rows] = inside.sum(axis=1)
+            received[rows] = per_cycle[rows] * (inside * inverse[None, :]).sum(axis=1)
+    result = summarize(per_cycle * fills, received, fills, series.final_price)
+    result['cycles'] = cycles
+    return result
+
+
+def first_trigger(series, start, trigger, expiry, rising, max_cells=None):
+    # Index of the first price at or after start that reaches trigger (from
+    # below when rising, from above otherwise), or -1; a start past the last
+    # price never fills. Running extremes are monotonic, so each combination
+    # is one binary search; every distinct start scans the series from there
+    # once.
+    start, trigger, expiry = np.broadcast_arrays(*(np.atleast_1d(np.asarray(value, dtype=np.float64)) for value in (start, trigger, expiry)))
+    hits = np.full(start.size, -1, dtype=np.int64)
+    first = float(series.timestamps[0])
+    begin = np.searchsorted(series.timestamps, first + start, side='left')
+    prices = np.asarray(series.prices)
+    begins = np.unique(begin[begin < len(prices)])
+    check_work(int((len(prices) - begins).sum()), max_cells)
+    for index in begins:
+        members = np.flatnonzero(begin == index)
+        window = prices[index:]
+        if rising:
+            extremes = np.maximum.accumulate(window)
+            found = np.searchsorted(extremes, trigger[members], side='left')
+        else:
+            extremes = -np.minimum.accumulate(window)
+            found = np.searchsorted(extremes, -trigger[members], side='left')
+        found = found + index
+        inside = found < len(prices)
+        deadline = first + start[members] + expiry[members]
+        inside[inside] &= np.asarray(series.timestamps)[found[inside]] <= deadline[inside]
+        hits[members] = np.where(inside, found, -1)
+    return hits
+
+
+def backtest_limit(series, in_amount, out_amount, start=0, expiry=np.inf, max_cells=None):
+    # Parameters mirror /limit_order: buy out_amount for in_amount once the
+    # price drops to in_amount / out_amount, before start + expiry seconds
+    in_amount, out_amount = np.broadcast_arrays(np.atleast_1d(np.asarray(in_amount, dtype=np.float64)), np.asarray(out_amount, dtype=np.float64))
+    if np.any(in_amount <= 0) or np.any(out_amount <= 0):
+        raise ValueError("Limit order amounts must be positive")
+    limit_price = in_amount / out_amount
+    hits = first_trigger(series, start, limit_price, expiry, rising=False, max_cells=max_cells)
+    filled = hits >= 0
+    result = summarize(np.where(filled, in_amount, 0.0), np.where(filled, out_amount, 0.0), filled, series.final_price)
+    result['limit_price'] = limit_price
+    result['fill_time'] = np.where(filled, np.asarray(series.timestamps)[np.maximum(hits, 0)], np.nan)
+    return result
+
+
+def backtest_stop(series, in_amount, stop_price, start=0, expiry=np.inf, max_cells=None):
+    # Buy stop: spend in_amount at the first price at or above stop_price
+    in_amount, stop_price = np.broadcast_arrays(np.atleast_1d(np.asarray(in_amount, dtype=np.float64)), np.asarray(stop_price, dtype=np.float64))
+    if np.any(in_amount <= 0) or np.any(stop_price <= 0):
+        raise ValueError("Stop order amount and price must be positive")
+    hits = first_trigger(series, start, stop_price, expiry, rising=True, max_cells=max_cells)
+    filled = hits >= 0
+    fill_price = np.asarray(series.prices)[np.maximum(hits, 0)]
+    received = np.where(filled, in_amount / fill_price, 0.0)
+    result = summarize(np.where(filled, in_amount, 0.0), received, filled, series.final_price)
+    result['fill_time'] = np.where(filled, np.asarray(series.timestamps)[np.maximum(hits, 0)], np.nan)
+    return result
+
+
+STRATEGIES = {'dca': backtest_dca, 'limit': backtest_limit, 'stop': backtest_stop}
+# Required and optional grid parameters of each strategy
+STRATEGY_PARAMETERS = {
+    'dca': (('cycle_frequency', 'in_amount_per_cycle', 'total_in_amount'),
+            ('min_out_amount_per_cycle', 'max_out_amount_per_cycle', 'start')),
+    'limit': (('in_amount', 'out_amount'), ('start', 'expiry')),
+    'stop': (('in_amount', 'stop_price'), ('start', 'expiry')),
+}
+
+
+def run_grid(series, strategy, max_cells=None, **values):
+    grid = parameter_grid(**values)
+    return grid, STRATEGIES[strategy](series, max_cells=max_cells, **grid)
+
+
+def ranked_rows(grid, result, limit=10, key='pnl'):
+    # Best parameter sets first, as plain dicts ready for JSON or a chat reply
+    order = np.argsort(-np.nan_to_num(result[key], nan=-np.inf), kind='stable')[:limit]
+    rows = []
+    for i in order:
+        row = {name: float(values[i]) for name, values in grid.items()}
+        for name, values in result.items():
+            value = values[i].item()
+            row[name] = None if isinstance(value, float) and not np.isfinite(value) else value
+        rows.append(row)
+    return rows
+
+
+def resolve_series(data_dir, name):
+    # Series are named files inside data_dir; names never reach other paths
+    if not name or os.path.basename(name) != name or name.startswith('.'):
+        raise ValueError(f"Invalid price series name: {name!r}")
+    path = os.path.join(data_dir, name)
+    if not os.path.isfile(path):
+        raise ValueError(f"Unknown price series: {name}")
+    return path
+
+
+def parameter_values(name, value):
+    try:
+        values = np.atleast_1d(np.asarray(value, dtype=np.float64))
+    except (TypeError, ValueError):
+        values = None
+    if values is None or values.ndim != 1:
+        raise ValueError(f"Parameter {name} must be a number or a flat list of numbers")
+    if not np.all(np.isfinite(values)):
+        raise ValueError(f"Parameter {name} must be finite")
+    return values
+
+
+def backtest(path, strategy, parameters, max_combinations=10000, limit=10, max_cells=MAX_WORK_CELLS):
+    # Validated entry point shared by the bot command and the API endpoint
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy {strategy!r}; use one of {', '.join(STRATEGIES)}")
+    required, optional = STRATEGY_PARAMETERS[strategy]
+    unknown = set(parameters) - set(required) - set(optional)
+    if unknown:
+        raise ValueError(f"Unknown {strategy} parameters: {', '.join(sorted(unknown))}")
+    missing = [name for name in required if name not in parameters]
+    if missing:
+        raise ValueError(f"Missing {strategy} parameters: {', '.join(missing)}")
+    values = {name: parameter_values(name, value) for name, value in parameters.items()}
+    combinations = int(np.prod([value.size for value in values.values()]))
+    if combinations > max_combinations:
+        raise ValueError(f"Grid has {combinations} combinations; the limit is {max_combinations}")
+    start = time.perf_counter()
+    grid, result = run_grid(load_price_series(path), strategy, max_cells, **values)
+    return {
+        'strategy': strategy,
+        'combinations': combinations,
+        'seconds': time.perf_counter() - start,
+        'results': ranked_rows(grid, result, limit),
+    }
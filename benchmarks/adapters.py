@@ -0,0 +1,67 @@
+# Thin stand-ins for the bot services whose client modules (user_management,
+# jupiter_trading_api, solana_api) are not part of this repository.
+# BenchmarkContext registers them in place of those factories. They still go
+# over the wire: users live in the benchmark's SQLite database behind the
+# API's SQLAlchemy UserManager, balances come from the fake Solana RPC through
+# the real solana-py client, and prices come from the fake Jupiter over HTTP.
+
+LAMPORTS_PER_SOL = 1000000000
+
+
+def user_manager(encryption_key):
+    # The API's UserManager has every method the bot handlers call
+    from user_manager import UserManager
+    manager = UserManager(encryption_key)
+    manager.init_schema()
+    return manager
+
+
+def seed_users(manager, user_ids):
+    # Verified users with a wallet, for scenarios that start past onboarding
+    from base58 import b58encode
+    from solders.keypair import Keypair
+    for user_id in user_ids:
+        keypair = Keypair()
+        manager.save_wallet(user_id, {'public_key': str(keypair.pubkey()), 'private_key': b58encode(bytes(keypair)).decode()})
+        manager.verify_user(user_id)
+
+
+class RPCSolanaAPI:
+    def __init__(self, rpc_url):
+        from solana.rpc.api import Client
+        self.client = Client(rpc_url)
+
+    def get_balance(self, public_key):
+        from solders.pubkey import Pubkey
+        return self.client.get_balance(Pubkey.from_string(public_key)).value / LAMPORTS_PER_SOL
+
+
+class JupiterTradingAPI:
+    # Market data and token lookups priced by the Jupiter price endpoint;
+    # token balances are read from the RPC node
+    def __init__(self, jupiter_url, rpc_url, mint):
+        import httpx
+        self.jupiter_url = jupiter_url
+        self.mint = mint
+        self.http = httpx.Client(timeout=30.0)
+        self.solana = RPCSolanaAPI(rpc_url)
+
+    def get_price(self, mint):
+        response = self.http.get(f"{self.jupiter_url}/price", params={'ids': mint})
+        response.raise_for_status()
+        return float(response.json()['data'][mint]['price'])
+
+    def get_market_data(self):
+        price = self.get_price(self.mint)
+        return {'latest_price': price, '24h_volume': 0, 'market_cap': 0, '24h_change': 0}
+
+    def get_token_info(self, token_address):
+        return {'name': token_address[:8], 'symbol': token_address[:4].upper(), 'price': self.get_price(token_address)}
+
+    def get_token_balance(self, public_key, mint):
+        from solana.rpc.types import TokenAccountOpts
+        from solders.pubkey import Pubkey
+        accounts = self.solana.client.get_token_accounts_by_owner_json_parsed(
+            Pubkey.from_string(public_key), TokenAccountOpts(mint=Pubkey.from_string(mint))
+        ).value
+        return sum(float(account.account.data.parsed['info']['tokenAmount']['uiAmount'] or 0) for account in accounts)
@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from backtester import load_price_series, run_grid, series_cache
+from benchmarks.harness import environment_info
+
+# Backtester throughput: 1000-combination DCA, limit and stop grids over a
+# synthetic year of 1-minute prices, plus the cost of the first CSV parse
+# against later memory-mapped loads.
+
+GRIDS = {
+    'dca': {
+        'cycle_frequency': [60, 120, 300, 600, 900, 1800, 3600, 14400, 86400, 604800],
+        'in_amount_per_cycle': [0.01, 0.05, 0.1, 0.5, 1.0],
+        'total_in_amount': [10, 50, 100, 500],
+        'min_out_amount_per_cycle': [0, 100, 500, 1000, 5000],
+    },
+    'limit': {
+        'in_amount': [1, 2, 5, 10],
+        'out_amount': list(np.linspace(5000, 20000, 50)),
+        'start': [0, 86400, 30 * 86400, 90 * 86400, 180 * 86400],
+    },
+    'stop': {
+        'in_amount': [1, 2, 5, 10],
+        'stop_price': list(np.linspace(0.00005, 0.0002, 50)),
+        'start': [0, 86400, 30 * 86400, 90 * 86400, 180 * 86400],
+    },
+}
+
+
+def write_series(path, minutes, seed):
+    rng = np.random.default_rng(seed)
+    timestamps = 1700000000 + 60 * np.arange(minutes)
+    prices = np.exp(np.cumsum(rng.normal(0, 0.001, minutes))) * 0.0001
+    np.savetxt(path, np.column_stack([timestamps, prices]), delimiter=',', header='timestamp,price', comments='', fmt=['%d', '%.10g'])
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run(minutes, seed, repeats):
+    results = {'benchmark': 'backtest', 'environment': environment_info(), 'minutes': minutes, 'results': {}}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'prices.csv')
+        write_series(path, minutes, seed)
+        series, parse_seconds = timed(load_price_series, path)
+        series_cache.clear()
+        series, mmap_seconds = timed(load_price_series, path)
+        results['results']['load'] = {'csv_parse_seconds': parse_seconds, 'memory_mapped_seconds': mmap_seconds}
+        for strategy, grid in GRIDS.items():
+            samples = []
+            for _ in range(repeats):
+                (parameters, result), seconds = timed(run_grid, series, strategy, **grid)
+                samples.append(seconds)
+            results['results'][strategy] = {
+                'combinations': len(next(iter(parameters.values()))),
+                'seconds': min(samples),
+                'filled_combinations': int((result['fills'] > 0).sum()),
+            }
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the BarkBOT strategy backtester")
+    parser.add_argument('--minutes', type=int, default=525600, help="Length of the synthetic 1m series (default: one year)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(run(args.minutes, args.seed, args.repeats), indent=2))
@@ -0,0 +1,82 @@
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from portfolio import SOL_MINT, value_holdings, value_positions
+
+# Portfolio valuation throughput: the vectorized pass in portfolio.py against
+# a per-token Python loop, for synthetic wallets holding a random subset of a
+# token universe.
+
+
+def build_holdings(wallet_count, mint_count, tokens_per_wallet, seed):
+    rng = random.Random(seed)
+    mints = [SOL_MINT] + [f"mint{i:05d}" for i in range(mint_count - 1)]
+    holdings = []
+    for _ in range(wallet_count):
+        held = rng.sample(mints, min(tokens_per_wallet, len(mints)))
+        holdings.append({mint: rng.uniform(1, 10000) for mint in held})
+    prices = {mint: rng.uniform(0.000001, 2) for mint in mints}
+    cost_basis = {mint: price * rng.uniform(0.5, 1.5) for mint, price in prices.items()}
+    return holdings, prices, cost_basis
+
+
+def loop_valuation(holdings, prices, cost_basis):
+    wallet_value = []
+    wallet_pnl = []
+    for balances in holdings:
+        total = 0.0
+        pnl = 0.0
+        values = {}
+        for mint, amount in balances.items():
+            values[mint] = amount * prices.get(mint, 0.0)
+            total += values[mint]
+            if mint in cost_basis:
+                pnl += values[mint] - amount * cost_basis[mint]
+        allocation = {mint: value / total if total else 0.0 for mint, value in values.items()}
+        wallet_value.append(total)
+        wallet_pnl.append(pnl)
+    return wallet_value, wallet_pnl
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def run(wallet_counts, mint_count, tokens_per_wallet, seed):
+    results = []
+    for wallet_count in wallet_counts:
+        holdings, prices, cost_basis = build_holdings(wallet_count, mint_count, tokens_per_wallet, seed)
+        vectorized, vectorized_seconds = timed(value_holdings, holdings, prices, cost_basis)
+        # The valuation pass alone, with positions already flattened into arrays
+        _, arrays_seconds = timed(
+            value_positions, vectorized['wallet_index'], vectorized['amount'],
+            vectorized['price'], vectorized['cost_price'], wallet_count,
+        )
+        (loop_values, _), loop_seconds = timed(loop_valuation, holdings, prices, cost_basis)
+        assert np.allclose(vectorized['wallet_value'], loop_values)
+        results.append({
+            'wallets': wallet_count,
+            'positions': int(vectorized['amount'].size),
+            'vectorized_seconds': vectorized_seconds,
+            'valuation_pass_seconds': arrays_seconds,
+            'loop_seconds': loop_seconds,
+            'wallets_per_sec': wallet_count / vectorized_seconds,
+        })
+    return {'benchmark': 'portfolio', 'mints': mint_count, 'tokens_per_wallet': tokens_per_wallet, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark BarkBOT portfolio valuation")
+    parser.add_argument('--wallets', default='100,1000,10000', help="Comma-separated wallet counts")
+    parser.add_argument('--mints', type=int, default=2000, help="Size of the token universe")
+    parser.add_argument('--tokens-per-wallet', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    wallet_counts = [int(count) for count in args.wallets.split(',')]
+    print(json.dumps(run(wallet_counts, args.mints, args.tokens_per_wallet, args.seed), indent=2))
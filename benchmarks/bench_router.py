@@ -0,0 +1,81 @@
+import argparse
+import json
+import time
+from types import SimpleNamespace
+
+from router import Router
+
+# Routing throughput: the Router's hash/trie lookups against telebot-style
+# linear predicate scanning, for a growing number of registered routes.
+
+
+def build_routes(route_count):
+    texts = [f"button {i}" for i in range(route_count)]
+    callbacks = [f"action_{i}" for i in range(route_count)]
+    return texts, callbacks
+
+
+def build_router(texts, callbacks):
+    router = Router()
+    handler = lambda update: None
+    for text in texts:
+        router.text(text)(handler)
+    for data in callbacks:
+        router.callback(data)(handler)
+    router.callback_prefix('help_')(handler)
+    return router
+
+
+def build_linear(texts, callbacks):
+    handler = lambda update: None
+    message_handlers = [(lambda message, text=text: message.text == text, handler) for text in texts]
+    callback_handlers = [(lambda call, data=data: call.data == data, handler) for data in callbacks]
+    callback_handlers.append((lambda call: call.data.startswith('help_'), handler))
+    return message_handlers, callback_handlers
+
+
+def linear_dispatch(handlers, update):
+    for func, handler in handlers:
+        if func(update):
+            handler(update)
+            return True
+    return False
+
+
+def measure(dispatch, updates):
+    start = time.perf_counter()
+    for update in updates:
+        dispatch(update)
+    elapsed = time.perf_counter() - start
+    return len(updates) / elapsed
+
+
+def run(route_counts, iterations):
+    results = []
+    for route_count in route_counts:
+        texts, callbacks = build_routes(route_count)
+        router = build_router(texts, callbacks)
+        message_handlers, callback_handlers = build_linear(texts, callbacks)
+        # Cycle through all routes so the linear scan pays its average cost
+        messages = [SimpleNamespace(text=texts[i % route_count]) for i in range(iterations)]
+        calls = [SimpleNamespace(data=callbacks[i % route_count]) for i in range(iterations)]
+        help_calls = [SimpleNamespace(data='help_trading') for _ in range(iterations)]
+        results.append({
+            'routes': route_count,
+            'router_messages_per_sec': measure(router.dispatch_message, messages),
+            'linear_messages_per_sec': measure(lambda m: linear_dispatch(message_handlers, m), messages),
+            'router_callbacks_per_sec': measure(router.dispatch_callback, calls),
+            'linear_callbacks_per_sec': measure(lambda c: linear_dispatch(callback_handlers, c), calls),
+            'router_prefix_callbacks_per_sec': measure(router.dispatch_callback, help_calls),
+            'linear_prefix_callbacks_per_sec': measure(lambda c: linear_dispatch(callback_handlers, c), help_calls),
+        })
+    return {'benchmark': 'router', 'iterations': iterations, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark BarkBOT update routing throughput")
+    parser.add_argument('--routes', default='10,100,1000', help="Comma-separated route counts")
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+    route_counts = [int(count) for count in args.routes.split(',')]
+    print(json.dumps(run(route_counts, args.iterations), indent=2))
@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+import time
+
+from benchmarks.harness import environment_info
+from shard_runtime import ShardedRuntime
+
+# Sharded runtime scaling: updates per second through the front process and
+# N worker processes, for a handler doing the CPU-bound work of a typical
+# update (keypair generation, base58, Fernet encrypt/decrypt, formatting).
+# Throughput should grow with the shard count up to the number of cores.
+
+
+def cpu_handler():
+    from base58 import b58encode
+    from cryptography.fernet import Fernet
+    from solders.keypair import Keypair
+
+    cipher = Fernet(Fernet.generate_key())
+
+    def handle(update):
+        keypair = Keypair()
+        secret = b58encode(bytes(keypair)).decode()
+        token = cipher.encrypt(secret.encode())
+        assert cipher.decrypt(token).decode() == secret
+        text = f"Wallet {keypair.pubkey()} for chat {update['message']['chat']['id']}"
+        return text.upper()
+    return handle
+
+
+def build_updates(count, chats):
+    return [
+        {'update_id': i, 'message': {'message_id': i, 'chat': {'id': 1000 + i % chats}, 'text': '/start'}}
+        for i in range(count)
+    ]
+
+
+def run(shard_counts, updates, chats, threads):
+    batch = build_updates(updates, chats)
+    results = []
+    for shards in shard_counts:
+        runtime = ShardedRuntime(shards, handler_factory=cpu_handler, threads=threads).start()
+        try:
+            # Warm up so process start and imports are not timed
+            for update in batch[:shards * 10]:
+                runtime.dispatch(update)
+            runtime.wait_idle()
+            start = time.perf_counter()
+            for update in batch:
+                runtime.dispatch(update)
+            runtime.wait_idle()
+            elapsed = time.perf_counter() - start
+            status = runtime.shard_status()
+        finally:
+            runtime.stop()
+        results.append({
+            'shards': shards,
+            'updates_per_sec': updates / elapsed,
+            'seconds': elapsed,
+            'per_shard_processed': [shard['processed'] for shard in status],
+        })
+    baseline = results[0]['updates_per_sec']
+    for result in results:
+        result['speedup'] = result['updates_per_sec'] / baseline
+    return {'benchmark': 'shards', 'environment': environment_info(), 'updates': updates, 'chats': chats, 'results': results}
+
+
+if __name__ == '__main__':
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Benchmark BarkBOT sharded runtime scaling")
+    parser.add_argument('--shards', default=','.join(str(n) for n in sorted({1, 2, 4, cores}) if n <= cores),
+                        help="Comma-separated shard counts (default: powers of two up to the core count)")
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--chats', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=1, help="Handler threads per worker")
+    args = parser.parse_args()
+    shard_counts = [int(count) for count in args.shards.split(',')]
+    print(json.dumps(run(shard_counts, args.updates, args.chats, args.threads), indent=2))
@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.harness import environment_info
+from benchmarks.scenarios import ROOT, BenchmarkContext
+
+# Cold-start benchmark: import time of bot.py and api/app.py, and the time
+# from interpreter start to the first update being answered, each measured in
+# a fresh interpreter.
+
+IMPORT_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - start}}))
+"""
+
+FIRST_UPDATE_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import telebot
+telebot.apihelper.API_URL = {api_url!r}
+import bot
+bot.services.startup()
+bot.bot.threaded = False
+update = telebot.types.Update.de_json({update!r})
+bot.bot.process_new_updates([update])
+print(json.dumps({{'seconds': time.perf_counter() - start}}))
+"""
+
+
+def run_script(script, cwd):
+    completed = subprocess.run([sys.executable, '-c', script], cwd=cwd, capture_output=True, text=True, env=os.environ.copy())
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'failed')
+    return json.loads(completed.stdout.strip().splitlines()[-1])['seconds']
+
+
+def measure(script, cwd, runs):
+    try:
+        samples = [run_script(script, cwd) for _ in range(runs)]
+    except Exception as e:
+        return {'error': str(e)}
+    return {
+        'runs': runs,
+        'median_ms': statistics.median(samples) * 1000,
+        'min_ms': min(samples) * 1000,
+        'max_ms': max(samples) * 1000,
+    }
+
+
+def run(runs):
+    results = {'benchmark': 'startup', 'environment': environment_info(), 'results': {}}
+    with BenchmarkContext() as context:
+        update = {
+            'update_id': 1,
+            'message': {
+                'message_id': 1, 'date': 0, 'text': '/help',
+                'chat': {'id': 1, 'type': 'private'},
+                'from': {'id': 1, 'is_bot': False, 'first_name': 'bench'},
+            },
+        }
+        results['results']['import_bot'] = measure(IMPORT_SCRIPT.format(module='bot'), ROOT, runs)
+        results['results']['import_app'] = measure(IMPORT_SCRIPT.format(module='app'), os.path.join(ROOT, 'api'), runs)
+        results['results']['time_to_first_update'] = measure(
+            FIRST_UPDATE_SCRIPT.format(api_url=context.telegram.api_url(), update=update), ROOT, runs
+        )
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark BarkBOT cold start")
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.runs), indent=2))
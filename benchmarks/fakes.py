@@ -0,0 +1,255 @@
+import base64
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from base58 import b58encode
+
+# In-process stand-ins for the Telegram Bot API, the Jupiter API and a Solana
+# JSON-RPC node. Each server runs on a random localhost port in a daemon
+# thread and can inject latency and errors so benchmarks exercise the real
+# HTTP clients used by bot.py and api/app.py.
+
+
+class FakeServer:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def delay(self):
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def should_fail(self):
+        with self.lock:
+            self.requests += 1
+            fail = self.error_rate > 0 and self.random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        return fail
+
+    def handle(self, method, path, query, body):
+        # Subclasses answer their API; anything they do not know is a 404
+        return 404, {'error': f"No route for {method} {path}"}
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def dispatch(self, method):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                body = decode_body(raw, self.headers.get('Content-Type', ''))
+                query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+                fake.delay()
+                status, payload = fake.handle(method, parsed.path, query, body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.dispatch('GET')
+
+            def do_POST(self):
+                self.dispatch('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def decode_body(raw, content_type):
+    if not raw:
+        return {}
+    if 'application/json' in content_type:
+        return json.loads(raw)
+    if 'application/x-www-form-urlencoded' in content_type:
+        return {key: values[-1] for key, values in parse_qs(raw.decode()).items()}
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return {}
+
+
+def fake_signature():
+    return b58encode(os.urandom(64)).decode()
+
+
+class FakeTelegram(FakeServer):
+    # Serves /bot<token>/<method> like api.telegram.org
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.sent = deque(maxlen=100000)
+        # Texts sent to each chat, so a benchmark can check what the bot answered
+        self.replies = {}
+        self.updates = deque()
+        self.message_id = 0
+
+    def api_url(self):
+        # Format string expected by telebot.apihelper.API_URL
+        return self.url + "/bot{0}/{1}"
+
+    def push_update(self, update):
+        self.updates.append(update)
+
+    def replies_to(self, chat_id):
+        with self.lock:
+            return list(self.replies.get(chat_id, ()))
+
+    def handle(self, method, path, query, body):
+        if self.should_fail():
+            return 500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'}
+        api_method = path.rsplit('/', 1)[-1]
+        params = dict(query, **body)
+        if api_method == 'getMe':
+            return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'BarkBOT', 'username': 'BarkBot'}}
+        if api_method == 'getUpdates':
+            offset = int(params.get('offset') or 0)
+            while self.updates and self.updates[0]['update_id'] < offset:
+                self.updates.popleft()
+            limit = int(params.get('limit') or 100)
+            return 200, {'ok': True, 'result': list(self.updates)[:limit]}
+        if api_method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params.get('chat_id') or 0)
+            with self.lock:
+                self.message_id += 1
+                message_id = self.message_id
+                self.replies.setdefault(chat_id, []).append(params.get('text', ''))
+            self.sent.append(params)
+            return 200, {'ok': True, 'result': {
+                'message_id': message_id, 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text', ''),
+            }}
+        return 200, {'ok': True, 'result': True}
+
+
+class FakeJupiter(FakeServer):
+    # Quote, swap and price endpoints of the Jupiter API
+    def __init__(self, price=0.0001, **kwargs):
+        super().__init__(**kwargs)
+        self.price = price
+
+    def handle(self, method, path, query, body):
+        if self.should_fail():
+            return 500, {'error': 'Injected error'}
+        if path.endswith('/quote'):
+            amount = int(query.get('amount', 0))
+            return 200, {
+                'inputMint': query.get('inputMint'), 'outputMint': query.get('outputMint'),
+                'inAmount': str(amount), 'outAmount': str(int(amount / self.price)),
+                'otherAmountThreshold': str(int(amount / self.price * 0.99)),
+                'swapMode': 'ExactIn', 'slippageBps': int(query.get('slippageBps', 50)),
+                'priceImpactPct': '0', 'routePlan': [], 'contextSlot': 1, 'timeTaken': 0.001,
+            }
+        if path.endswith('/swap'):
+            return 200, {'swapTransaction': build_swap_transaction(body.get('userPublicKey')), 'lastValidBlockHeight': 1}
+        if path.endswith('/price'):
+            ids = [mint for mint in query.get('ids', '').split(',') if mint]
+            return 200, {'data': {mint: {'id': mint, 'price': str(self.price)} for mint in ids}}
+        return 404, {'error': 'Not found'}
+
+
+def build_swap_transaction(user_public_key):
+    # An unsigned v0 transaction paying from the user's key, standing in for
+    # the route Jupiter would return
+    from solders.hash import Hash
+    from solders.message import MessageV0
+    from solders.null_signer import NullSigner
+    from solders.pubkey import Pubkey
+    from solders.system_program import TransferParams, transfer
+    from solders.transaction import VersionedTransaction
+
+    payer = Pubkey.from_string(user_public_key)
+    instruction = transfer(TransferParams(from_pubkey=payer, to_pubkey=Pubkey.new_unique(), lamports=1))
+    message = MessageV0.try_compile(payer, [instruction], [], Hash.default())
+    transaction = VersionedTransaction(message, [NullSigner(payer)])
+    return base64.b64encode(bytes(transaction)).decode()
+
+
+class FakeSolanaRPC(FakeServer):
+    # Minimal JSON-RPC node answering the calls made by the bot and API
+    def __init__(self, balance=1000000000, **kwargs):
+        super().__init__(**kwargs)
+        self.balance = balance
+        self.slot = 1
+        self.sent_transactions = 0
+
+    def context(self):
+        return {'slot': self.slot, 'apiVersion': '1.18.0'}
+
+    def handle(self, method, path, query, body):
+        if isinstance(body, list):
+            return 200, [self.rpc(request) for request in body]
+        return 200, self.rpc(body)
+
+    def rpc(self, request):
+        request_id = request.get('id')
+        if self.should_fail():
+            return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': -32005, 'message': 'Node is behind'}}
+        result = self.result(request.get('method'), request.get('params') or [])
+        return {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+    def result(self, method, params):
+        if method == 'getBalance':
+            return {'context': self.context(), 'value': self.balance}
+        if method == 'getLatestBlockhash':
+            return {'context': self.context(), 'value': {'blockhash': b58encode(os.urandom(32)).decode(), 'lastValidBlockHeight': 1000}}
+        if method == 'sendTransaction':
+            with self.lock:
+                self.sent_transactions += 1
+            return fake_signature()
+        if method == 'getSignatureStatuses':
+            statuses = [{'slot': self.slot, 'confirmations': None, 'err': None, 'confirmationStatus': 'confirmed', 'status': {'Ok': None}} for _ in params[0]]
+            return {'context': self.context(), 'value': statuses}
+        if method == 'getTokenAccountsByOwner':
+            return {'context': self.context(), 'value': []}
+        if method in ('getAccountInfo', 'getMultipleAccounts'):
+            value = None if method == 'getAccountInfo' else [None] * len(params[0])
+            return {'context': self.context(), 'value': value}
+        if method == 'getHealth':
+            return 'ok'
+        if method == 'getSlot':
+            return self.slot
+        if method == 'getBlockHeight':
+            return self.slot
+        return None
@@ -0,0 +1,88 @@
+import os
+import platform
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Drives a scenario's operations through a thread pool and summarises
+# throughput and latency percentiles as plain JSON-serialisable dicts.
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        'operations': total,
+        'errors': errors,
+        'error_rate': errors / total if total else 0.0,
+        'elapsed_s': elapsed,
+        'throughput_ops': total / elapsed if elapsed else 0.0,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.50) * 1000,
+            'p95': percentile(latencies, 0.95) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'max': (latencies[-1] if latencies else 0.0) * 1000,
+            'mean': (sum(latencies) / len(latencies) if latencies else 0.0) * 1000,
+        },
+    }
+
+
+def run_operations(operations, concurrency):
+    # list.append is atomic, so worker threads record without a lock
+    latencies = []
+    errors = []
+
+    def timed(operation):
+        start = time.perf_counter()
+        try:
+            operation()
+        except Exception as e:
+            errors.append(e)
+            return
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, operations))
+    return summarize(latencies, len(errors), time.perf_counter() - start)
+
+
+def environment_info():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(current, baseline):
+    # Relative change of throughput and p95 per scenario, for regression checks
+    deltas = {}
+    for name, result in current['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous or 'throughput_ops' not in result or 'throughput_ops' not in previous:
+            continue
+        deltas[name] = {
+            'throughput_change': ratio(result['throughput_ops'], previous['throughput_ops']),
+            'p95_change': ratio(result['latency_ms']['p95'], previous['latency_ms']['p95']),
+        }
+    return deltas
+
+
+def ratio(current, previous):
+    return (current - previous) / previous if previous else None
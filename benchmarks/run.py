@@ -0,0 +1,62 @@
+import argparse
+import json
+import logging
+import sys
+
+from benchmarks.harness import compare, environment_info
+from benchmarks.scenarios import SCENARIOS, BenchmarkContext
+
+# End-to-end load benchmark. Example:
+#   python -m benchmarks.run --requests 500 --concurrency 16 --latency-ms 20 --out bench.json
+#   python -m benchmarks.run --baseline bench.json
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run BarkBOT load and latency benchmarks against local fakes")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma-separated scenario names")
+    parser.add_argument('--requests', type=int, default=500, help="Operations per scenario")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Base latency added by every fake")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="Uniform random latency on top of the base")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of fake responses that fail")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help="Write results JSON to this file instead of stdout")
+    parser.add_argument('--baseline', help="Results JSON from an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    names = [name for name in args.scenarios.split(',') if name]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    # Handler error logging would dominate the timings under error injection
+    logging.disable(logging.ERROR)
+    results = {
+        'environment': environment_info(),
+        'config': {
+            'requests': args.requests, 'concurrency': args.concurrency, 'latency_ms': args.latency_ms,
+            'jitter_ms': args.jitter_ms, 'error_rate': args.error_rate, 'seed': args.seed,
+        },
+        'scenarios': {},
+    }
+    with BenchmarkContext(args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate, args.seed) as context:
+        for name in names:
+            try:
+                results['scenarios'][name] = SCENARIOS[name](context, args.requests, args.concurrency)
+            except Exception as e:
+                results['scenarios'][name] = {'error': f"{type(e).__name__}: {e}"}
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            results['comparison'] = compare(results, json.load(baseline_file))
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as out_file:
+            out_file.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
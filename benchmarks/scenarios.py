@@ -0,0 +1,180 @@
+import os
+import sys
+import tempfile
+
+from benchmarks import adapters
+from benchmarks.fakes import FakeJupiter, FakeSolanaRPC, FakeTelegram
+from benchmarks.harness import run_operations
+
+# Load scenarios for the real bot.py handlers and api/app.py routes. The bot
+# and the API read their configuration at import time, so BenchmarkContext
+# starts the fakes and points the environment at them before importing.
+#
+# Real layers: the telebot client, the router and handlers, the Flask app,
+# SQLAlchemy over SQLite, solana-py and httpx, all talking to the fakes over
+# localhost HTTP. The bot's user_manager, trading_api and solana_api come
+# from modules outside this repository, so they are replaced by the thin
+# adapters in benchmarks/adapters.py.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOL_MINT = 'So11111111111111111111111111111111111111112'
+BARK_MINT = 'BARKhLzdWbyZiP3LNoD9boy7MrAy4CVXEToDyYGeEBKF'
+# Bot handlers catch their own errors and answer with a message starting with this
+ERROR_REPLY_PREFIX = '❌'
+
+
+class BenchmarkContext:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=1):
+        options = {'latency': latency, 'jitter': jitter, 'error_rate': error_rate, 'seed': seed}
+        self.telegram = FakeTelegram(**options)
+        self.jupiter = FakeJupiter(**options)
+        self.rpc = FakeSolanaRPC(**options)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.bot_module = None
+        self.app_module = None
+
+    def __enter__(self):
+        self.telegram.start()
+        self.jupiter.start()
+        self.rpc.start()
+        self.configure_environment()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.telegram.stop()
+        self.jupiter.stop()
+        self.rpc.stop()
+        self.tmpdir.cleanup()
+
+    def configure_environment(self):
+        from base58 import b58encode
+        from cryptography.fernet import Fernet
+
+        database_path = os.path.join(self.tmpdir.name, 'barkbot.db')
+        os.environ.update({
+            'TELEGRAM_TOKEN': '123456:benchmark',
+            'ENCRYPTION_KEY': Fernet.generate_key().decode(),
+            'DATABASE_URL': f"sqlite:///{database_path}",
+            'JWT_SECRET_KEY': 'benchmark-secret',
+            'PRIVATE_KEY': b58encode(os.urandom(32) * 2).decode(),
+            'SOLANA_RPC_URL': self.rpc.url,
+            'SOLANA_RPC_ENDPOINT_URL': self.rpc.url,
+            'JUPITER_API_URL': self.jupiter.url,
+            'RATELIMIT_ENABLED': 'false',
+            'FEE_AUDIT_LOG': os.path.join(self.tmpdir.name, 'fee_audit.log'),
+            'JUPITER_PRICE_API_URL': f"{self.jupiter.url}/price",
+            'BARK_MINT': BARK_MINT,
+            'CANDLE_STORE_DIR': os.path.join(self.tmpdir.name, 'candles'),
+            'TOKEN_CACHE_PATH': os.path.join(self.tmpdir.name, 'token_cache.json'),
+        })
+
+    def bot(self):
+        if self.bot_module is None:
+            import telebot
+            telebot.apihelper.API_URL = self.telegram.api_url()
+            api_dir = os.path.join(ROOT, 'api')
+            if api_dir not in sys.path:
+                sys.path.insert(0, api_dir)
+            import bot
+            bot.services.register('user_manager', lambda: bot.instrument(adapters.user_manager(bot.ENCRYPTION_KEY), 'user_manager'))
+            bot.services.register('solana_api', lambda: bot.instrument(adapters.RPCSolanaAPI(self.rpc.url), 'solana_rpc'))
+            bot.services.register('trading_api', lambda: bot.instrument(adapters.JupiterTradingAPI(self.jupiter.url, self.rpc.url, BARK_MINT), 'jupiter'))
+            # Run handlers inline so each operation is timed to completion
+            bot.bot.threaded = False
+            self.bot_module = bot
+        return self.bot_module
+
+    def app(self):
+        if self.app_module is None:
+            api_dir = os.path.join(ROOT, 'api')
+            if api_dir not in sys.path:
+                sys.path.insert(0, api_dir)
+            import app
+            self.app_module = app
+        return self.app_module
+
+
+def message_update(update_id, user_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': 0, 'text': text,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'bench'},
+        },
+    }
+
+
+def checked_reply(telegram, chat_id, operation):
+    # Fails the operation if the bot answered its chat with an error message
+    def run():
+        operation()
+        for text in telegram.replies_to(chat_id):
+            if text.startswith(ERROR_REPLY_PREFIX):
+                raise RuntimeError(text)
+    return run
+
+
+def seed_chats(context, requests):
+    # Verified users with wallets for the chats bot_update_operations uses
+    adapters.seed_users(context.bot().user_manager, [100000 + i for i in range(requests)])
+
+
+def bot_update_operations(context, texts, requests):
+    import telebot
+
+    bot = context.bot()
+    # One chat per operation, so each one's replies can be checked on their own
+    updates = [
+        telebot.types.Update.de_json(message_update(i + 1, 100000 + i, texts[i % len(texts)]))
+        for i in range(requests)
+    ]
+    return [
+        checked_reply(context.telegram, update.message.chat.id, lambda update=update: bot.bot.process_new_updates([update]))
+        for update in updates
+    ]
+
+
+def onboarding_storm(context, requests, concurrency):
+    # Every update is a new user sending /start
+    return run_operations(bot_update_operations(context, ['/start'], requests), concurrency)
+
+
+def refresh_burst(context, requests, concurrency):
+    seed_chats(context, requests)
+    return run_operations(bot_update_operations(context, ['🔄 Refresh'], requests), concurrency)
+
+
+def alert_fanout(context, requests, concurrency):
+    # One price alert delivered to many chats through the real telebot client
+    bot = context.bot()
+    text = "🔔 Price alert: BARK crossed 0.0001 SOL"
+    return run_operations(
+        [lambda chat_id=chat_id: bot.bot.send_message(chat_id, text) for chat_id in range(1, requests + 1)],
+        concurrency,
+    )
+
+
+def swap_burst(context, requests, concurrency):
+    from flask_jwt_extended import create_access_token
+
+    app = context.app()
+    client = app.app.test_client()
+    with app.app.app_context():
+        tokens = [create_access_token(identity=user_id) for user_id in range(1, 51)]
+    payload = {'input_mint': SOL_MINT, 'output_mint': BARK_MINT, 'amount': 10000000, 'slippage_bps': 50}
+
+    def swap(token):
+        response = client.post('/swap', json=payload, headers={'Authorization': f"Bearer {token}"})
+        if response.status_code != 200:
+            raise RuntimeError(response.get_json())
+
+    return run_operations([lambda token=tokens[i % len(tokens)]: swap(token) for i in range(requests)], concurrency)
+
+
+SCENARIOS = {
+    'onboarding_storm': onboarding_storm,
+    'refresh_burst': refresh_burst,
+    'swap_burst': swap_burst,
+    'alert_fanout': alert_fanout,
+}
@@ -1,22 +1,12 @@
 import os
-import telebot
 import logging
-from cryptography.fernet import Fernet
+import threading
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
-from solana.keypair import Keypair
-from solana.rpc.api import Client
-from base58 import b58encode
-from jupiter_trading_api import JupiterTradingAPI  # Assuming this is the correct import for Jupiter Trading API
-from referral_system import ReferralSystem
-from pnl_tracker import PNLTracker
-from user_management import UserManager
-from price_alerts import PriceAlertManager
-from solana_api import SolanaAPI
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-
-Base = declarative_base()
+from router import Router
+from instrumentation import instrument, metrics, start_metrics_server, start_profiler
+from services import ServiceContainer
 
 # Load environment variables
 load_dotenv()
@@ -24,38 +14,159 @@ load_dotenv()
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-# Initialize bot and services
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY')
 DATABASE_URL = os.getenv('DATABASE_URL')
-
-cipher_suite = Fernet(ENCRYPTION_KEY)
-bot = telebot.TeleBot(TELEGRAM_TOKEN)
-trading_api = JupiterTradingAPI(os.getenv('JUPITER_API_KEY'))  # Use Jupiter Trading API
-referral_system = ReferralSystem()
-pnl_tracker = PNLTracker(trading_api)
-user_manager = UserManager(ENCRYPTION_KEY)
-price_alert_manager = PriceAlertManager()
-solana_api = SolanaAPI(os.getenv('SOLANA_API_KEY'))
-solana_client = Client("https://api.mainnet-beta.solana.com")
-SOLANA_PROGRAM_ID = "TOKEN_2022_PROGRAM_ID"
+SOLANA_RPC_URL = os.getenv('SOLANA_RPC_URL', 'https://api.mainnet-beta.solana.com')
+BARK_MINT = os.getenv('BARK_MINT')
+LAMPORTS_PER_SOL = 1000000000
 LOW_BALANCE_THRESHOLD = 0.0069
+METRICS_PORT = os.getenv('METRICS_PORT')
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_EXPOSE_PROFILE = os.getenv('METRICS_EXPOSE_PROFILE', 'false').lower() == 'true'
+PROFILE_SAMPLE_INTERVAL = os.getenv('PROFILE_SAMPLE_INTERVAL')
+CANDLE_STORE_DIR = os.getenv('CANDLE_STORE_DIR', 'candles')
+# Shards of shard_runtime.py read the candles its front process polls
+CANDLE_STORE_READONLY = bool(os.getenv('BARKBOT_SHARD'))
+CANDLE_MINTS = [mint for mint in os.getenv('CANDLE_MINTS', '').split(',') if mint]
+CANDLE_POLL_INTERVAL = float(os.getenv('CANDLE_POLL_INTERVAL', '10'))
+TOKEN_CACHE_PATH = os.getenv('TOKEN_CACHE_PATH', 'token_cache.json')
+BACKTEST_DATA_DIR = os.getenv('BACKTEST_DATA_DIR', 'price_data')
+BACKTEST_DEFAULT_SERIES = os.getenv('BACKTEST_DEFAULT_SERIES', 'bark_1m.csv')
+BACKTEST_MAX_COMBINATIONS = int(os.getenv('BACKTEST_MAX_COMBINATIONS', '10000'))
+BACKTEST_MAX_CELLS = int(os.getenv('BACKTEST_MAX_CELLS', '50000000'))
+BACKTEST_COOLDOWN = float(os.getenv('BACKTEST_COOLDOWN', '10'))
+REFERRAL_PREFIX = 'ref_'
+PENDING_REFERRER_TTL = float(os.getenv('PENDING_REFERRER_TTL', '86400'))
+MAX_PENDING_REFERRERS = int(os.getenv('MAX_PENDING_REFERRERS', '100000'))
+
+# Services are built on first use; heavy client libraries are imported in
+# their factories so importing this module stays cheap.
+services = ServiceContainer()
+router = Router()
+
+@services.service('cipher_suite')
+def cipher_suite():
+    from cryptography.fernet import Fernet
+    return Fernet(ENCRYPTION_KEY)
+
+@services.service('bot')
+def bot():
+    import telebot
+    telegram_bot = telebot.TeleBot(TELEGRAM_TOKEN)
+    # Register the router as the single telebot handler for messages and callbacks
+    router.attach(telegram_bot)
+    return telegram_bot
+
+@services.service('trading_api')
+def trading_api():
+    from jupiter_trading_api import JupiterTradingAPI  # Assuming this is the correct import for Jupiter Trading API
+    return instrument(JupiterTradingAPI(os.getenv('JUPITER_API_KEY')), 'jupiter')
+
+@services.service('referral_system')
+def referral_system():
+    from referral_system import ReferralSystem
+    return ReferralSystem()
+
+@services.service('pnl_tracker')
+def pnl_tracker():
+    from pnl_tracker import PNLTracker
+    return instrument(PNLTracker(trading_api), 'pnl_tracker')
+
+@services.service('user_manager')
+def user_manager():
+    from user_management import UserManager
+    return instrument(UserManager(ENCRYPTION_KEY), 'user_manager')
+
+@services.service('price_alert_manager')
+def price_alert_manager():
+    from price_alerts import PriceAlertManager
+    return PriceAlertManager()
+
+@services.service('solana_api')
+def solana_api():
+    from solana_api import SolanaAPI
+    return instrument(SolanaAPI(os.getenv('SOLANA_API_KEY')), 'solana_rpc')
+
+@services.service('solana_client')
+def solana_client():
+    from solana.rpc.api import Client
+    return instrument(Client(SOLANA_RPC_URL), 'solana_rpc')
+
+@services.service('token_cache')
+def token_cache():
+    from token_cache import TokenCache
+    return TokenCache(TOKEN_CACHE_PATH, registry=metrics)
+
+@services.service('withdrawal_engine')
+def withdrawal_engine():
+    from solana.rpc.async_api import AsyncClient
+    from withdrawal_engine import WithdrawalEngine
+    return WithdrawalEngine(instrument(AsyncClient(SOLANA_RPC_URL), 'solana_rpc'), cache=token_cache)
+
+@services.service('candle_store')
+def candle_store():
+    from candle_store import CandleStore
+    return CandleStore(CANDLE_STORE_DIR, registry=metrics, readonly=CANDLE_STORE_READONLY)
+
+@services.on_startup
+def start_candle_store():
+    if CANDLE_STORE_READONLY:
+        return
+    from portfolio import fetch_prices
+    for mint in filter(None, [BARK_MINT] + CANDLE_MINTS):
+        candle_store.track(mint)
+    candle_store.start(fetch_prices, CANDLE_POLL_INTERVAL)
 
 def main_menu_markup():
-    markup = telebot.types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
+    from telebot import types
+    markup = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
     markup.add(
-        telebot.types.KeyboardButton('💰 Buy'),
-        telebot.types.KeyboardButton('🔄 Refresh'),
-        telebot.types.KeyboardButton('🏦 Wallet'),
-        telebot.types.KeyboardButton('⚙️ Settings'),
-        telebot.types.KeyboardButton('📊 Dashboard'),
-        telebot.types.KeyboardButton('📈 Market Data')
+        types.KeyboardButton('💰 Buy'),
+        types.KeyboardButton('🔄 Refresh'),
+        types.KeyboardButton('🏦 Wallet'),
+        types.KeyboardButton('⚙️ Settings'),
+        types.KeyboardButton('📊 Dashboard'),
+        types.KeyboardButton('📈 Market Data')
     )
     return markup
 
-@bot.message_handler(commands=['start'])
+# Referrers from /start links of users who have not registered yet; applied at
+# /verify. Oldest first, bounded, and forgotten after PENDING_REFERRER_TTL.
+pending_referrers = OrderedDict()
+pending_referrers_lock = threading.Lock()
+
+def remember_referrer(user_id, referrer_id):
+    now = time.monotonic()
+    with pending_referrers_lock:
+        pending_referrers[user_id] = (referrer_id, now)
+        pending_referrers.move_to_end(user_id)
+        while pending_referrers and (
+            len(pending_referrers) > MAX_PENDING_REFERRERS
+            or now - next(iter(pending_referrers.values()))[1] > PENDING_REFERRER_TTL
+        ):
+            pending_referrers.popitem(last=False)
+
+def take_referrer(user_id):
+    with pending_referrers_lock:
+        entry = pending_referrers.pop(user_id, None)
+    if entry is None or time.monotonic() - entry[1] > PENDING_REFERRER_TTL:
+        return None
+    return entry[0]
+
+def referral_payload(text):
+    # Referral links open the bot with "/start ref_<telegram_id>"
+    parts = (text or '').split(maxsplit=1)
+    if len(parts) == 2 and parts[1].startswith(REFERRAL_PREFIX) and parts[1][len(REFERRAL_PREFIX):].isdigit():
+        return int(parts[1][len(REFERRAL_PREFIX):])
+    return None
+
+@router.command('start')
 def send_welcome(message):
     user_id = message.from_user.id
+    referrer_id = referral_payload(message.text)
+    if referrer_id is not None and not user_manager.set_referrer(user_id, referrer_id):
+        remember_referrer(user_id, referrer_id)
     if not user_manager.is_user_verified(user_id):
         bot.reply_to(message, "Please verify your account using /verify before using BarkBOT.")
         return
@@ -68,16 +179,19 @@ def send_welcome(message):
         wallet = user_manager.get_wallet(user_id)
         bot.reply_to(message, f"🎉 Welcome back to BarkBOT! 🎉\n\nYour wallet address is:\n\n📍 {wallet['public_key']}\n\nTo buy a token, paste the token address or tap “💰 Buy”.\n\nTap \"🔄 Refresh\" to update your balance.\nTap \"🏦 Wallet\" to withdraw your SOL and export private key.\n\nAdvanced traders can set a custom RPC, slippage, and priority in \"⚙️ Settings\".\n\n⚠️ Your balance is below 0.0069 SOL. Please add more to pay for transaction fees!", reply_markup=main_menu_markup())
 
-@bot.message_handler(commands=['verify'])
+@router.command('verify')
 def verify_user(message):
     bot.reply_to(message, "✉️ Please provide your email for verification.")
-    bot.register_next_step_handler(message, process_verification)
+    router.next_step(bot, message, process_verification)
 
 def process_verification(message):
     email = message.text
     verification_code = user_manager.generate_verification_code(message.from_user.id, email)
+    referrer_id = take_referrer(message.from_user.id)
+    if referrer_id is not None:
+        user_manager.set_referrer(message.from_user.id, referrer_id)
     bot.reply_to(message, f"A verification code has been sent to {email}. Please enter the code to verify your account.")
-    bot.register_next_step_handler(message, confirm_verification, email, verification_code)
+    router.next_step(bot, message, confirm_verification, email, verification_code)
 
 def confirm_verification(message, email, verification_code):
     user_code = message.text
@@ -86,26 +200,34 @@ def confirm_verification(message, email, verification_code):
         bot.reply_to(message, "✅ Your account has been verified! You can now use BarkBOT.")
     else:
         bot.reply_to(message, "❌ Invalid verification code. Please try again.")
-        bot.register_next_step_handler(message, confirm_verification, email, verification_code)
+        router.next_step(bot, message, confirm_verification, email, verification_code)
+
+@router.command('referral')
+def send_referral_link(message):
+    link = f"https://t.me/{bot.get_me().username}?start={REFERRAL_PREFIX}{message.from_user.id}"
+    bot.reply_to(message, f"🤝 Share your referral link and earn a share of your referrals' trading fees:\n\n{link}")
 
 def generate_wallet():
+    from base58 import b58encode
+    from solana.keypair import Keypair
     keypair = Keypair.generate()
     public_key = str(keypair.public_key)
     private_key = b58encode(keypair.secret_key).decode('utf-8')
     return {'public_key': public_key, 'private_key': private_key}
 
-@bot.message_handler(commands=['help'])
+@router.command('help')
 def show_help(message):
-    markup = telebot.types.InlineKeyboardMarkup(row_width=2)
+    from telebot import types
+    markup = types.InlineKeyboardMarkup(row_width=2)
     markup.add(
-        telebot.types.InlineKeyboardButton('Trading Commands', callback_data='help_trading'),
-        telebot.types.InlineKeyboardButton('Account Management', callback_data='help_account'),
-        telebot.types.InlineKeyboardButton('Security Features', callback_data='help_security'),
-        telebot.types.InlineKeyboardButton('Market Data', callback_data='help_market')
+        types.InlineKeyboardButton('Trading Commands', callback_data='help_trading'),
+        types.InlineKeyboardButton('Account Management', callback_data='help_account'),
+        types.InlineKeyboardButton('Security Features', callback_data='help_security'),
+        types.InlineKeyboardButton('Market Data', callback_data='help_market')
     )
     bot.reply_to(message, "❓ Select a topic to get help:", reply_markup=markup)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('help_'))
+@router.callback_prefix('help_')
 def help_topic(call):
     topic = call.data.split('_')[1]
     if topic == 'trading':
@@ -114,6 +236,8 @@ def help_topic(call):
             "/autobuy - Automatically buy BARK tokens by pasting its address.\n"
             "/setalert - Set a price alert for BARK tokens.\n"
             "/pnl - Get your PNL overview.\n"
+            "/portfolio - Value every token in your wallet.\n"
+            "/backtest - Test DCA and limit/stop settings on price history.\n"
             "/history - View your transaction history.\n"
         )
     elif topic == 'account':
@@ -133,10 +257,11 @@ def help_topic(call):
         help_text = (
             "📊 Market Data:\n"
             "/market - Get the latest market data.\n"
+            "/market 5m - Chart and indicators at 1m, 5m, 1h or 1d.\n"
         )
     bot.send_message(call.message.chat.id, help_text)
 
-@bot.message_handler(func=lambda message: message.text == '🔄 Refresh')
+@router.text('🔄 Refresh')
 def refresh_balance(message):
     user_id = message.from_user.id
     sol_balance, bark_balance = get_balances(user_id)
@@ -156,17 +281,17 @@ def get_balances(user_id):
     try:
         wallet = user_manager.get_wallet(user_id)
         sol_balance = solana_api.get_balance(wallet['public_key'])
-        bark_balance = trading_api.get_token_balance(wallet['public_key'], SOLANA_PROGRAM_ID)
+        bark_balance = trading_api.get_token_balance(wallet['public_key'], BARK_MINT)
     except Exception as e:
         bot.reply_to(message, f"❌ Failed to retrieve balances: {str(e)}")
         logging.error(f"Error retrieving balances for user {user_id}: {e}")
         sol_balance, bark_balance = 0, 0
     return sol_balance, bark_balance
 
-@bot.message_handler(func=lambda message: message.text == '💰 Buy')
+@router.text('💰 Buy')
 def initiate_buy(message):
     bot.reply_to(message, "🔹 Please send the token address you want to buy.")
-    bot.register_next_step_handler(message, execute_buy)
+    router.next_step(bot, message, execute_buy)
 
 def execute_buy(message):
     token_address = message.text
@@ -177,11 +302,20 @@ def execute_buy(message):
             f"📊 Token Information:\n\n"
             f"Name: {token_info['name']}\n"
             f"Symbol: {token_info['symbol']}\n"
-            f"Price: {token_info['price']} SOL\n\n"
-            "Do you want to proceed with the purchase? (yes/no)"
+            f"Price: {token_info['price']} SOL\n"
         )
+        try:
+            # Cached in memory after the first lookup; user-typed mints aren't persisted
+            mint_info = token_cache.mint_info(solana_client, token_address, persist=False)
+            if mint_info.transfer_fee:
+                fee_config = mint_info.fee_config(token_cache.current_epoch(solana_client))
+                confirm_text += f"Transfer Fee: {fee_config['basis_points'] / 100}%\n"
+        except Exception as e:
+            # The fee line is informational; the purchase doesn't depend on it
+            logging.error(f"Error reading transfer fee for {token_address}: {e}")
+        confirm_text += "\nDo you want to proceed with the purchase? (yes/no)"
         bot.reply_to(message, confirm_text)
-        bot.register_next_step_handler(message, confirm_buy, token_address, token_info['price'])
+        router.next_step(bot, message, confirm_buy, token_address, token_info['price'])
     except Exception as e:
         bot.reply_to(message, f"❌ Failed to retrieve token information: {str(e)}")
         logging.error(f"Error retrieving token information for address {token_address}: {e}")
@@ -200,20 +334,34 @@ def confirm_buy(message, token_address, token_price):
     else:
         bot.reply_to(message, "❌ Purchase cancelled.")
 
-@bot.message_handler(func=lambda message: message.text == '🏦 Wallet')
+@router.text('🏦 Wallet')
 def wallet_menu(message):
-    markup = telebot.types.InlineKeyboardMarkup(row_width=1)
+    from telebot import types
+    markup = types.InlineKeyboardMarkup(row_width=1)
     markup.add(
-        telebot.types.InlineKeyboardButton('Withdraw SOL', callback_data='withdraw_sol'),
-        telebot.types.InlineKeyboardButton('Withdraw BARK', callback_data='withdraw_bark'),
-        telebot.types.InlineKeyboardButton('Export Private Key', callback_data='export_key')
+        types.InlineKeyboardButton('Withdraw SOL', callback_data='withdraw_sol'),
+        types.InlineKeyboardButton('Withdraw BARK', callback_data='withdraw_bark'),
+        types.InlineKeyboardButton('Export Private Key', callback_data='export_key')
     )
     bot.reply_to(message, "🏦 Wallet Options:", reply_markup=markup)
 
-@bot.callback_query_handler(func=lambda call: call.data == 'withdraw_sol')
+def send_withdrawal(wallet, recipient_address, amount, mint=None, decimals=None, token_program=None):
+    from withdrawal_engine import TransferIntent, keypair_from_secret
+    program = {} if token_program is None else {'token_program': token_program}
+    intent = TransferIntent(keypair_from_secret(wallet['private_key']), recipient_address, amount, mint=mint, decimals=decimals, **program)
+    result = withdrawal_engine.execute([intent])[0]
+    if result.failed:
+        raise result.error
+    # Confirmed, or pending: sent but not yet confirmed, so it must not be resent
+    return result
+
+def pending_transfer_text(result):
+    return f"⏳ Your transfer was sent but is not confirmed yet. Check transaction {result.signature} on an explorer before trying again."
+
+@router.callback('withdraw_sol')
 def withdraw_sol(call):
     bot.send_message(call.message.chat.id, "🔹 Please send the amount of SOL you want to withdraw and the recipient address separated by a space (e.g., 0.1 9tV5oXSkPzYBwZJCnreMA4Q2NYZox7snJYEbxmFEaSac).")
-    bot.register_next_step_handler(call.message, execute_withdraw_sol)
+    router.next_step(bot, call.message, execute_withdraw_sol)
 
 def execute_withdraw_sol(message):
     try:
@@ -221,16 +369,19 @@ def execute_withdraw_sol(message):
         amount = float(amount)
         user_id = message.from_user.id
         wallet = user_manager.get_wallet(user_id)
-        solana_api.transfer_sol(wallet['public_key'], recipient_address, amount)
+        result = send_withdrawal(wallet, recipient_address, int(round(amount * LAMPORTS_PER_SOL)))
+        if result.pending:
+            bot.reply_to(message, pending_transfer_text(result))
+            return
         bot.reply_to(message, f"✅ Successfully transferred {amount} SOL to {recipient_address}.")
     except Exception as e:
         bot.reply_to(message, f"❌ Failed to transfer SOL: {str(e)}")
         logging.error(f"Error transferring SOL: {e}")
 
-@bot.callback_query_handler(func=lambda call: call.data == 'withdraw_bark')
+@router.callback('withdraw_bark')
 def withdraw_bark(call):
     bot.send_message(call.message.chat.id, "🔹 Please send the amount of BARK you want to withdraw and the recipient address separated by a space (e.g., 10 9tV5oXSkPzYBwZJCnreMA4Q2NYZox7snJYEbxmFEaSac).")
-    bot.register_next_step_handler(call.message, execute_withdraw_bark)
+    router.next_step(bot, call.message, execute_withdraw_bark)
 
 def execute_withdraw_bark(message):
     try:
@@ -238,13 +389,24 @@ def execute_withdraw_bark(message):
         amount = float(amount)
         user_id = message.from_user.id
         wallet = user_manager.get_wallet(user_id)
-        trading_api.transfer_bark(wallet['public_key'], recipient_address, amount)
-        bot.reply_to(message, f"✅ Successfully transferred {amount} BARK to {recipient_address}.")
+        mint_info = token_cache.mint_info(solana_client, BARK_MINT)
+        # Read before sending, so a failed lookup can't turn a sent transfer into an error reply
+        epoch = token_cache.current_epoch(solana_client) if mint_info.transfer_fee else None
+        base_amount = int(round(amount * 10 ** mint_info.decimals))
+        result = send_withdrawal(wallet, recipient_address, base_amount, mint=BARK_MINT, decimals=mint_info.decimals, token_program=mint_info.program_id)
+        if result.pending:
+            bot.reply_to(message, pending_transfer_text(result))
+            return
+        reply = f"✅ Successfully transferred {amount} BARK to {recipient_address}."
+        fee = mint_info.fee(base_amount, epoch)
+        if fee:
+            reply += f" A transfer fee of {fee / 10 ** mint_info.decimals} BARK was withheld."
+        bot.reply_to(message, reply)
     except Exception as e:
         bot.reply_to(message, f"❌ Failed to transfer BARK: {str(e)}")
         logging.error(f"Error transferring BARK: {e}")
 
-@bot.callback_query_handler(func=lambda call: call.data == 'export_key')
+@router.callback('export_key')
 def export_key(call):
     try:
         private_key = user_manager.get_private_key(call.from_user.id)
@@ -253,20 +415,21 @@ def export_key(call):
         bot.reply_to(call.message, f"❌ Failed to export private key: {str(e)}")
         logging.error(f"Error exporting private key for user {call.from_user.id}: {e}")
 
-@bot.message_handler(func=lambda message: message.text == '⚙️ Settings')
+@router.text('⚙️ Settings')
 def settings_menu(message):
-    markup = telebot.types.InlineKeyboardMarkup(row_width=1)
+    from telebot import types
+    markup = types.InlineKeyboardMarkup(row_width=1)
     markup.add(
-        telebot.types.InlineKeyboardButton('Set Custom RPC', callback_data='set_rpc'),
-        telebot.types.InlineKeyboardButton('Set Slippage', callback_data='set_slippage'),
-        telebot.types.InlineKeyboardButton('Set Priority', callback_data='set_priority')
+        types.InlineKeyboardButton('Set Custom RPC', callback_data='set_rpc'),
+        types.InlineKeyboardButton('Set Slippage', callback_data='set_slippage'),
+        types.InlineKeyboardButton('Set Priority', callback_data='set_priority')
     )
     bot.reply_to(message, "⚙️ Advanced Settings:", reply_markup=markup)
 
-@bot.callback_query_handler(func=lambda call: call.data == 'set_rpc')
+@router.callback('set_rpc')
 def set_rpc(call):
     bot.send_message(call.message.chat.id, "🔹 Please send the custom RPC URL.")
-    bot.register_next_step_handler(call.message, update_rpc)
+    router.next_step(bot, call.message, update_rpc)
 
 def update_rpc(message):
     custom_rpc = message.text
@@ -277,10 +440,10 @@ def update_rpc(message):
         bot.reply_to(message, f"❌ Failed to set custom RPC: {str(e)}")
         logging.error(f"Error setting custom RPC for user {message.from_user.id}: {e}")
 
-@bot.callback_query_handler(func=lambda call: call.data == 'set_slippage')
+@router.callback('set_slippage')
 def set_slippage(call):
     bot.send_message(call.message.chat.id, "🔹 Please send the slippage percentage (e.g., 0.5 for 0.5%).")
-    bot.register_next_step_handler(call.message, update_slippage)
+    router.next_step(bot, call.message, update_slippage)
 
 def update_slippage(message):
     try:
@@ -291,10 +454,10 @@ def update_slippage(message):
         bot.reply_to(message, f"❌ Failed to set slippage: {str(e)}")
         logging.error(f"Error setting slippage for user {message.from_user.id}: {e}")
 
-@bot.callback_query_handler(func=lambda call: call.data == 'set_priority')
+@router.callback('set_priority')
 def set_priority(call):
     bot.send_message(call.message.chat.id, "🔹 Please send the priority level (e.g., high, medium, low).")
-    bot.register_next_step_handler(call.message, update_priority)
+    router.next_step(bot, call.message, update_priority)
 
 def update_priority(message):
     priority = message.text.lower()
@@ -305,7 +468,7 @@ def update_priority(message):
         bot.reply_to(message, f"❌ Failed to set priority: {str(e)}")
         logging.error(f"Error setting priority for user {message.from_user.id}: {e}")
 
-@bot.message_handler(func=lambda message: message.text == '📊 Dashboard')
+@router.text('📊 Dashboard')
 def show_dashboard(message):
     user_id = message.from_user.id
     pnl = pnl_tracker.get_pnl(user_id)
@@ -320,9 +483,33 @@ def show_dashboard(message):
     )
     for tx in recent_transactions:
         dashboard_text += f"- {tx['date']}: {tx['amount']} SOL ({tx['status']})\n"
+    try:
+        dashboard_text += "\n" + holdings_text(user_id, recent_transactions)
+    except Exception as e:
+        logging.error(f"Error valuing portfolio for user {user_id}: {e}")
     bot.reply_to(message, dashboard_text)
 
-@bot.message_handler(func=lambda message: message.text == '📈 Market Data')
+def holdings_text(user_id, fills=None):
+    from portfolio import cost_basis_from_fills, format_holdings, wallet_portfolio
+    wallet = user_manager.get_wallet(user_id)
+    try:
+        # PNL is measured against the user's buys; holdings show without it
+        cost_basis = cost_basis_from_fills(pnl_tracker.get_recent_transactions(user_id) if fills is None else fills)
+    except Exception as e:
+        logging.error(f"Error reading fills for user {user_id}: {e}")
+        cost_basis = None
+    return format_holdings(wallet_portfolio(solana_client, wallet['public_key'], cost_basis))
+
+@router.command('portfolio')
+def show_portfolio(message):
+    try:
+        bot.reply_to(message, holdings_text(message.from_user.id))
+    except Exception as e:
+        bot.reply_to(message, f"❌ Failed to load portfolio: {str(e)}")
+        logging.error(f"Error valuing portfolio for user {message.from_user.id}: {e}")
+
+@router.text('📈 Market Data')
+@router.command('market')
 def show_market_data(message):
     market_data = trading_api.get_market_data()
     market_text = (
@@ -332,8 +519,102 @@ def show_market_data(message):
         f"Market Cap: {market_data['market_cap']} SOL\n"
         f"24h Change: {market_data['24h_change']}%\n"
     )
+    if BARK_MINT:
+        try:
+            candle_store.ingest(BARK_MINT, float(market_data['latest_price']))
+            market_text += "\n" + trend_text(BARK_MINT, market_resolution(message.text))
+        except Exception as e:
+            logging.error(f"Error reading candles for {BARK_MINT}: {e}")
     bot.reply_to(message, market_text)
 
+def market_resolution(text):
+    # "/market 5m" picks the chart resolution; 1m otherwise
+    from candle_store import RESOLUTIONS
+    parts = (text or '').split()
+    return parts[1] if len(parts) > 1 and parts[1] in RESOLUTIONS else '1m'
+
+def trend_text(mint, resolution, points=30):
+    from candle_store import CLOSE, sparkline
+    candles = candle_store.candles(mint, resolution, points)
+    if len(candles) < 2:
+        return "Trend: collecting price history…"
+    return (
+        f"Trend ({resolution}, last {len(candles)}): {sparkline(candles[:, CLOSE])}\n"
+        f"SMA(20): {candle_store.sma(mint, resolution, 20):.8f} SOL\n"
+        f"VWAP: {candle_store.vwap(mint, resolution, points):.8f} SOL\n"
+        f"Volatility: {candle_store.volatility(mint, resolution, points) * 100:.2f}% per candle\n"
+    )
+
+BACKTEST_USAGE = (
+    "🧪 Usage: /backtest <dca|limit|stop> name=v1,v2 ...\n"
+    "e.g. /backtest dca cycle_frequency=3600,86400 in_amount_per_cycle=0.1,0.5 total_in_amount=10\n"
+    "/backtest limit in_amount=1 out_amount=10000,20000 expiry=86400\n"
+    "Add series=<file> to pick another price history."
+)
+
+def parse_backtest_args(text):
+    # "/backtest dca cycle_frequency=60,3600 in_amount_per_cycle=0.1" -> strategy, series, grid
+    parts = text.split()[1:]
+    if not parts:
+        raise ValueError("Missing strategy")
+    series = BACKTEST_DEFAULT_SERIES
+    parameters = {}
+    for part in parts[1:]:
+        name, separator, values = part.partition('=')
+        if not separator:
+            raise ValueError(f"Expected name=value, got {part!r}")
+        if name == 'series':
+            series = values
+        else:
+            parameters[name] = [float(value) for value in values.split(',') if value]
+    return parts[0].lower(), series, parameters
+
+# Monotonic time of each user's last /backtest
+last_backtests = {}
+backtest_lock = threading.Lock()
+
+def backtest_wait(user_id):
+    # Seconds the user must still wait before another backtest; 0 claims the slot
+    now = time.monotonic()
+    with backtest_lock:
+        wait = last_backtests.get(user_id, -BACKTEST_COOLDOWN) + BACKTEST_COOLDOWN - now
+        if wait > 0:
+            return wait
+        last_backtests[user_id] = now
+        return 0
+
+@router.command('backtest')
+def run_backtest(message):
+    from backtester import backtest, resolve_series
+    wait = backtest_wait(message.from_user.id)
+    if wait:
+        bot.reply_to(message, f"⏳ Please wait {wait:.0f}s before running another backtest.")
+        return
+    try:
+        strategy, series, parameters = parse_backtest_args(message.text)
+        path = resolve_series(BACKTEST_DATA_DIR, series)
+        report = backtest(path, strategy, parameters, BACKTEST_MAX_COMBINATIONS, limit=5, max_cells=BACKTEST_MAX_CELLS)
+    except ValueError as e:
+        bot.reply_to(message, f"❌ {str(e)}\n\n{BACKTEST_USAGE}")
+        return
+    except Exception as e:
+        bot.reply_to(message, f"❌ Backtest failed: {str(e)}")
+        logging.error(f"Error running backtest for user {message.from_user.id}: {e}")
+        return
+    lines = [f"🧪 {strategy} backtest on {series}: {report['combinations']} combinations in {report['seconds'] * 1000:.0f} ms\n"]
+    for rank, row in enumerate(report['results'], 1):
+        grid = ', '.join(f"{name}={row[name]:g}" for name in parameters)
+        entry = f"{row['average_entry']:.8f}" if row['average_entry'] is not None else '-'
+        lines.append(f"{rank}. {grid}\n   fills {row['fills']}, avg entry {entry}, PNL {row['pnl']:+.4f} ({row['pnl_pct'] * 100:+.1f}%)")
+    bot.reply_to(message, '\n'.join(lines))
+
+metrics.register_gauge('barkbot_queue_depth', lambda: bot.worker_pool.tasks.qsize(), queue='telebot_workers')
+
 if __name__ == '__main__':
     logging.info("Starting BarkBOT...")
+    services.startup()
+    if METRICS_PORT:
+        start_metrics_server(int(METRICS_PORT), METRICS_HOST, expose_profile=METRICS_EXPOSE_PROFILE)
+    if PROFILE_SAMPLE_INTERVAL:
+        start_profiler(float(PROFILE_SAMPLE_INTERVAL))
     bot.polling()
@@ -0,0 +1,268 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+# OHLCV candles for tracked mints, kept in fixed-size NumPy ring buffers at
+# several resolutions. Every tick updates the current candle of each
+# resolution in place (or opens the next one), so ingest and rollups are O(1)
+# and memory per mint is fixed by the ring capacities. Rings can be backed by
+# .npy memory maps so history survives a restart. A read-only store follows
+# the memory maps another process writes, rereading the head on every read.
+
+RESOLUTIONS = {'1m': 60, '5m': 300, '1h': 3600, '1d': 86400}
+# 1 day of 1m, 1 week of 5m, 30 days of 1h and a year of 1d candles
+DEFAULT_CAPACITIES = {'1m': 1440, '5m': 2016, '1h': 720, '1d': 365}
+
+TS, OPEN, HIGH, LOW, CLOSE, VOLUME, PRICE_VOLUME = range(7)
+COLUMNS = 7
+
+SPARK_CHARS = '▁▂▃▄▅▆▇█'
+
+
+class CandleRing:
+    # Candles are contiguous in time: a jump of several intervals fills the
+    # gap with flat candles at the previous close, so the slot of any bucket
+    # is a fixed offset from the head and late ticks update in O(1).
+    def __init__(self, resolution, capacity, path=None, readonly=False):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.path = path
+        self.readonly = readonly
+        self.late_ticks = 0
+        self.data = self.open(path)
+        self.capacity = len(self.data)
+        self.refresh()
+
+    def refresh(self):
+        valid = self.data[:, TS] > 0
+        self.count = int(valid.sum())
+        self.head = int(np.argmax(self.data[:, TS])) if self.count else -1
+
+    def open(self, path):
+        if path is None:
+            return np.zeros((self.capacity, COLUMNS), dtype=np.float64)
+        if self.readonly:
+            return np.load(path, mmap_mode='r')
+        if os.path.exists(path):
+            data = np.load(path, mmap_mode='r+')
+            if data.shape == (self.capacity, COLUMNS):
+                return data
+            # Capacity changed: keep the newest candles that still fit
+            ordered = data[np.argsort(data[:, TS])]
+            ordered = ordered[ordered[:, TS] > 0][-self.capacity:]
+            del data
+        else:
+            ordered = None
+        data = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=(self.capacity, COLUMNS))
+        if ordered is not None and len(ordered):
+            data[:len(ordered)] = ordered
+        return data
+
+    @property
+    def last_bucket(self):
+        return self.data[self.head, TS] if self.count else None
+
+    def open_candle(self, bucket, price, volume):
+        self.head = (self.head + 1) % self.capacity
+        self.data[self.head] = (bucket, price, price, price, price, volume, price * volume)
+        self.count = min(self.count + 1, self.capacity)
+
+    def ingest(self, ts, price, volume=0.0):
+        bucket = ts - ts % self.resolution
+        last = self.last_bucket
+        if last is None or bucket > last:
+            if last is not None:
+                previous_close = self.data[self.head, CLOSE]
+                missing = min(int((bucket - last) // self.resolution) - 1, self.capacity)
+                for step in range(missing, 0, -1):
+                    self.open_candle(bucket - step * self.resolution, previous_close, 0.0)
+            self.open_candle(bucket, price, volume)
+            return
+        offset = int((last - bucket) // self.resolution)
+        if offset >= self.count:
+            self.late_ticks += 1
+            return
+        row = self.data[(self.head - offset) % self.capacity]
+        if price > row[HIGH]:
+            row[HIGH] = price
+        if price < row[LOW]:
+            row[LOW] = price
+        if offset == 0:
+            row[CLOSE] = price
+        row[VOLUME] += volume
+        row[PRICE_VOLUME] += price * volume
+
+    def candles(self, limit=None):
+        # Oldest first; a copy, so callers never see a half-written candle
+        if self.readonly:
+            self.refresh()
+        count = self.count if limit is None else min(limit, self.count)
+        if not count:
+            return np.empty((0, COLUMNS), dtype=np.float64)
+        indices = (self.head - np.arange(count - 1, -1, -1)) % self.capacity
+        return self.data[indices]
+
+    def flush(self):
+        if isinstance(self.data, np.memmap) and not self.readonly:
+            self.data.flush()
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+
+def vwap(candles):
+    volume = candles[:, VOLUME].sum()
+    if volume > 0:
+        return float(candles[:, PRICE_VOLUME].sum() / volume)
+    if not len(candles):
+        return float('nan')
+    # Price-only feeds carry no volume; fall back to the mean typical price
+    return float(((candles[:, HIGH] + candles[:, LOW] + candles[:, CLOSE]) / 3).mean())
+
+
+def sma(candles, window):
+    closes = candles[-window:, CLOSE]
+    return float(closes.mean()) if len(closes) else float('nan')
+
+
+def volatility(candles, window=None):
+    # Standard deviation of close-to-close log returns, per candle
+    closes = candles[:, CLOSE] if window is None else candles[-(window + 1):, CLOSE]
+    closes = closes[closes > 0]
+    if len(closes) < 2:
+        return float('nan')
+    return float(np.diff(np.log(closes)).std())
+
+
+def sparkline(values):
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return ''
+    low, high = values.min(), values.max()
+    if high == low:
+        return SPARK_CHARS[0] * len(values)
+    levels = ((values - low) / (high - low) * (len(SPARK_CHARS) - 1)).round().astype(int)
+    return ''.join(SPARK_CHARS[level] for level in levels)
+
+
+class CandleStore:
+    def __init__(self, directory=None, capacities=None, registry=None, readonly=False):
+        self.directory = directory
+        self.capacities = dict(DEFAULT_CAPACITIES, **(capacities or {}))
+        self.registry = registry
+        self.readonly = readonly
+        self.rings = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.worker = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            for name in sorted(os.listdir(directory)):
+                mint, _, resolution = name[:-len('.npy')].rpartition('_')
+                if name.endswith('.npy') and resolution in RESOLUTIONS:
+                    self.track(mint)
+
+    def path(self, mint, resolution):
+        if not self.directory:
+            return None
+        return os.path.join(self.directory, f"{mint}_{resolution}.npy")
+
+    def track(self, mint):
+        # A read-only store can only track mints the writer has snapshots of
+        if self.readonly and not all(os.path.exists(self.path(mint, resolution)) for resolution in RESOLUTIONS):
+            return
+        with self.lock:
+            if mint in self.rings:
+                return
+            self.rings[mint] = {
+                resolution: CandleRing(seconds, self.capacities[resolution], self.path(mint, resolution), self.readonly)
+                for resolution, seconds in RESOLUTIONS.items()
+            }
+        if self.registry is not None:
+            self.registry.register_gauge('barkbot_candle_store_bytes', lambda: self.memory_usage(mint), mint=mint)
+
+    def tracked(self):
+        return list(self.rings)
+
+    def ingest(self, mint, price, volume=0.0, ts=None):
+        if self.readonly or price is None or price <= 0:
+            return
+        if mint not in self.rings:
+            self.track(mint)
+        ts = int(time.time() if ts is None else ts)
+        with self.lock:
+            for ring in self.rings[mint].values():
+                ring.ingest(ts, float(price), float(volume))
+
+    def candles(self, mint, resolution='1m', limit=None):
+        if self.readonly and mint not in self.rings:
+            self.track(mint)
+        rings = self.rings.get(mint)
+        if rings is None:
+            return np.empty((0, COLUMNS), dtype=np.float64)
+        with self.lock:
+            return rings[resolution].candles(limit)
+
+    def vwap(self, mint, resolution='1m', window=60):
+        return vwap(self.candles(mint, resolution, window))
+
+    def sma(self, mint, resolution='1m', window=20):
+        return sma(self.candles(mint, resolution, window), window)
+
+    def volatility(self, mint, resolution='1m', window=60):
+        return volatility(self.candles(mint, resolution, window + 1))
+
+    def memory_usage(self, mint=None):
+        # Bytes held by the rings; fixed per mint once tracked
+        if mint is not None:
+            return sum(ring.nbytes for ring in self.rings.get(mint, {}).values())
+        return {mint: self.memory_usage(mint) for mint in self.tracked()}
+
+    def bytes_per_mint(self):
+        return sum(capacity * COLUMNS * 8 for capacity in self.capacities.values())
+
+    def flush(self):
+        with self.lock:
+            for rings in self.rings.values():
+                for ring in rings.values():
+                    ring.flush()
+
+    def poll(self, fetch_prices):
+        # fetch_prices takes a list of mints and returns {mint: price}
+        mints = self.tracked()
+        if not mints:
+            return 0
+        ts = time.time()
+        prices = fetch_prices(mints)
+        for mint, price in prices.items():
+            self.ingest(mint, price, ts=ts)
+        return len(prices)
+
+    def run(self, fetch_prices, interval, flush_interval):
+        last_flush = time.monotonic()
+        while not self.stop_event.wait(interval):
+            try:
+                self.poll(fetch_prices)
+                if time.monotonic() - last_flush >= flush_interval:
+                    last_flush = time.monotonic()
+                    self.flush()
+            except Exception as e:
+                logging.error(f"Error polling candle prices: {e}")
+
+    def start(self, fetch_prices, interval=10.0, flush_interval=60.0):
+        if self.worker is None and not self.readonly:
+            self.worker = threading.Thread(
+                target=self.run, args=(fetch_prices, interval, flush_interval), name='candle-store', daemon=True
+            )
+            self.worker.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+        self.flush()
@@ -0,0 +1,425 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+# Fee accounting for swaps, limit fills and DCA orders. Every fee is split
+# into buckets by basis points with integer math (the rounding remainder goes
+# to the first bucket, so allocations always sum to the fee), totals are kept
+# in memory and every change is written to an append-only JSON-lines audit
+# log. Buyback allocations accumulate per mint and are executed as one
+# aggregated swap per period instead of one dust swap per fill.
+#
+# Recording a fee only appends it to an in-process queue. A background
+# writer group-commits the queue: one O_APPEND write and one fsync per batch,
+# under an exclusive lock on the log, then applies the batch to the totals.
+# A fee with a transaction signature is written as pending. It is booked
+# into the buckets once the transaction confirms, or voided if it fails.
+#
+# Several processes may share one audit log. A record torn by a crash is cut
+# off the end of the log on open and skipped on replay. Only the process
+# holding the buyback lock confirms pending fees and executes buybacks.
+# First it catches up on the records other processes appended, so every
+# process's fees are booked and bought back exactly once.
+
+BPS_DENOMINATOR = 10000
+DEFAULT_SPLITS = (('buyback', 5000), ('charity', 2000), ('donations', 1000), ('governance', 2000))
+
+
+def parse_splits(value):
+    # "buyback=5000,charity=2000,donations=1000,governance=2000"
+    splits = []
+    for item in value.split(','):
+        bucket, bps = item.split('=')
+        splits.append((bucket.strip(), int(bps)))
+    return validate_splits(splits)
+
+
+def validate_splits(splits):
+    splits = tuple((bucket, int(bps)) for bucket, bps in splits)
+    if not splits:
+        raise ValueError("At least one fee bucket is required")
+    if any(bps < 0 for _, bps in splits):
+        raise ValueError("Fee splits must not be negative")
+    if sum(bps for _, bps in splits) != BPS_DENOMINATOR:
+        raise ValueError(f"Fee splits must add up to {BPS_DENOMINATOR} bps")
+    if len({bucket for bucket, _ in splits}) != len(splits):
+        raise ValueError("Fee bucket names must be unique")
+    return splits
+
+
+def allocate(fee, splits):
+    allocations = [fee * bps // BPS_DENOMINATOR for _, bps in splits]
+    allocations[0] += fee - sum(allocations)
+    return allocations
+
+
+class FeeLedger:
+    def __init__(self, splits=DEFAULT_SPLITS, fee_bps=20, audit_path=None,
+                 buyback_bucket='buyback', min_buyback=0, check_fees=None, booked=None,
+                 flush_interval=0.05, confirm_interval=5.0, max_batch=10000):
+        self.splits = validate_splits(splits)
+        self.buckets = [bucket for bucket, _ in self.splits]
+        if buyback_bucket not in self.buckets:
+            raise ValueError(f"Unknown buyback bucket: {buyback_bucket}")
+        self.buyback_index = self.buckets.index(buyback_bucket)
+        self.fee_bps = fee_bps
+        self.min_buyback = min_buyback
+        self.audit_path = audit_path
+        # check_fees({signature: last_valid_block_height}) returns
+        # {signature: status}; booked(telegram_id, mint, fee) is told about
+        # every fee once it is booked
+        self.check_fees = check_fees
+        self.booked = booked
+        self.flush_interval = flush_interval
+        self.confirm_interval = confirm_interval
+        self.max_batch = max_batch
+        self.totals = {}
+        self.fees = {}
+        self.pending_buyback = {}
+        # {signature: pending fee record}
+        self.pending_fees = {}
+        self.sequence = 0
+        # Tags this ledger's records, so catching up skips its own
+        self.writer = uuid.uuid4().hex
+        self.audit_fd = None
+        self.audit_offset = 0
+        self.buyback_fd = None
+        if audit_path:
+            self.audit_fd = os.open(audit_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            with locked(self.audit_fd):
+                truncate_torn_record(self.audit_fd)
+                # The audit log is the source of truth across restarts
+                state = replay_audit_log(audit_path, self.buckets, self.buyback_index)
+            self.fees = state['fees']
+            self.totals = state['totals']
+            self.pending_buyback = {mint: amount for mint, amount in state['pending_buyback'].items() if amount}
+            self.pending_fees = state['pending_fees']
+            self.sequence = state['sequence']
+            self.audit_offset = state['offset']
+        # deque.append/popleft are atomic, so producers never take a lock
+        self.events = deque()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.worker = None
+        self.execute = None
+        self.buyback_interval = 3600.0
+        self.confirm = False
+        self.last_buyback = self.last_confirm = time.monotonic()
+
+    def platform_fee(self, amount):
+        return amount * self.fee_bps // BPS_DENOMINATOR
+
+    def commit(self, entries, apply=True):
+        # Durably append the entries with one write and one fsync, then apply
+        # them to the in-memory books
+        with self.lock:
+            for entry in entries:
+                self.sequence += 1
+                entry['seq'] = self.sequence
+                entry['ts'] = time.time()
+                entry['writer'] = self.writer
+            if self.audit_fd is not None:
+                data = b''.join((json.dumps(entry, separators=(',', ':')) + '\n').encode() for entry in entries)
+                with locked(self.audit_fd):
+                    size = os.fstat(self.audit_fd).st_size
+                    try:
+                        view = memoryview(data)
+                        while view:
+                            view = view[os.write(self.audit_fd, view):]
+                        os.fsync(self.audit_fd)
+                    except OSError:
+                        # Never leave half a batch for the next write to land on
+                        os.ftruncate(self.audit_fd, size)
+                        raise
+            if apply:
+                for entry in entries:
+                    apply_entry(entry, self.fees, self.totals, self.pending_buyback, self.pending_fees, self.buckets, self.buyback_index)
+
+    def catch_up(self):
+        # Apply the records other processes appended since the last read;
+        # this ledger's own records are already in memory
+        if self.audit_path is None:
+            return 0
+        applied = 0
+        with self.lock:
+            for entry, offset in read_audit_log(self.audit_path, self.audit_offset):
+                self.audit_offset = offset
+                if entry.get('writer') != self.writer:
+                    apply_entry(entry, self.fees, self.totals, self.pending_buyback, self.pending_fees, self.buckets, self.buyback_index)
+                    applied += 1
+        return applied
+
+    def acquire_buyback_owner(self):
+        # Non-blocking; the lock dies with its process, so a surviving
+        # process takes buybacks over at its next interval
+        if self.audit_path is None:
+            return True
+        if self.buyback_fd is None:
+            fd = os.open(self.audit_path + '.buyback.lock', os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            self.buyback_fd = fd
+        return True
+
+    def record_fee(self, source, telegram_id, mint, fee, signature=None, last_valid_block_height=None):
+        # Hot path: a single append, no I/O. With a signature the fee stays
+        # pending until the transaction confirms.
+        if fee <= 0:
+            return None
+        allocations = allocate(fee, self.splits)
+        entry = {'type': 'fee', 'source': source, 'telegram_id': telegram_id, 'mint': mint, 'fee': fee, 'allocations': allocations}
+        if signature is not None:
+            entry.update(type='pending_fee', signature=signature, last_valid_block_height=last_valid_block_height)
+        self.events.append(entry)
+        return dict(zip(self.buckets, allocations))
+
+    def queue_depth(self):
+        return len(self.events)
+
+    def drain(self):
+        batch = []
+        events = self.events
+        while events and len(batch) < self.max_batch:
+            batch.append(events.popleft())
+        return batch
+
+    def flush(self):
+        flushed = 0
+        with self.flush_lock:
+            while True:
+                batch = self.drain()
+                if not batch:
+                    break
+                try:
+                    self.commit(batch)
+                except Exception as e:
+                    # Put the batch back in front so no fee is lost
+                    self.events.extendleft(reversed(batch))
+                    logging.error(f"Error writing fee audit records: {e}")
+                    raise
+                flushed += len(batch)
+        return flushed
+
+    def resolve_fees(self, statuses):
+        # Book the pending fees whose transactions confirmed and void the
+        # failed ones; anything else stays pending
+        entries = []
+        with self.lock:
+            for signature, status in statuses.items():
+                pending = self.pending_fees.get(signature)
+                if pending is None or status not in ('confirmed', 'failed'):
+                    continue
+                if status == 'confirmed':
+                    entry = {key: pending[key] for key in ('source', 'telegram_id', 'mint', 'fee', 'allocations')}
+                    entry.update(type='fee', signature=signature)
+                else:
+                    entry = {'type': 'void', 'signature': signature, 'mint': pending['mint']}
+                entries.append(entry)
+        if not entries:
+            return []
+        self.commit(entries)
+        booked = [entry for entry in entries if entry['type'] == 'fee']
+        if self.booked is not None:
+            for entry in booked:
+                self.booked(entry['telegram_id'], entry['mint'], entry['fee'])
+        return booked
+
+    def confirm_fees(self):
+        # Owner only: every process's pending fees reach it through catch_up
+        if self.check_fees is None or not self.acquire_buyback_owner():
+            return []
+        self.flush()
+        self.catch_up()
+        with self.lock:
+            pending = {signature: entry.get('last_valid_block_height') for signature, entry in self.pending_fees.items()}
+        if not pending:
+            return []
+        return self.resolve_fees(self.check_fees(pending))
+
+    def take_buyback(self):
+        # Hand out every pending buyback at or above the minimum and clear it
+        with self.lock:
+            batch = {mint: amount for mint, amount in self.pending_buyback.items() if amount > 0 and amount >= self.min_buyback}
+            for mint in batch:
+                del self.pending_buyback[mint]
+        return batch
+
+    def restore_buyback(self, mint, amount):
+        with self.lock:
+            self.pending_buyback[mint] = self.pending_buyback.get(mint, 0) + amount
+
+    def record_buyback(self, mint, amount, transaction_id):
+        # take_buyback already removed the amount from memory
+        self.commit([{'type': 'buyback', 'mint': mint, 'amount': amount, 'transaction_id': transaction_id}], apply=False)
+
+    def run_buybacks(self, execute):
+        if not self.acquire_buyback_owner():
+            return {}
+        self.flush()
+        self.catch_up()
+        executed = {}
+        for mint, amount in self.take_buyback().items():
+            try:
+                transaction_id = execute(mint, amount)
+            except Exception as e:
+                self.restore_buyback(mint, amount)
+                logging.error(f"Error executing buyback for {mint}: {e}")
+                continue
+            self.record_buyback(mint, amount, transaction_id)
+            executed[mint] = amount
+        return executed
+
+    def snapshot(self):
+        self.flush()
+        with self.lock:
+            return {'fees': dict(self.fees), 'totals': dict(self.totals), 'pending_buyback': dict(self.pending_buyback),
+                    'pending_fees': {signature: entry['fee'] for signature, entry in self.pending_fees.items()}}
+
+    def reconcile(self):
+        # Replay the audit log and compare it against the running totals;
+        # returns a list of discrepancies, empty when the books agree.
+        if self.audit_path is None:
+            raise ValueError("Reconciliation requires an audit log")
+        self.flush()
+        self.catch_up()
+        expected = self.snapshot()
+        replayed = replay_audit_log(self.audit_path, self.buckets, self.buyback_index)
+        replayed['pending_fees'] = {signature: entry['fee'] for signature, entry in replayed['pending_fees'].items()}
+        problems = []
+        for name in ('fees', 'totals', 'pending_buyback', 'pending_fees'):
+            actual = {key: value for key, value in replayed[name].items() if value}
+            wanted = {key: value for key, value in expected[name].items() if value}
+            for key in set(actual) | set(wanted):
+                if actual.get(key, 0) != wanted.get(key, 0):
+                    problems.append((name, key, wanted.get(key, 0), actual.get(key, 0)))
+        for mint, fee in replayed['fees'].items():
+            allocated = sum(replayed['totals'].get((bucket, mint), 0) for bucket in self.buckets)
+            if allocated != fee:
+                problems.append(('allocation', mint, fee, allocated))
+        return problems
+
+    def run(self):
+        while not self.stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+                now = time.monotonic()
+                if self.confirm and now - self.last_confirm >= self.confirm_interval:
+                    self.last_confirm = now
+                    self.confirm_fees()
+                if self.execute is not None and now - self.last_buyback >= self.buyback_interval:
+                    self.last_buyback = now
+                    self.run_buybacks(self.execute)
+            except Exception as e:
+                logging.error(f"Error in fee ledger worker: {e}")
+
+    def start(self, execute=None, interval=3600.0, confirm=False):
+        # Every process runs the writer; the one that owns buybacks also
+        # passes execute and confirm
+        if execute is not None:
+            self.execute = execute
+            self.buyback_interval = interval
+        self.confirm = self.confirm or confirm
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run, name='fee-ledger', daemon=True)
+            self.worker.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+
+    def close(self):
+        self.stop()
+        self.flush()
+        for fd in (self.audit_fd, self.buyback_fd):
+            if fd is not None:
+                os.close(fd)
+        self.audit_fd = self.buyback_fd = None
+
+
+class locked:
+    # Exclusive flock on an open file for the duration of a with block
+    def __init__(self, fd):
+        self.fd = fd
+
+    def __enter__(self):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, exc_type, exc, tb):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+
+def truncate_torn_record(fd):
+    # A crash mid-write can leave a last line without its newline
+    size = os.fstat(fd).st_size
+    if not size or os.pread(fd, 1, size - 1) == b'\n':
+        return
+    end = size
+    while end > 0:
+        start = max(0, end - 65536)
+        newline = os.pread(fd, end - start, start).rfind(b'\n')
+        if newline >= 0:
+            end = start + newline + 1
+            break
+        end = start
+    logging.error(f"Truncating a torn fee audit record of {size - end} bytes")
+    os.ftruncate(fd, end)
+
+
+def read_audit_log(path, offset=0):
+    # Yields (entry, offset after it) for each complete record from offset on
+    with open(path, 'rb') as audit_file:
+        audit_file.seek(offset)
+        for line in audit_file:
+            if not line.endswith(b'\n'):
+                # Torn, or still being written by another process
+                break
+            offset += len(line)
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logging.error(f"Skipping unreadable fee audit record ending at byte {offset}")
+                continue
+            yield entry, offset
+
+
+def apply_entry(entry, fees, totals, pending_buyback, pending_fees, buckets, buyback_index):
+    mint = entry['mint']
+    if entry['type'] == 'pending_fee':
+        pending_fees[entry['signature']] = entry
+    elif entry['type'] == 'void':
+        pending_fees.pop(entry['signature'], None)
+    elif entry['type'] == 'fee':
+        # A pending fee is booked once, however many processes confirm it
+        if 'signature' in entry and pending_fees.pop(entry['signature'], None) is None:
+            return
+        fees[mint] = fees.get(mint, 0) + entry['fee']
+        for bucket, amount in zip(buckets, entry['allocations']):
+            totals[(bucket, mint)] = totals.get((bucket, mint), 0) + amount
+        pending_buyback[mint] = pending_buyback.get(mint, 0) + entry['allocations'][buyback_index]
+    elif entry['type'] == 'buyback':
+        pending_buyback[mint] = pending_buyback.get(mint, 0) - entry['amount']
+
+
+def replay_audit_log(path, buckets, buyback_index=0):
+    fees = {}
+    totals = {}
+    pending_buyback = {}
+    pending_fees = {}
+    sequence = 0
+    offset = 0
+    for entry, offset in read_audit_log(path):
+        sequence = entry['seq']
+        apply_entry(entry, fees, totals, pending_buyback, pending_fees, buckets, buyback_index)
+    return {'fees': fees, 'totals': totals, 'pending_buyback': pending_buyback, 'pending_fees': pending_fees,
+            'sequence': sequence, 'offset': offset}
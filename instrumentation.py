@@ -0,0 +1,287 @@
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import Awaitable
+
+# Low-overhead latency instrumentation. Spans record into fixed-bucket
+# histograms (one bisect and two counter increments per observation), queue
+# depths are read from callbacks at scrape time, and everything is rendered in
+# the Prometheus text format for /metrics. An optional sampling profiler
+# collects collapsed stacks from all threads without tracing every call.
+
+# Bucket upper bounds in seconds, roughly log-spaced from 100us to 60s
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        # Linear interpolation inside the bucket holding the q-th observation
+        with self.lock:
+            counts = list(self.counts)
+            total = self.count
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[index - 1] if index > 0 else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else self.bounds[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+
+class Span:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.help = {}
+        self.gauges = []
+        self.lock = threading.Lock()
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram(self.buckets))
+        return histogram
+
+    def span(self, name, **labels):
+        return Span(self.histogram(name, **labels))
+
+    def timed(self, name, **labels):
+        def decorator(func):
+            histogram = self.histogram(name, function=func.__name__, **labels)
+
+            def wrapper(*args, **kwargs):
+                with Span(histogram):
+                    return func(*args, **kwargs)
+            wrapper.__name__ = func.__name__
+            wrapper.__wrapped__ = func
+            return wrapper
+        return decorator
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def register_gauge(self, name, func, **labels):
+        self.gauges.append((name, tuple(sorted(labels.items())), func))
+
+    def render(self):
+        lines = []
+        by_name = {}
+        for (name, labels), histogram in list(self.histograms.items()):
+            by_name.setdefault(name, []).append((labels, histogram))
+        for name in sorted(by_name):
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in by_name[name]:
+                with histogram.lock:
+                    counts = list(histogram.counts)
+                    total = histogram.count
+                    value_sum = histogram.sum
+                cumulative = 0
+                for bound, count in zip(histogram.bounds + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {value_sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {total}")
+            lines.append(f"# TYPE {name}_quantile gauge")
+            for labels, histogram in by_name[name]:
+                for q in QUANTILES:
+                    lines.append(f"{name}_quantile{format_labels(labels + (('quantile', repr(q)),))} {histogram.quantile(q)}")
+        gauge_names = set()
+        for name, labels, func in list(self.gauges):
+            if name not in gauge_names:
+                gauge_names.add(name)
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} gauge")
+            try:
+                value = func()
+            except Exception:
+                continue
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+metrics.describe('barkbot_handler_seconds', "Telegram handler latency")
+metrics.describe('barkbot_http_request_seconds', "API route latency")
+metrics.describe('barkbot_call_seconds', "Latency of UserManager, Solana RPC and Jupiter calls")
+metrics.describe('barkbot_queue_depth', "Pending items in background queues")
+
+
+class InstrumentedService:
+    # Transparent proxy timing every method call on the wrapped service,
+    # including coroutine methods of async clients.
+    def __init__(self, target, service, nested=(), registry=None):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_service', service)
+        object.__setattr__(self, '_registry', registry or metrics)
+        object.__setattr__(self, '_nested', {
+            name: InstrumentedService(getattr(target, name), f"{service}.{name}", registry=registry)
+            for name in nested
+        })
+
+    def __getattr__(self, name):
+        nested = self._nested.get(name)
+        if nested is not None:
+            return nested
+        attribute = getattr(self._target, name)
+        if not callable(attribute) or name.startswith('_'):
+            return attribute
+        histogram = self._registry.histogram('barkbot_call_seconds', service=self._service, method=name)
+
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            result = attribute(*args, **kwargs)
+            if isinstance(result, Awaitable):
+                return timed_awaitable(result, histogram, start)
+            histogram.observe(time.perf_counter() - start)
+            return result
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+    def __delattr__(self, name):
+        delattr(self._target, name)
+
+
+async def timed_awaitable(awaitable, histogram, start):
+    try:
+        return await awaitable
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+def instrument(target, service, nested=(), registry=None):
+    return InstrumentedService(target, service, nested, registry)
+
+
+class SamplingProfiler:
+    # Periodically samples the stacks of all threads and counts collapsed
+    # stacks ("module:function;module:function count"), flamegraph-ready.
+    def __init__(self, interval=0.01, max_depth=32):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        own_id = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def collapsed(self):
+        return '\n'.join(f"{stack} {count}" for stack, count in self.samples.most_common()) + '\n'
+
+
+profiler = None
+
+
+def start_profiler(interval):
+    global profiler
+    if profiler is None:
+        profiler = SamplingProfiler(interval)
+        profiler.start()
+    return profiler
+
+
+def start_metrics_server(port, host='127.0.0.1', expose_profile=False):
+    # Loopback only unless a host is given; /profile leaks code paths and is
+    # served only when asked for. http.server is only imported by processes
+    # that actually serve metrics.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body = metrics.render()
+            elif self.path == '/profile' and expose_profile and profiler is not None:
+                body = profiler.collapsed()
+            else:
+                self.send_error(404)
+                return
+            payload = body.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
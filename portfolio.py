@@ -0,0 +1,213 @@
+import os
+
+import numpy as np
+
+from program_ids import TOKEN_2022_PROGRAM_ID, TOKEN_PROGRAM_ID
+
+# Portfolio valuation. Holdings are fetched with one getTokenAccountsByOwner
+# call per token program, priced with one batched Jupiter price request for
+# all distinct mints, and valued as flat NumPy columns: value, allocation and
+# PNL for every position of every wallet are computed in a single pass, with
+# per-wallet totals from np.bincount.
+
+SOL_MINT = 'So11111111111111111111111111111111111111112'
+JUPITER_PRICE_API_URL = os.getenv('JUPITER_PRICE_API_URL', 'https://api.jup.ag/price/v2')
+PRICE_BATCH_SIZE = 100
+MULTIPLE_ACCOUNTS_BATCH_SIZE = 100
+LAMPORTS_PER_SOL = 1000000000
+
+
+def fetch_token_accounts(client, owner):
+    # Returns {mint: ui_amount} across the SPL Token and Token-2022 programs
+    from solana.rpc.types import TokenAccountOpts
+    from solders.pubkey import Pubkey
+
+    owner = Pubkey.from_string(owner) if isinstance(owner, str) else owner
+    balances = {}
+    for program_id in (TOKEN_PROGRAM_ID, TOKEN_2022_PROGRAM_ID):
+        opts = TokenAccountOpts(program_id=Pubkey.from_string(program_id))
+        response = client.get_token_accounts_by_owner_json_parsed(owner, opts)
+        for account in response.value:
+            info = account.account.data.parsed['info']
+            token_amount = info['tokenAmount']
+            amount = int(token_amount['amount']) / 10 ** token_amount['decimals']
+            if amount:
+                balances[info['mint']] = balances.get(info['mint'], 0.0) + amount
+    return balances
+
+
+def fetch_native_balances(client, owners):
+    # Lamports for many wallets, MULTIPLE_ACCOUNTS_BATCH_SIZE per getMultipleAccounts call
+    from solders.pubkey import Pubkey
+
+    keys = [Pubkey.from_string(owner) if isinstance(owner, str) else owner for owner in owners]
+    lamports = []
+    for i in range(0, len(keys), MULTIPLE_ACCOUNTS_BATCH_SIZE):
+        accounts = client.get_multiple_accounts(keys[i:i + MULTIPLE_ACCOUNTS_BATCH_SIZE]).value
+        lamports.extend(account.lamports if account is not None else 0 for account in accounts)
+    return lamports
+
+
+def fetch_prices(mints, session=None, vs_token=SOL_MINT):
+    # One request per PRICE_BATCH_SIZE mints; prices are quoted in vs_token
+    if session is None:
+        import requests as session
+    mints = sorted(set(mints))
+    prices = {}
+    for i in range(0, len(mints), PRICE_BATCH_SIZE):
+        batch = mints[i:i + PRICE_BATCH_SIZE]
+        response = session.get(JUPITER_PRICE_API_URL, params={'ids': ','.join(batch), 'vsToken': vs_token}, timeout=10)
+        response.raise_for_status()
+        for mint, quote in (response.json().get('data') or {}).items():
+            if quote and quote.get('price') is not None:
+                prices[mint] = float(quote['price'])
+    if vs_token in mints:
+        prices[vs_token] = 1.0
+    return prices
+
+
+def value_positions(wallet_index, amounts, prices, cost_prices, wallet_count=None):
+    # All arguments are aligned 1-D arrays, one entry per (wallet, mint)
+    # position; prices and cost_prices are per unit, NaN when unknown.
+    wallet_index = np.asarray(wallet_index, dtype=np.int64)
+    amounts = np.asarray(amounts, dtype=np.float64)
+    prices = np.asarray(prices, dtype=np.float64)
+    cost_prices = np.asarray(cost_prices, dtype=np.float64)
+    if wallet_count is None:
+        wallet_count = int(wallet_index.max()) + 1 if wallet_index.size else 0
+
+    value = amounts * np.nan_to_num(prices)
+    totals = np.bincount(wallet_index, weights=value, minlength=wallet_count)
+    wallet_totals = totals[wallet_index]
+    allocation = np.divide(value, wallet_totals, out=np.zeros_like(value), where=wallet_totals > 0)
+    cost = amounts * cost_prices
+    # NaN where the price or the cost basis is unknown
+    pnl = amounts * prices - cost
+    pnl_pct = np.divide(pnl, cost, out=np.full_like(value, np.nan), where=cost > 0)
+    pnl_totals = np.bincount(wallet_index, weights=np.nan_to_num(pnl), minlength=wallet_count)
+    return {
+        'value': value,
+        'allocation': allocation,
+        'pnl': pnl,
+        'pnl_pct': pnl_pct,
+        'wallet_value': totals,
+        'wallet_pnl': pnl_totals,
+    }
+
+
+def cost_basis_from_fills(fills):
+    # Average entry price per mint in SOL, from the buy fills PNLTracker
+    # reports: dicts with the mint, the SOL amount spent and the SOL price
+    # paid per token. Fills without a mint or price (SOL transfers), sells
+    # and failed fills don't move the basis.
+    rows = [
+        (fill['mint'], float(fill['amount']), float(fill['price'])) for fill in fills
+        if fill.get('mint') and fill.get('price') and fill.get('side', 'buy') == 'buy' and fill.get('status') != 'failed'
+    ]
+    if not rows:
+        return {}
+    codes = {}
+    index = np.array([codes.setdefault(mint, len(codes)) for mint, _, _ in rows], dtype=np.int64)
+    spent = np.array([amount for _, amount, _ in rows], dtype=np.float64)
+    paid = np.array([price for _, _, price in rows], dtype=np.float64)
+    tokens = np.bincount(index, weights=spent / paid, minlength=len(codes))
+    cost = np.bincount(index, weights=spent, minlength=len(codes))
+    basis = np.divide(cost, tokens, out=np.full(len(codes), np.nan), where=tokens > 0)
+    return {mint: float(price) for mint, price in zip(codes, basis) if np.isfinite(price)}
+
+
+def build_positions(holdings, prices, cost_basis=None):
+    # holdings: list (one per wallet) of {mint: amount}; cost_basis maps
+    # (wallet_position, mint) or mint to an average entry price. Mints are
+    # interned to integer codes so prices are looked up once per distinct mint.
+    cost_basis = cost_basis or {}
+    codes = {}
+    wallet_index = []
+    mint_codes = []
+    amounts = []
+    for position, balances in enumerate(holdings):
+        wallet_index.extend([position] * len(balances))
+        mint_codes.extend([codes.setdefault(mint, len(codes)) for mint in balances])
+        amounts.extend(balances.values())
+    unique_mints = np.array(list(codes), dtype=object)
+    inverse = np.array(mint_codes, dtype=np.int64)
+    unique_prices = np.array([prices.get(mint, np.nan) for mint in codes], dtype=np.float64)
+    unique_costs = np.array([cost_basis.get(mint, np.nan) for mint in codes], dtype=np.float64)
+    cost_prices = unique_costs[inverse]
+    if any(isinstance(key, tuple) for key in cost_basis):
+        wallet_specific = [cost_basis.get((position, mint)) for position, mint in zip(wallet_index, unique_mints[inverse])]
+        overrides = np.array([np.nan if cost is None else cost for cost in wallet_specific], dtype=np.float64)
+        cost_prices = np.where(np.isnan(overrides), cost_prices, overrides)
+    return {
+        'wallet_index': np.array(wallet_index, dtype=np.int64),
+        'mint': unique_mints[inverse],
+        'amount': np.array(amounts, dtype=np.float64),
+        'price': unique_prices[inverse],
+        'cost_price': cost_prices,
+    }
+
+
+def value_holdings(holdings, prices, cost_basis=None):
+    positions = build_positions(holdings, prices, cost_basis)
+    valuation = value_positions(positions['wallet_index'], positions['amount'], positions['price'], positions['cost_price'], len(holdings))
+    positions.update(valuation)
+    return positions
+
+
+def wallet_portfolio(client, owner, cost_basis=None, session=None):
+    # Holdings of one wallet, native SOL included, sorted by value
+    from solders.pubkey import Pubkey
+
+    balances = fetch_token_accounts(client, owner)
+    lamports = client.get_balance(Pubkey.from_string(owner) if isinstance(owner, str) else owner).value
+    if lamports:
+        balances[SOL_MINT] = balances.get(SOL_MINT, 0.0) + lamports / LAMPORTS_PER_SOL
+    prices = fetch_prices(balances, session=session)
+    positions = value_holdings([balances], prices, cost_basis)
+    order = np.argsort(-positions['value'], kind='stable')
+    rows = [
+        {
+            'mint': positions['mint'][i],
+            'amount': float(positions['amount'][i]),
+            'price': float(positions['price'][i]),
+            'value': float(positions['value'][i]),
+            'allocation': float(positions['allocation'][i]),
+            'pnl': float(positions['pnl'][i]),
+            'pnl_pct': float(positions['pnl_pct'][i]),
+        }
+        for i in order
+    ]
+    total = float(positions['wallet_value'][0]) if len(positions['wallet_value']) else 0.0
+    return {'owner': str(owner), 'total_value': total, 'holdings': rows}
+
+
+def portfolio_report(client, owners, cost_basis=None, session=None, workers=8):
+    # Admin report over many wallets: RPC reads run concurrently, then one
+    # batched price lookup and one vectorized valuation pass for everything
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        holdings = list(executor.map(lambda owner: fetch_token_accounts(client, owner), owners))
+    for balances, lamports in zip(holdings, fetch_native_balances(client, owners)):
+        if lamports:
+            balances[SOL_MINT] = balances.get(SOL_MINT, 0.0) + lamports / LAMPORTS_PER_SOL
+    prices = fetch_prices({mint for balances in holdings for mint in balances}, session=session)
+    positions = value_holdings(holdings, prices, cost_basis)
+    return {
+        'owners': list(owners),
+        'wallet_value': positions['wallet_value'],
+        'wallet_pnl': positions['wallet_pnl'],
+        'positions': positions,
+    }
+
+
+def format_holdings(portfolio, limit=10):
+    lines = [f"💼 Holdings (total {portfolio['total_value']:.4f} SOL):"]
+    for row in portfolio['holdings'][:limit]:
+        line = f"- {row['mint'][:4]}…{row['mint'][-4:]}: {row['amount']:.4f} ≈ {row['value']:.4f} SOL ({row['allocation'] * 100:.1f}%)"
+        if not np.isnan(row['pnl_pct']):
+            line += f" PNL {row['pnl_pct'] * 100:+.1f}%"
+        lines.append(line)
+    if len(portfolio['holdings']) > limit:
+        lines.append(f"…and {len(portfolio['holdings']) - limit} more")
+    return '\n'.join(lines)
@@ -0,0 +1,6 @@
+# Well-known Solana program ids as base58 strings, so modules that only read
+# chain state can use them without importing solders at module load
+SYSTEM_PROGRAM_ID = '11111111111111111111111111111111'
+TOKEN_PROGRAM_ID = 'TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA'
+TOKEN_2022_PROGRAM_ID = 'TokenzQdBNbLqP5VEhdkAS6EPFLC1PHnBqCXEpPxuEb'
+ASSOCIATED_TOKEN_PROGRAM_ID = 'ATokenGPvbdGVxr1b2hvZbsiqW5xWrLKTVo3Vx9yb6x'
@@ -0,0 +1,206 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Referral rewards are accrued off the swap path: a fill only appends a
+# compact (telegram_id, mint, fee) tuple to an in-process queue. A background
+# worker drains the queue, resolves referrers for the whole batch at once and
+# upserts per-referrer balances in one round trip. Payouts settle separately,
+# in bulk, on their own schedule.
+#
+# Settlement runs in one process at a time, under the ledger's settlement
+# lock. Each transfer is recorded as a pending payout, with its signature and
+# the amount already counted as paid, before it is sent. It is marked
+# confirmed once it lands, or released back to the balance once it is known
+# to have failed. A transfer whose outcome is unknown stays pending and is
+# checked again at the next settlement, never paid a second time.
+
+DEFAULT_REWARD_BPS = 2000
+BPS_DENOMINATOR = 10000
+
+
+def recompute_balances(events, referrers, reward_bps=DEFAULT_REWARD_BPS):
+    # Roll fill events up into {(referrer_id, mint): reward}. Integer math only,
+    # so incremental batches and a full recompute always agree exactly.
+    balances = {}
+    for telegram_id, mint, fee in events:
+        referrer_id = referrers.get(telegram_id)
+        if referrer_id is None:
+            continue
+        reward = fee * reward_bps // BPS_DENOMINATOR
+        if reward:
+            key = (referrer_id, mint)
+            balances[key] = balances.get(key, 0) + reward
+    return balances
+
+
+class MemoryReferralLedger:
+    # In-process ledger with the same interface as UserManager's referral
+    # methods; used for local runs and tests.
+    def __init__(self, referrers=None):
+        self.referrers = dict(referrers or {})
+        self.balances = {}
+        self.paid = {}
+        self.payouts = []
+        self.lock = threading.Lock()
+        self.settling = threading.Lock()
+
+    def get_referrers(self, telegram_ids):
+        return {telegram_id: self.referrers[telegram_id] for telegram_id in telegram_ids if telegram_id in self.referrers}
+
+    def upsert_referral_balances(self, balances):
+        with self.lock:
+            for key, amount in balances.items():
+                self.balances[key] = self.balances.get(key, 0) + amount
+
+    def get_referral_balances(self, min_amount=0):
+        with self.lock:
+            return {key: amount for key, amount in self.balances.items() if amount > 0 and amount >= min_amount}
+
+    @contextmanager
+    def settlement_lock(self):
+        acquired = self.settling.acquire(blocking=False)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.settling.release()
+
+    def record_referral_payouts(self, payouts, signature, last_valid_block_height):
+        with self.lock:
+            for key, amount in payouts.items():
+                if self.balances.get(key, 0) < amount:
+                    raise ValueError(f"Referral balance {key} does not cover {amount}")
+            for key, amount in payouts.items():
+                self.balances[key] -= amount
+                self.payouts.append({'key': key, 'amount': amount, 'signature': signature,
+                                     'last_valid_block_height': last_valid_block_height, 'status': 'pending'})
+
+    def get_pending_referral_payouts(self):
+        with self.lock:
+            return {payout['signature']: payout['last_valid_block_height'] for payout in self.payouts if payout['status'] == 'pending'}
+
+    def resolve_referral_payouts(self, statuses):
+        confirmed = {}
+        with self.lock:
+            for payout in self.payouts:
+                status = statuses.get(payout['signature'])
+                if payout['status'] != 'pending' or status not in ('confirmed', 'failed'):
+                    continue
+                payout['status'] = status
+                key = payout['key']
+                if status == 'confirmed':
+                    confirmed[key] = confirmed.get(key, 0) + payout['amount']
+                    self.paid[key] = self.paid.get(key, 0) + payout['amount']
+                else:
+                    self.balances[key] = self.balances.get(key, 0) + payout['amount']
+        return confirmed
+
+
+class ReferralAccrual:
+    def __init__(self, ledger, reward_bps=DEFAULT_REWARD_BPS, flush_interval=5.0,
+                 settle_interval=86400.0, min_payout=0, payout=None, check_payouts=None, max_batch=10000):
+        self.ledger = ledger
+        self.reward_bps = reward_bps
+        self.flush_interval = flush_interval
+        self.settle_interval = settle_interval
+        self.min_payout = min_payout
+        # payout(balances, record) sends transfers, calling
+        # record(payouts, signature, last_valid_block_height) before each send,
+        # and returns {signature: status}; check_payouts({signature:
+        # last_valid_block_height}) returns the current status of pending ones
+        self.payout = payout
+        self.check_payouts = check_payouts
+        self.max_batch = max_batch
+        # deque.append/popleft are atomic, so producers never take a lock
+        self.events = deque()
+        self.flush_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.worker = None
+        # Every process flushes its own queue; only one settles
+        self.settlement_enabled = True
+        self.last_settlement = time.monotonic()
+
+    def record_fill(self, telegram_id, mint, fee):
+        # Hot path: a single append, no I/O
+        if fee > 0:
+            self.events.append((telegram_id, mint, fee))
+
+    def queue_depth(self):
+        return len(self.events)
+
+    def drain(self):
+        batch = []
+        events = self.events
+        while events and len(batch) < self.max_batch:
+            batch.append(events.popleft())
+        return batch
+
+    def flush(self):
+        flushed = 0
+        with self.flush_lock:
+            while True:
+                batch = self.drain()
+                if not batch:
+                    break
+                try:
+                    referrers = self.ledger.get_referrers({telegram_id for telegram_id, _, _ in batch})
+                    balances = recompute_balances(batch, referrers, self.reward_bps)
+                    if balances:
+                        self.ledger.upsert_referral_balances(balances)
+                except Exception as e:
+                    # Put the batch back in front so no accrual is lost
+                    self.events.extendleft(reversed(batch))
+                    logging.error(f"Error flushing referral accruals: {e}")
+                    raise
+                flushed += len(batch)
+        return flushed
+
+    def reconcile(self):
+        pending = self.ledger.get_pending_referral_payouts()
+        if not pending or self.check_payouts is None:
+            return {}
+        return self.ledger.resolve_referral_payouts(self.check_payouts(pending))
+
+    def settle(self):
+        if self.payout is None:
+            return {}
+        with self.ledger.settlement_lock() as leader:
+            if not leader:
+                logging.info("Referral settlement is running in another process; skipping")
+                return {}
+            self.flush()
+            # Earlier transfers first: a failed one is released and paid again now
+            paid = self.reconcile()
+            balances = self.ledger.get_referral_balances(self.min_payout)
+            if balances:
+                statuses = self.payout(balances, self.ledger.record_referral_payouts) or {}
+                for key, amount in self.ledger.resolve_referral_payouts(statuses).items():
+                    paid[key] = paid.get(key, 0) + amount
+        logging.info(f"Settled {len(paid)} referral payouts")
+        return paid
+
+    def run(self):
+        while not self.stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+                if self.settlement_enabled and time.monotonic() - self.last_settlement >= self.settle_interval:
+                    self.last_settlement = time.monotonic()
+                    self.settle()
+            except Exception as e:
+                logging.error(f"Error in referral accrual worker: {e}")
+
+    def start(self, settle=True):
+        self.settlement_enabled = settle
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run, name='referral-accrual', daemon=True)
+            self.worker.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+        self.flush()
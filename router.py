@@ -0,0 +1,173 @@
+import logging
+
+from instrumentation import Span, metrics
+
+# Routes Telegram updates to handlers with hash lookups instead of letting
+# telebot evaluate every lambda predicate in order. Exact texts, commands and
+# callback data resolve through dicts, prefixes through a trie, and only
+# unmatched updates fall through to predicate routes.
+
+
+class PrefixTrie:
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def insert(self, prefix, value):
+        node = self.root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        if None not in node:
+            self.size += 1
+        # The None key holds the value stored at this node
+        node[None] = value
+
+    def longest_match(self, text):
+        node = self.root
+        match = node.get(None)
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                match = node[None]
+        return match
+
+    def __len__(self):
+        return self.size
+
+
+class Router:
+    def __init__(self):
+        self.commands = {}
+        self.texts = {}
+        self.text_prefixes = PrefixTrie()
+        self.text_fallbacks = []
+        self.callbacks = {}
+        self.callback_prefixes = PrefixTrie()
+        self.callback_fallbacks = []
+        self.histograms = {}
+
+    # Registration decorators
+    def command(self, *names):
+        def decorator(handler):
+            for name in names:
+                self.commands[name] = handler
+            return handler
+        return decorator
+
+    def text(self, *texts):
+        def decorator(handler):
+            for text in texts:
+                self.texts[text] = handler
+            return handler
+        return decorator
+
+    def text_prefix(self, prefix):
+        def decorator(handler):
+            self.text_prefixes.insert(prefix, handler)
+            return handler
+        return decorator
+
+    def text_fallback(self, func):
+        def decorator(handler):
+            self.text_fallbacks.append((func, handler))
+            return handler
+        return decorator
+
+    def callback(self, *data):
+        def decorator(handler):
+            for value in data:
+                self.callbacks[value] = handler
+            return handler
+        return decorator
+
+    def callback_prefix(self, prefix):
+        def decorator(handler):
+            self.callback_prefixes.insert(prefix, handler)
+            return handler
+        return decorator
+
+    def callback_fallback(self, func):
+        def decorator(handler):
+            self.callback_fallbacks.append((func, handler))
+            return handler
+        return decorator
+
+    # Resolution
+    def resolve_message(self, message):
+        text = message.text
+        if not text:
+            return None
+        if text[0] == '/':
+            # "/start@BarkBot arg" -> "start"
+            name = text[1:].split(maxsplit=1)[0].split('@', 1)[0] if len(text) > 1 else ''
+            handler = self.commands.get(name)
+            if handler is not None:
+                return handler
+        handler = self.texts.get(text)
+        if handler is not None:
+            return handler
+        if self.text_prefixes:
+            handler = self.text_prefixes.longest_match(text)
+            if handler is not None:
+                return handler
+        for func, handler in self.text_fallbacks:
+            if func(message):
+                return handler
+        return None
+
+    def resolve_callback(self, call):
+        data = call.data
+        if data is None:
+            return None
+        handler = self.callbacks.get(data)
+        if handler is not None:
+            return handler
+        if self.callback_prefixes:
+            handler = self.callback_prefixes.longest_match(data)
+            if handler is not None:
+                return handler
+        for func, handler in self.callback_fallbacks:
+            if func(call):
+                return handler
+        return None
+
+    def histogram(self, handler):
+        histogram = self.histograms.get(handler)
+        if histogram is None:
+            histogram = metrics.histogram('barkbot_handler_seconds', handler=getattr(handler, '__name__', 'handler'))
+            self.histograms[handler] = histogram
+        return histogram
+
+    def dispatch_message(self, message):
+        handler = self.resolve_message(message)
+        if handler is None:
+            return False
+        with Span(self.histogram(handler)):
+            handler(message)
+        return True
+
+    def dispatch_callback(self, call):
+        handler = self.resolve_callback(call)
+        if handler is None:
+            logging.info(f"Unhandled callback data: {call.data}")
+            return False
+        with Span(self.histogram(handler)):
+            handler(call)
+        return True
+
+    def next_step(self, bot, message, handler, *args, **kwargs):
+        # Replies telebot routes to a registered next step never reach
+        # dispatch_message, so the step is timed here instead
+        histogram = self.histogram(handler)
+
+        def step(message, *args, **kwargs):
+            with Span(histogram):
+                return handler(message, *args, **kwargs)
+        bot.register_next_step_handler(message, step, *args, **kwargs)
+
+    def attach(self, bot):
+        # One catch-all telebot handler per update type; the router does the rest
+        bot.message_handler(func=lambda message: True, content_types=['text'])(self.dispatch_message)
+        bot.callback_query_handler(func=lambda call: True)(self.dispatch_callback)
@@ -0,0 +1,132 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+
+# Lazily-initialized service container. Services are registered as factories
+# and built on first use, so importing bot.py or api/app.py does not open
+# database or RPC connections, and pre-fork servers build clients in each
+# worker after the fork. Module-level names stay usable through LazyService
+# proxies, which resolve to the real instance on first attribute access.
+#
+# Singleton background workers register with on_leader_startup. Pre-fork
+# servers run startup in every worker, but these hooks run only in the one
+# process holding the leader lock file. The lock is released when that
+# process exits, and the replacement worker takes it over at its startup.
+
+
+class ServiceContainer:
+    def __init__(self, leader_lock=None):
+        self.factories = {}
+        self.instances = {}
+        self.build_times = {}
+        self.startup_hooks = []
+        self.leader_hooks = []
+        self.leader_lock = leader_lock
+        self.leader_fd = None
+        self.started = False
+        self.lock = threading.RLock()
+        if hasattr(os, 'register_at_fork'):
+            # Clients and threads created before a fork are not safe to share
+            os.register_at_fork(after_in_child=self.reset)
+
+    def register(self, name, factory):
+        self.factories[name] = factory
+        return LazyService(self, name)
+
+    def service(self, name):
+        # Decorator form of register for factory functions
+        def decorator(factory):
+            return self.register(name, factory)
+        return decorator
+
+    def get(self, name):
+        instance = self.instances.get(name)
+        if instance is not None:
+            return instance
+        with self.lock:
+            instance = self.instances.get(name)
+            if instance is None:
+                start = time.perf_counter()
+                instance = self.factories[name]()
+                self.build_times[name] = time.perf_counter() - start
+                self.instances[name] = instance
+                logging.info(f"Initialized service {name} in {self.build_times[name] * 1000:.1f} ms")
+        return instance
+
+    def is_built(self, name):
+        return name in self.instances
+
+    def on_startup(self, hook):
+        self.startup_hooks.append(hook)
+        return hook
+
+    def on_leader_startup(self, hook):
+        self.leader_hooks.append(hook)
+        return hook
+
+    def acquire_leadership(self):
+        # Without a lock file every process is its own leader
+        if self.leader_lock is None or self.leader_fd is not None:
+            return True
+        fd = os.open(self.leader_lock, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self.leader_fd = fd
+        return True
+
+    def startup(self):
+        # Runs one-time checks (schema creation, background workers) once per process
+        if self.started:
+            return
+        with self.lock:
+            if self.started:
+                return
+            for hook in self.startup_hooks:
+                hook()
+            if self.leader_hooks and self.acquire_leadership():
+                logging.info(f"Process {os.getpid()} is the leader; starting singleton workers")
+                for hook in self.leader_hooks:
+                    hook()
+            self.started = True
+
+    def reset(self):
+        if self.leader_fd is not None:
+            # The parent keeps its lock; the child must not hold it too
+            os.close(self.leader_fd)
+            self.leader_fd = None
+        self.instances = {}
+        self.build_times = {}
+        self.started = False
+        self.lock = threading.RLock()
+
+
+class LazyService:
+    __slots__ = ('_container', '_name')
+
+    def __init__(self, container, name):
+        object.__setattr__(self, '_container', container)
+        object.__setattr__(self, '_name', name)
+
+    def _resolve(self):
+        return self._container.get(self._name)
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._resolve(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._resolve(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+    def __repr__(self):
+        state = 'built' if self._container.is_built(self._name) else 'lazy'
+        return f"<LazyService {self._name} ({state})>"
@@ -0,0 +1,336 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import zlib
+
+from instrumentation import metrics, start_metrics_server
+
+# Sharded bot runtime. A front process long-polls Telegram and routes each raw
+# update by a hash of its chat_id to one of N worker processes; the front never
+# deserializes or handles updates, so it stays off the CPU. Each worker imports
+# bot.py itself, so it builds its own database pool and RPC clients and has
+# its own GIL. All updates of a chat go to the same worker queue, and inside
+# a worker to the same thread, so per-chat ordering is preserved.
+#
+# Worker n serves its own metrics on METRICS_PORT + 1 + n; the front serves
+# the shard gauges on METRICS_PORT. The front is also the only process that
+# polls candle prices: workers open its snapshots read-only.
+
+STAT_FIELDS = ('enqueued', 'processed', 'errors', 'busy_seconds', 'heartbeat')
+ENQUEUED, PROCESSED, ERRORS, BUSY_SECONDS, HEARTBEAT = range(len(STAT_FIELDS))
+
+# A worker that has not looked at its queue for this long is reported unhealthy
+HEARTBEAT_TIMEOUT = 10.0
+# How long a restart waits for more updates when moving a dead worker's queue
+RESET_READ_TIMEOUT = 0.1
+
+
+def chat_id_of(update):
+    for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if key in update:
+            return update[key]['chat']['id']
+    callback_query = update.get('callback_query')
+    if callback_query is not None:
+        message = callback_query.get('message')
+        return message['chat']['id'] if message else callback_query['from']['id']
+    for value in update.values():
+        # Inline queries, polls, member updates and the like carry a sender
+        if isinstance(value, dict):
+            sender = value.get('from') or value.get('user')
+            if sender:
+                return sender['id']
+    return None
+
+
+def shard_for(chat_id, shards):
+    # crc32 rather than hash() so the mapping is stable across processes and restarts
+    if chat_id is None:
+        return 0
+    return zlib.crc32(str(chat_id).encode()) % shards
+
+
+class ChatSerialExecutor:
+    # Runs work on a fixed pool of threads, pinning each chat to one thread so
+    # a chat's updates are handled one at a time and in arrival order
+    def __init__(self, threads):
+        self.queues = [queue.SimpleQueue() for _ in range(threads)]
+        self.threads = [
+            threading.Thread(target=self.run, args=(work,), name=f'shard-worker-{i}', daemon=True)
+            for i, work in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, chat_id, func, *args):
+        # hash() here, not shard_for: every chat in this worker already shares
+        # one crc32 residue, which would pile them onto a single thread
+        self.queues[hash(chat_id) % len(self.queues)].put((func, args))
+
+    def run(self, work):
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            func, args = item
+            func(*args)
+
+    def shutdown(self):
+        for work in self.queues:
+            work.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+def worker_metrics_port(port, shard):
+    return port + 1 + shard
+
+
+def bot_handler():
+    # Default worker handler: the real bot.py handlers, run inline
+    import telebot
+    import bot
+
+    bot.services.startup()
+    bot.bot.threaded = False
+    if bot.METRICS_PORT:
+        start_metrics_server(
+            worker_metrics_port(int(bot.METRICS_PORT), int(os.environ['BARKBOT_SHARD'])),
+            bot.METRICS_HOST, expose_profile=bot.METRICS_EXPOSE_PROFILE,
+        )
+
+    def handle(update):
+        bot.bot.process_new_updates([telebot.types.Update.de_json(update)])
+    return handle
+
+
+def worker_main(shard, updates, stats, handler_factory, threads):
+    os.environ['BARKBOT_SHARD'] = str(shard)
+    base = shard * len(STAT_FIELDS)
+    handle = handler_factory()
+    executor = ChatSerialExecutor(threads)
+    # Stats are shared memory without a cross-process lock: each worker only
+    # writes its own fields, so a killed worker can't leave the front blocked
+    lock = threading.Lock()
+
+    def process(update):
+        start = time.perf_counter()
+        try:
+            handle(update)
+            field = PROCESSED
+        except Exception as e:
+            logging.error(f"Shard {shard} failed to handle update {update.get('update_id')}: {e}")
+            field = ERRORS
+        with lock:
+            stats[base + field] += 1
+            stats[base + BUSY_SECONDS] += time.perf_counter() - start
+
+    while True:
+        stats[base + HEARTBEAT] = time.time()
+        try:
+            update = updates.get(timeout=1.0)
+        except queue.Empty:
+            continue
+        if update is None:
+            break
+        executor.submit(chat_id_of(update), process, update)
+    executor.shutdown()
+
+
+class ShardedRuntime:
+    def __init__(self, shards=None, handler_factory=bot_handler, threads=4, start_method='spawn', max_queue=10000):
+        self.shards = shards or os.cpu_count() or 1
+        self.handler_factory = handler_factory
+        self.threads = threads
+        self.context = multiprocessing.get_context(start_method)
+        self.max_queue = max_queue
+        self.queues = [self.context.Queue(max_queue) for _ in range(self.shards)]
+        self.stats = self.context.Array('d', self.shards * len(STAT_FIELDS), lock=False)
+        self.lock = threading.Lock()
+        self.processes = [None] * self.shards
+        self.restarts = [0] * self.shards
+        self.stopping = False
+
+    def start_worker(self, shard):
+        process = self.context.Process(
+            target=worker_main, name=f'barkbot-shard-{shard}',
+            args=(shard, self.queues[shard], self.stats, self.handler_factory, self.threads), daemon=True,
+        )
+        process.start()
+        self.processes[shard] = process
+
+    def start(self):
+        for shard in range(self.shards):
+            self.start_worker(shard)
+        logging.info(f"Started {self.shards} bot shards")
+        return self
+
+    def stat(self, shard, field):
+        return self.stats[shard * len(STAT_FIELDS) + field]
+
+    def dispatch(self, update):
+        shard = shard_for(chat_id_of(update), self.shards)
+        # Blocks when the shard queue is full, which pushes back on polling
+        self.queues[shard].put(update)
+        with self.lock:
+            self.stats[shard * len(STAT_FIELDS) + ENQUEUED] += 1
+        return shard
+
+    def queue_depth(self, shard):
+        return self.stat(shard, ENQUEUED) - self.stat(shard, PROCESSED) - self.stat(shard, ERRORS)
+
+    def healthy(self, shard):
+        process = self.processes[shard]
+        return (
+            process is not None and process.is_alive()
+            and time.time() - self.stat(shard, HEARTBEAT) < HEARTBEAT_TIMEOUT
+        )
+
+    def shard_status(self):
+        status = []
+        for shard, process in enumerate(self.processes):
+            heartbeat = self.stat(shard, HEARTBEAT)
+            status.append({
+                'shard': shard,
+                'pid': process.pid if process is not None else None,
+                'alive': process is not None and process.is_alive(),
+                'healthy': self.healthy(shard),
+                'heartbeat_age': time.time() - heartbeat if heartbeat else None,
+                'queue_depth': int(self.queue_depth(shard)),
+                'processed': int(self.stat(shard, PROCESSED)),
+                'errors': int(self.stat(shard, ERRORS)),
+                'busy_seconds': self.stat(shard, BUSY_SECONDS),
+                'restarts': self.restarts[shard],
+            })
+        return status
+
+    def supervise(self):
+        # Restart dead workers; updates still waiting for a dead worker move to
+        # its replacement's queue and are handled in order
+        for shard, process in enumerate(self.processes):
+            if not self.stopping and process is not None and not process.is_alive():
+                logging.error(f"Shard {shard} exited with code {process.exitcode}; restarting")
+                self.restarts[shard] += 1
+                self.reset_shard(shard)
+                self.start_worker(shard)
+
+    def reset_shard(self, shard):
+        # A worker killed inside Queue.get takes the queue's read lock with it,
+        # so the replacement gets a fresh queue. Updates still readable from the
+        # old one are moved over; the rest, and any the dead worker had taken
+        # but not finished, are lost and counted as errors
+        old, fresh = self.queues[shard], self.context.Queue(self.max_queue)
+        moved = 0
+        while True:
+            try:
+                update = old.get(timeout=RESET_READ_TIMEOUT)
+            except queue.Empty:
+                break
+            fresh.put(update)
+            moved += 1
+        self.queues[shard] = fresh
+        old.cancel_join_thread()
+        old.close()
+        base = shard * len(STAT_FIELDS)
+        with self.lock:
+            lost = max(self.queue_depth(shard) - moved, 0)
+            if lost:
+                logging.error(f"Shard {shard} lost {int(lost)} updates")
+            self.stats[base + ERRORS] += lost
+            self.stats[base + HEARTBEAT] = 0.0
+
+    def wait_idle(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while any(self.queue_depth(shard) > 0 for shard in range(self.shards)):
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            self.supervise()
+            time.sleep(0.01)
+        return True
+
+    def register_metrics(self, registry=metrics):
+        for shard in range(self.shards):
+            registry.register_gauge('barkbot_shard_up', lambda shard=shard: int(self.healthy(shard)), shard=shard)
+            registry.register_gauge('barkbot_shard_queue_depth', lambda shard=shard: self.queue_depth(shard), shard=shard)
+            registry.register_gauge('barkbot_shard_processed', lambda shard=shard: self.stat(shard, PROCESSED), shard=shard)
+            registry.register_gauge('barkbot_shard_errors', lambda shard=shard: self.stat(shard, ERRORS), shard=shard)
+            registry.register_gauge('barkbot_shard_busy_seconds', lambda shard=shard: self.stat(shard, BUSY_SECONDS), shard=shard)
+            registry.register_gauge('barkbot_shard_restarts', lambda shard=shard: self.restarts[shard], shard=shard)
+
+    def poll_telegram(self, token, timeout=30, status_interval=60.0):
+        # Raw long polling: updates are routed as JSON dicts, never parsed here
+        from telebot import apihelper
+
+        offset = None
+        last_status = time.monotonic()
+        while not self.stopping:
+            try:
+                updates = apihelper.get_updates(token, offset=offset, timeout=timeout, long_polling_timeout=timeout)
+            except Exception as e:
+                logging.error(f"Error polling Telegram updates: {e}")
+                time.sleep(1)
+                continue
+            for update in updates:
+                self.dispatch(update)
+                offset = update['update_id'] + 1
+            self.supervise()
+            if time.monotonic() - last_status >= status_interval:
+                last_status = time.monotonic()
+                logging.info(f"Shard status: {self.shard_status()}")
+
+    def stop(self, timeout=10.0):
+        self.stopping = True
+        for updates in self.queues:
+            updates.put(None)
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+
+
+def start_candle_store():
+    # Only the front polls prices and writes candle snapshots; bot.py opens
+    # them read-only in workers
+    from candle_store import CandleStore
+    from portfolio import fetch_prices
+
+    store = CandleStore(os.getenv('CANDLE_STORE_DIR', 'candles'), registry=metrics)
+    for mint in filter(None, [os.getenv('BARK_MINT')] + os.getenv('CANDLE_MINTS', '').split(',')):
+        store.track(mint)
+    store.start(fetch_prices, float(os.getenv('CANDLE_POLL_INTERVAL', '10')))
+    return store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run BarkBOT as a front process and N chat-sharded workers")
+    parser.add_argument('--shards', type=int, default=int(os.getenv('BOT_SHARDS', '0')) or None,
+                        help="Worker processes (default: BOT_SHARDS or the CPU count)")
+    parser.add_argument('--threads', type=int, default=int(os.getenv('BOT_SHARD_THREADS', '4')),
+                        help="Handler threads per worker")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    # Snapshots exist before any worker opens them
+    candle_store = start_candle_store()
+    runtime = ShardedRuntime(args.shards, threads=args.threads).start()
+    runtime.register_metrics()
+    if os.getenv('METRICS_PORT'):
+        start_metrics_server(
+            int(os.getenv('METRICS_PORT')), os.getenv('METRICS_HOST', '127.0.0.1'),
+            expose_profile=os.getenv('METRICS_EXPOSE_PROFILE', 'false').lower() == 'true',
+        )
+    try:
+        runtime.poll_telegram(os.getenv('TELEGRAM_TOKEN'))
+    finally:
+        runtime.stop()
+        candle_store.stop()
+
+
+if __name__ == '__main__':
+    main()
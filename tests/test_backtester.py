@@ -0,0 +1,162 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from backtester import (
+    PriceSeries, backtest, backtest_dca, backtest_limit, backtest_stop, load_price_series, parameter_grid, ranked_rows,
+    resolve_series, run_grid,
+)
+
+def random_series(length=2000, seed=3):
+    rng = np.random.default_rng(seed)
+    timestamps = 1700000000 + 60 * np.arange(length, dtype=np.float64)
+    prices = np.exp(np.cumsum(rng.normal(0, 0.01, length))) * 0.001
+    return PriceSeries(timestamps, prices)
+
+def naive_dca(series, frequency, per_cycle, total, min_out, max_out, start):
+    fills, received = 0, 0.0
+    for cycle in range(int(round(total / per_cycle, 9))):
+        t = series.timestamps[0] + start + cycle * frequency
+        if t > series.timestamps[-1]:
+            break
+        price = series.prices[np.searchsorted(series.timestamps, t, side='right') - 1]
+        out = per_cycle / price
+        if (min_out and out < min_out) or (max_out and out > max_out):
+            continue
+        fills += 1
+        received += out
+    return fills, received
+
+def naive_trigger(series, start, trigger, expiry, rising):
+    begin = np.searchsorted(series.timestamps, series.timestamps[0] + start, side='left')
+    for i in range(begin, len(series)):
+        if series.timestamps[i] > series.timestamps[0] + start + expiry:
+            return -1
+        if (series.prices[i] >= trigger) if rising else (series.prices[i] <= trigger):
+            return i
+    return -1
+
+class TestBacktester(unittest.TestCase):
+
+    def setUp(self):
+        self.series = random_series()
+
+    def test_dca_grid_matches_cycle_by_cycle_simulation(self):
+        grid = parameter_grid(
+            cycle_frequency=[60, 600, 3600],
+            in_amount_per_cycle=[0.1, 0.25],
+            total_in_amount=[1, 10, 1000],
+            min_out_amount_per_cycle=[0, 100],
+            max_out_amount_per_cycle=[0, 300],
+            start=[0, 7200],
+        )
+        result = backtest_dca(self.series, **grid)
+        for i in range(len(grid['start'])):
+            fills, received = naive_dca(self.series, *(grid[name][i] for name in grid))
+            self.assertEqual(result['fills'][i], fills)
+            self.assertAlmostEqual(result['received'][i], received, places=6)
+            self.assertAlmostEqual(result['spent'][i], fills * grid['in_amount_per_cycle'][i])
+        filled = result['fills'] > 0
+        np.testing.assert_allclose(result['average_entry'][filled], result['spent'][filled] / result['received'][filled])
+        np.testing.assert_allclose(result['pnl'], result['received'] * self.series.final_price - result['spent'])
+
+    def test_limit_and_stop_triggers_match_scan(self):
+        prices = np.quantile(self.series.prices, [0.05, 0.3, 0.6, 0.95])
+        for start in (0, 3000, 3030, 60000):
+            for expiry in (np.inf, 1800):
+                limit = backtest_limit(self.series, 1.0, 1.0 / prices, start, expiry)
+                stop = backtest_stop(self.series, 1.0, prices, start, expiry)
+                for i, price in enumerate(prices):
+                    hit = naive_trigger(self.series, start, limit['limit_price'][i], expiry, rising=False)
+                    self.assertEqual(limit['fills'][i], int(hit >= 0))
+                    if hit >= 0:
+                        self.assertEqual(limit['fill_time'][i], self.series.timestamps[hit])
+                    hit = naive_trigger(self.series, start, price, expiry, rising=True)
+                    self.assertEqual(stop['fills'][i], int(hit >= 0))
+                    if hit >= 0:
+                        self.assertAlmostEqual(stop['received'][i], 1.0 / self.series.prices[hit])
+
+    def test_invalid_parameters(self):
+        with self.assertRaises(ValueError):
+            backtest_dca(self.series, 0, 1, 10)
+        with self.assertRaises(ValueError):
+            backtest_limit(self.series, 1, 0)
+        with self.assertRaises(ValueError):
+            backtest_dca(self.series, 1, 1, 10)
+        # An absurd total is clipped instead of overflowing the cycle count
+        result = backtest_dca(self.series, 60, 1e-12, 1e12)
+        self.assertEqual(result['fills'][0], len(self.series))
+
+    def test_start_past_the_series_never_fills(self):
+        span = self.series.timestamps[-1] - self.series.timestamps[0]
+        for start in (span + 1, span * 10):
+            self.assertEqual(backtest_stop(self.series, 1, 1e-9, start)['fills'][0], 0)
+            self.assertEqual(backtest_limit(self.series, 1, 1e-9, start)['fills'][0], 0)
+        # The last price itself is still reachable
+        self.assertEqual(backtest_stop(self.series, 1, 1e-9, span)['fill_time'][0], self.series.timestamps[-1])
+
+    def test_work_budget(self):
+        grid = parameter_grid(cycle_frequency=[60, 120], in_amount_per_cycle=1, total_in_amount=1e6, max_out_amount_per_cycle=[0, 1e9])
+        # Two schedules of 2000 and 1000 cycles, one banded row on each
+        backtest_dca(self.series, **grid, max_cells=6000)
+        with self.assertRaises(ValueError):
+            backtest_dca(self.series, **grid, max_cells=5999)
+        starts = 60 * np.arange(10)
+        backtest_stop(self.series, 1, 1, starts, max_cells=2000 * 10 - 45)
+        with self.assertRaises(ValueError):
+            backtest_stop(self.series, 1, 1, starts, max_cells=2000 * 10 - 46)
+
+    def test_load_csv_builds_memory_mapped_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'prices.csv')
+            with open(path, 'w') as out:
+                out.write('timestamp,open,close\n')
+                for i in (2, 0, 1):
+                    out.write(f"{(1700000000 + 60 * i) * 1000},0,{i + 1}\n")
+            series = load_price_series(path)
+            self.assertTrue(os.path.exists(path + '.npy'))
+            self.assertIsInstance(series.prices, np.memmap)
+            np.testing.assert_allclose(series.timestamps, [1700000000, 1700000060, 1700000120])
+            np.testing.assert_allclose(series.prices, [1, 2, 3])
+            self.assertIs(load_price_series(path), series)
+
+    def test_ranked_rows(self):
+        grid, result = run_grid(self.series, 'stop', in_amount=[1, 2], stop_price=[0.0001, 1e9])
+        rows = ranked_rows(grid, result, limit=4)
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[-1]['fills'], 0)
+        self.assertIsNone(rows[-1]['average_entry'])
+        self.assertGreaterEqual(rows[0]['pnl'], rows[1]['pnl'])
+
+    def test_backtest_entry_point_validates_requests(self):
+        with tempfile.TemporaryDirectory() as directory:
+            np.save(os.path.join(directory, 'bark.npy'), np.column_stack([self.series.timestamps, self.series.prices]))
+            path = resolve_series(directory, 'bark.npy')
+            report = backtest(path, 'dca', {'cycle_frequency': [60, 3600], 'in_amount_per_cycle': 0.1, 'total_in_amount': [1, 2]}, limit=3)
+            self.assertEqual(report['combinations'], 4)
+            self.assertEqual(len(report['results']), 3)
+            for name in ('../bark.npy', 'missing.npy', ''):
+                with self.assertRaises(ValueError):
+                    resolve_series(directory, name)
+            with self.assertRaises(ValueError):
+                backtest(path, 'martingale', {})
+            with self.assertRaises(ValueError):
+                backtest(path, 'stop', {'in_amount': 1})
+            with self.assertRaises(ValueError):
+                backtest(path, 'stop', {'in_amount': 1, 'stop_price': 1, 'leverage': 5})
+            with self.assertRaises(ValueError):
+                backtest(path, 'stop', {'in_amount': range(100), 'stop_price': range(1, 101)}, max_combinations=1000)
+            with self.assertRaises(ValueError):
+                backtest(path, 'stop', {'in_amount': [[1, 2], [3, 4]], 'stop_price': 1}, max_combinations=3)
+            with self.assertRaises(ValueError):
+                backtest(path, 'stop', {'in_amount': [1, [2, 3]], 'stop_price': 1})
+            for bad in (float('nan'), float('inf'), [1, float('-inf')]):
+                with self.assertRaises(ValueError):
+                    backtest(path, 'stop', {'in_amount': 1, 'stop_price': bad})
+            with self.assertRaises(ValueError):
+                backtest(path, 'stop', {'in_amount': 1, 'stop_price': 1, 'start': 60 * np.arange(100)}, max_cells=1000)
+
+if __name__ == '__main__':
+    unittest.main()
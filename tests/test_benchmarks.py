@@ -0,0 +1,100 @@
+import json
+import unittest
+import urllib.error
+import urllib.request
+
+from benchmarks.adapters import JupiterTradingAPI, RPCSolanaAPI
+from benchmarks.fakes import FakeJupiter, FakeServer, FakeSolanaRPC, FakeTelegram
+from benchmarks.harness import compare, percentile, run_operations, summarize
+from benchmarks.scenarios import checked_reply
+
+def post_json(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(), headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+class TestBenchmarkFakes(unittest.TestCase):
+
+    def test_fake_rpc_answers_and_injects_errors(self):
+        with FakeSolanaRPC(balance=42) as rpc:
+            response = post_json(rpc.url, {'jsonrpc': '2.0', 'id': 1, 'method': 'getBalance', 'params': ['x']})
+            self.assertEqual(response['result']['value'], 42)
+        with FakeSolanaRPC(error_rate=1.0) as rpc:
+            response = post_json(rpc.url, {'jsonrpc': '2.0', 'id': 1, 'method': 'getBalance', 'params': ['x']})
+            self.assertEqual(response['error']['code'], -32005)
+
+    def test_fake_telegram_records_messages(self):
+        with FakeTelegram() as telegram:
+            response = post_json(telegram.api_url().format('123:abc', 'sendMessage'), {'chat_id': 7, 'text': 'hi'})
+            self.assertTrue(response['ok'])
+            self.assertEqual(response['result']['chat']['id'], 7)
+            self.assertEqual(telegram.sent[-1]['text'], 'hi')
+            self.assertEqual(telegram.replies_to(7), ['hi'])
+
+    def test_unknown_routes_are_not_found(self):
+        with FakeServer() as server:
+            with self.assertRaises(urllib.error.HTTPError) as raised:
+                post_json(server.url + '/anything', {})
+            self.assertEqual(raised.exception.code, 404)
+
+class TestServiceAdapters(unittest.TestCase):
+
+    def test_adapters_read_from_the_fakes(self):
+        from solders.pubkey import Pubkey
+        mint = 'BARKhLzdWbyZiP3LNoD9boy7MrAy4CVXEToDyYGeEBKF'
+        owner = str(Pubkey.new_unique())
+        with FakeSolanaRPC(balance=2000000000) as rpc, FakeJupiter(price=0.5) as jupiter:
+            self.assertEqual(RPCSolanaAPI(rpc.url).get_balance(owner), 2.0)
+            trading_api = JupiterTradingAPI(jupiter.url, rpc.url, mint)
+            self.assertEqual(trading_api.get_market_data()['latest_price'], 0.5)
+            self.assertEqual(trading_api.get_token_info(mint)['price'], 0.5)
+            self.assertEqual(trading_api.get_token_balance(owner, mint), 0)
+            self.assertEqual(jupiter.requests, 2)
+
+class TestHarness(unittest.TestCase):
+
+    def test_run_operations_counts_errors(self):
+        operations = [lambda: None] * 9 + [lambda: 1 / 0]
+        result = run_operations(operations, concurrency=4)
+        self.assertEqual(result['operations'], 10)
+        self.assertEqual(result['errors'], 1)
+        self.assertIn('p99', result['latency_ms'])
+
+    def test_error_replies_count_as_errors(self):
+        with FakeTelegram() as telegram:
+            url = telegram.api_url().format('123:abc', 'sendMessage')
+            operations = [
+                checked_reply(telegram, chat_id, lambda chat_id=chat_id: post_json(url, {
+                    'chat_id': chat_id, 'text': '❌ Failed to retrieve balances' if chat_id % 4 == 0 else '✅ Done',
+                }))
+                for chat_id in range(1, 21)
+            ]
+            result = run_operations(operations, concurrency=4)
+        self.assertEqual(result['operations'], 20)
+        self.assertEqual(result['errors'], 5)
+        self.assertAlmostEqual(result['error_rate'], 0.25)
+
+    def test_injected_server_errors_surface_in_results(self):
+        with FakeTelegram(error_rate=1.0) as telegram:
+            url = telegram.api_url().format('123:abc', 'sendMessage')
+            result = run_operations([lambda: post_json(url, {'chat_id': 1, 'text': 'hi'})] * 5, concurrency=2)
+        self.assertEqual(result['errors'], 5)
+        self.assertEqual(result['latency_ms']['p50'], 0.0)
+
+    def test_summary_percentiles(self):
+        values = [i / 1000 for i in range(1, 101)]
+        self.assertEqual(percentile(values, 0.5), 0.051)
+        self.assertEqual(percentile(values, 0.99), 0.099)
+        self.assertEqual(percentile([], 0.5), 0.0)
+        summary = summarize(values, 0, 2.0)
+        self.assertEqual(summary['throughput_ops'], 50.0)
+        self.assertAlmostEqual(summary['latency_ms']['max'], 100.0)
+        self.assertAlmostEqual(summary['latency_ms']['mean'], 50.5)
+
+    def test_compare_reports_relative_change(self):
+        baseline = {'scenarios': {'swap_burst': summarize([0.01] * 10, 0, 1.0)}}
+        current = {'scenarios': {'swap_burst': summarize([0.01] * 20, 0, 1.0)}}
+        self.assertAlmostEqual(compare(current, baseline)['swap_burst']['throughput_change'], 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,15 @@
 import unittest
 from unittest.mock import patch, MagicMock
-from bot import get_balances, execute_buy, execute_withdraw_sol, user_manager, jupiter_swap_api, solana_api, bot
+from solders.keypair import Keypair
+from withdrawal_engine import CONFIRMED, WithdrawalResult
+import bot as bot_module
+from bot import get_balances, execute_buy, execute_withdraw_sol, user_manager, trading_api, solana_api, withdrawal_engine, bot
 
 class TestBarkBOT(unittest.TestCase):
 
     @patch('test_bot.user_manager.get_wallet')
     @patch('test_bot.solana_api.get_balance')
-    @patch('test_bot.jupiter_swap_api.get_token_balance')
+    @patch('test_bot.trading_api.get_token_balance')
     def test_get_balances(self, mock_get_token_balance, mock_get_balance, mock_get_wallet):
         mock_get_wallet.return_value = {'public_key': 'mock_public_key'}
         mock_get_balance.return_value = 10.0
@@ -17,8 +20,8 @@ class TestBarkBOT(unittest.TestCase):
         self.assertEqual(bark_balance, 100.0)
 
     @patch('test_bot.user_manager.get_wallet')
-    @patch('test_bot.jupiter_swap_api.buy_token')
-    @patch('test_bot.jupiter_swap_api.get_transaction_receipt')
+    @patch('test_bot.trading_api.buy_token')
+    @patch('test_bot.trading_api.get_transaction_receipt')
     def test_execute_buy(self, mock_get_transaction_receipt, mock_buy_token, mock_get_wallet):
         mock_get_wallet.return_value = {'public_key': 'mock_public_key'}
         mock_buy_token.return_value = 'mock_tx_id'
@@ -30,15 +33,32 @@ class TestBarkBOT(unittest.TestCase):
         bot.reply_to.assert_called_with(message, '✅ Successfully purchased tokens at address mock_token_address.\nTransaction Receipt:\nmock_receipt')
 
     @patch('test_bot.user_manager.get_wallet')
-    @patch('test_bot.solana_api.transfer_sol')
-    def test_execute_withdraw_sol(self, mock_transfer_sol, mock_get_wallet):
-        mock_get_wallet.return_value = {'public_key': 'mock_public_key'}
+    @patch('test_bot.withdrawal_engine.execute')
+    def test_execute_withdraw_sol(self, mock_execute, mock_get_wallet):
+        keypair = Keypair()
+        recipient_address = str(Keypair().pubkey())
+        mock_get_wallet.return_value = {'public_key': str(keypair.pubkey()), 'private_key': str(keypair)}
+        mock_execute.side_effect = lambda intents: [WithdrawalResult(intent, signature='mock_signature', status=CONFIRMED) for intent in intents]
         message = MagicMock()
-        message.text = '0.1 mock_recipient_address'
+        message.text = f'0.1 {recipient_address}'
 
         execute_withdraw_sol(message)
-        mock_transfer_sol.assert_called_with('mock_public_key', 'mock_recipient_address', 0.1)
-        bot.reply_to.assert_called_with(message, '✅ Successfully transferred 0.1 SOL to mock_recipient_address.')
+        intent = mock_execute.call_args[0][0][0]
+        self.assertEqual(intent.amount, 100000000)
+        self.assertEqual(str(intent.recipient), recipient_address)
+        bot.reply_to.assert_called_with(message, f'✅ Successfully transferred 0.1 SOL to {recipient_address}.')
+
+    def test_pending_referrers_are_bounded(self):
+        with patch.object(bot_module, 'MAX_PENDING_REFERRERS', 2), patch.dict(bot_module.pending_referrers, clear=True):
+            for user_id in range(5):
+                bot_module.remember_referrer(user_id, 100 + user_id)
+            self.assertEqual(list(bot_module.pending_referrers), [3, 4])
+            self.assertIsNone(bot_module.take_referrer(0))
+            self.assertEqual(bot_module.take_referrer(4), 104)
+            self.assertIsNone(bot_module.take_referrer(4))
+            bot_module.remember_referrer(5, 105)
+            with patch.object(bot_module, 'PENDING_REFERRER_TTL', -1):
+                self.assertIsNone(bot_module.take_referrer(5))
 
 if __name__ == '__main__':
     unittest.main()
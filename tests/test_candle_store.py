@@ -0,0 +1,106 @@
+import math
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from candle_store import CLOSE, HIGH, LOW, OPEN, TS, VOLUME, CandleRing, CandleStore, sparkline, vwap
+from instrumentation import MetricsRegistry
+
+MINT = 'BARKhLzdWbyZiP3LNoD9boy7MrAy4CVXEToDyYGeEBKF'
+START = 1700000040  # a minute boundary
+
+class TestCandleStore(unittest.TestCase):
+
+    def test_ticks_roll_up_into_every_resolution(self):
+        store = CandleStore()
+        store.ingest(MINT, 1.0, 10, ts=START)
+        store.ingest(MINT, 3.0, 10, ts=START + 20)
+        store.ingest(MINT, 2.0, 20, ts=START + 70)
+        minute = store.candles(MINT, '1m')
+        self.assertEqual(len(minute), 2)
+        np.testing.assert_allclose(minute[0, [TS, OPEN, HIGH, LOW, CLOSE, VOLUME]], [START, 1, 3, 1, 3, 20])
+        hour = store.candles(MINT, '1h')
+        self.assertEqual(len(hour), 1)
+        np.testing.assert_allclose(hour[0, [OPEN, HIGH, LOW, CLOSE, VOLUME]], [1, 3, 1, 2, 40])
+        self.assertAlmostEqual(store.vwap(MINT, '1h'), (10 + 30 + 40) / 40)
+
+    def test_gaps_are_filled_and_late_ticks_land_in_their_candle(self):
+        ring = CandleRing(60, 10)
+        ring.ingest(START, 1.0)
+        ring.ingest(START + 180, 2.0)
+        candles = ring.candles()
+        np.testing.assert_allclose(candles[:, TS], [START, START + 60, START + 120, START + 180])
+        np.testing.assert_allclose(candles[:, CLOSE], [1, 1, 1, 2])
+        ring.ingest(START + 5, 0.5)
+        self.assertEqual(ring.candles()[0, LOW], 0.5)
+        self.assertEqual(ring.candles()[0, CLOSE], 1.0)
+
+    def test_ring_is_bounded_and_keeps_newest(self):
+        ring = CandleRing(60, 5)
+        for i in range(12):
+            ring.ingest(START + i * 60, float(i + 1))
+        candles = ring.candles()
+        self.assertEqual(len(candles), 5)
+        np.testing.assert_allclose(candles[:, CLOSE], [8, 9, 10, 11, 12])
+        ring.ingest(START, 100.0)
+        self.assertEqual(ring.late_ticks, 1)
+
+    def test_indicators(self):
+        store = CandleStore()
+        closes = [1.0, 2.0, 4.0, 8.0]
+        for i, price in enumerate(closes):
+            store.ingest(MINT, price, ts=START + i * 60)
+        self.assertAlmostEqual(store.sma(MINT, '1m', 2), 6.0)
+        self.assertAlmostEqual(store.volatility(MINT, '1m', 3), 0.0)
+        self.assertAlmostEqual(vwap(store.candles(MINT, '1m')), np.mean(closes))
+        self.assertTrue(math.isnan(store.sma('unknown', '1m', 5)))
+        self.assertEqual(sparkline([1, 2, 3]), '▁▅█')
+
+    def test_snapshots_survive_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = CandleStore(directory, capacities={'1m': 3})
+            for i in range(5):
+                store.ingest(MINT, float(i + 1), ts=START + i * 60)
+            store.flush()
+            self.assertTrue(os.path.exists(os.path.join(directory, f"{MINT}_1m.npy")))
+            restored = CandleStore(directory, capacities={'1m': 3})
+            self.assertEqual(restored.tracked(), [MINT])
+            np.testing.assert_allclose(restored.candles(MINT, '1m')[:, CLOSE], [3, 4, 5])
+            restored.ingest(MINT, 6.0, ts=START + 300)
+            np.testing.assert_allclose(restored.candles(MINT, '1m')[:, CLOSE], [4, 5, 6])
+            resized = CandleStore(directory, capacities={'1m': 2})
+            np.testing.assert_allclose(resized.candles(MINT, '1m')[:, CLOSE], [5, 6])
+
+    def test_readonly_store_follows_the_writer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            reader = CandleStore(directory, readonly=True)
+            self.assertEqual(len(reader.candles(MINT, '1m')), 0)
+            writer = CandleStore(directory)
+            writer.ingest(MINT, 1.0, ts=START)
+            np.testing.assert_allclose(reader.candles(MINT, '1m')[:, CLOSE], [1])
+            writer.ingest(MINT, 2.0, ts=START + 60)
+            np.testing.assert_allclose(reader.candles(MINT, '1m')[:, CLOSE], [1, 2])
+            reader.ingest(MINT, 9.0, ts=START + 120)
+            np.testing.assert_allclose(writer.candles(MINT, '1m')[:, CLOSE], [1, 2])
+
+    def test_memory_is_fixed_per_mint_and_reported(self):
+        registry = MetricsRegistry()
+        store = CandleStore(registry=registry)
+        store.ingest(MINT, 1.0, ts=START)
+        before = store.memory_usage(MINT)
+        for i in range(5000):
+            store.ingest(MINT, 1.0 + i, ts=START + i * 60)
+        self.assertEqual(store.memory_usage(MINT), before)
+        self.assertEqual(before, store.bytes_per_mint())
+        self.assertIn(f'barkbot_candle_store_bytes{{mint="{MINT}"}} {before}', registry.render())
+
+    def test_poll_ingests_fetched_prices(self):
+        store = CandleStore()
+        store.track(MINT)
+        self.assertEqual(store.poll(lambda mints: dict.fromkeys(mints, 2.5)), 1)
+        self.assertEqual(store.candles(MINT, '1d')[-1, CLOSE], 2.5)
+
+if __name__ == '__main__':
+    unittest.main()
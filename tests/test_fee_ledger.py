@@ -0,0 +1,155 @@
+import os
+import random
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from fee_ledger import DEFAULT_SPLITS, FeeLedger, allocate, parse_splits
+
+SOL_MINT = 'So11111111111111111111111111111111111111112'
+USDC_MINT = 'EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v'
+
+class TestFeeLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.audit_path = os.path.join(self.tmpdir.name, 'fee_audit.log')
+        self.ledger = FeeLedger(DEFAULT_SPLITS, fee_bps=20, audit_path=self.audit_path)
+
+    def tearDown(self):
+        self.ledger.close()
+        self.tmpdir.cleanup()
+
+    def test_allocate_sums_to_fee(self):
+        for fee in (1, 3, 7, 9999, 10**12 + 7):
+            allocations = allocate(fee, DEFAULT_SPLITS)
+            self.assertEqual(sum(allocations), fee)
+            self.assertTrue(all(isinstance(amount, int) for amount in allocations))
+
+    def test_parse_splits_rejects_bad_totals(self):
+        self.assertEqual(parse_splits('buyback=6000,charity=4000'), (('buyback', 6000), ('charity', 4000)))
+        with self.assertRaises(ValueError):
+            parse_splits('buyback=6000,charity=3000')
+
+    def test_buybacks_are_aggregated_per_mint(self):
+        for _ in range(100):
+            self.ledger.record_fee('swap', 1, SOL_MINT, 1000)
+        swaps = []
+        executed = self.ledger.run_buybacks(lambda mint, amount: swaps.append((mint, amount)) or 'tx')
+        self.assertEqual(swaps, [(SOL_MINT, 50000)])
+        self.assertEqual(executed, {SOL_MINT: 50000})
+        self.assertEqual(self.ledger.take_buyback(), {})
+
+    def test_failed_buyback_is_restored(self):
+        self.ledger.record_fee('swap', 1, SOL_MINT, 1000)
+        self.ledger.run_buybacks(lambda mint, amount: 1 / 0)
+        self.assertEqual(self.ledger.pending_buyback, {SOL_MINT: 500})
+
+    def test_reconciliation_after_random_fills_and_restart(self):
+        rng = random.Random(7)
+        for i in range(5000):
+            source = rng.choice(['swap', 'limit_order', 'dca'])
+            mint = rng.choice([SOL_MINT, USDC_MINT])
+            self.ledger.record_fee(source, i % 13, mint, self.ledger.platform_fee(rng.randint(1, 10**10)))
+            if i % 1000 == 999:
+                self.ledger.run_buybacks(lambda mint, amount: 'tx')
+        self.assertEqual(self.ledger.reconcile(), [])
+        snapshot = self.ledger.snapshot()
+        self.ledger.close()
+        self.ledger = FeeLedger(DEFAULT_SPLITS, fee_bps=20, audit_path=self.audit_path)
+        self.assertEqual(self.ledger.snapshot()['totals'], snapshot['totals'])
+        self.assertEqual(self.ledger.reconcile(), [])
+
+    def test_torn_trailing_record_is_dropped(self):
+        self.ledger.record_fee('swap', 1, SOL_MINT, 1000)
+        self.ledger.close()
+        with open(self.audit_path, 'a') as audit_file:
+            audit_file.write('{"type":"fee","mint":"' + SOL_MINT)
+        self.ledger = FeeLedger(DEFAULT_SPLITS, fee_bps=20, audit_path=self.audit_path)
+        self.assertEqual(self.ledger.fees, {SOL_MINT: 1000})
+        self.ledger.record_fee('swap', 1, SOL_MINT, 1000)
+        self.assertEqual(self.ledger.reconcile(), [])
+        with open(self.audit_path) as audit_file:
+            self.assertEqual(len(audit_file.read().splitlines()), 2)
+
+    def test_one_owner_buys_back_every_process_share(self):
+        other = FeeLedger(DEFAULT_SPLITS, fee_bps=20, audit_path=self.audit_path)
+        try:
+            self.ledger.record_fee('swap', 1, SOL_MINT, 1000)
+            other.record_fee('swap', 2, SOL_MINT, 3000)
+            # Normally the other process's writer thread does this
+            other.flush()
+            swaps = []
+            execute = lambda mint, amount: swaps.append((mint, amount)) or 'tx'
+            self.assertEqual(self.ledger.run_buybacks(execute), {SOL_MINT: 2000})
+            self.assertEqual(other.run_buybacks(execute), {})
+            self.assertEqual(swaps, [(SOL_MINT, 2000)])
+            self.assertEqual(self.ledger.reconcile(), [])
+            self.assertEqual(other.reconcile(), [])
+            # The owner goes away and the other process takes over
+            self.ledger.close()
+            other.record_fee('swap', 2, SOL_MINT, 1000)
+            self.assertEqual(other.run_buybacks(execute), {SOL_MINT: 500})
+        finally:
+            other.close()
+
+    def test_fills_are_group_committed(self):
+        for i in range(1000):
+            self.ledger.record_fee('swap', i, SOL_MINT, 2000)
+        self.assertEqual(self.ledger.fees, {})
+        with mock.patch('fee_ledger.os.fsync', wraps=os.fsync) as fsync:
+            self.assertEqual(self.ledger.flush(), 1000)
+        self.assertEqual(fsync.call_count, 1)
+        self.assertEqual(self.ledger.fees, {SOL_MINT: 2000000})
+        with open(self.audit_path) as audit_file:
+            self.assertEqual(len(audit_file.read().splitlines()), 1000)
+
+    def test_failed_write_keeps_fills_queued(self):
+        self.ledger.record_fee('swap', 1, SOL_MINT, 1000)
+        with mock.patch('fee_ledger.os.fsync', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                self.ledger.flush()
+        self.assertEqual(self.ledger.queue_depth(), 1)
+        self.assertEqual(os.path.getsize(self.audit_path), 0)
+        self.ledger.flush()
+        self.assertEqual(self.ledger.fees, {SOL_MINT: 1000})
+        self.assertEqual(self.ledger.reconcile(), [])
+
+    def test_swap_fee_is_booked_on_confirmation(self):
+        booked = []
+        statuses = {'sig-ok': 'confirmed', 'sig-failed': 'failed', 'sig-pending': 'pending'}
+        self.ledger.check_fees = lambda pending: {signature: statuses[signature] for signature in pending}
+        self.ledger.booked = lambda telegram_id, mint, fee: booked.append((telegram_id, mint, fee))
+        self.ledger.record_fee('swap', 1, SOL_MINT, 1000, 'sig-ok', 100)
+        self.ledger.record_fee('swap', 2, SOL_MINT, 3000, 'sig-failed', 100)
+        self.ledger.record_fee('swap', 3, SOL_MINT, 5000, 'sig-pending', 100)
+        self.assertEqual(self.ledger.snapshot()['fees'], {})
+        self.assertEqual(self.ledger.run_buybacks(lambda mint, amount: 'tx'), {})
+        self.assertEqual(len(self.ledger.confirm_fees()), 1)
+        self.assertEqual(booked, [(1, SOL_MINT, 1000)])
+        snapshot = self.ledger.snapshot()
+        self.assertEqual(snapshot['fees'], {SOL_MINT: 1000})
+        self.assertEqual(snapshot['pending_fees'], {'sig-pending': 5000})
+        # A second confirmation pass books nothing twice
+        self.ledger.confirm_fees()
+        self.assertEqual(booked, [(1, SOL_MINT, 1000)])
+        self.assertEqual(self.ledger.reconcile(), [])
+        # The pending fee survives a restart
+        self.ledger.close()
+        self.ledger = FeeLedger(DEFAULT_SPLITS, fee_bps=20, audit_path=self.audit_path)
+        self.assertEqual(self.ledger.snapshot()['pending_fees'], {'sig-pending': 5000})
+        self.assertEqual(self.ledger.fees, {SOL_MINT: 1000})
+
+    def test_enqueue_throughput(self):
+        # The request path only enqueues; the writer thread does the I/O
+        fills = 20000
+        start = time.perf_counter()
+        for i in range(fills):
+            self.ledger.record_fee('swap', i, SOL_MINT, 2000)
+        self.assertGreater(fills / (time.perf_counter() - start), 5000)
+        self.assertEqual(self.ledger.flush(), fills)
+        self.assertEqual(self.ledger.reconcile(), [])
+
+if __name__ == '__main__':
+    unittest.main()
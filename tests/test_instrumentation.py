@@ -0,0 +1,90 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import instrumentation
+from instrumentation import Histogram, MetricsRegistry, SamplingProfiler, instrument, start_metrics_server
+
+class Service:
+    def lookup(self, value):
+        return value * 2
+
+    async def fetch(self, value):
+        return value + 1
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_histogram_quantiles(self):
+        histogram = Histogram()
+        for _ in range(90):
+            histogram.observe(0.002)
+        for _ in range(10):
+            histogram.observe(2.0)
+        self.assertLessEqual(histogram.quantile(0.5), 0.0025)
+        self.assertGreater(histogram.quantile(0.99), 1.0)
+        self.assertEqual(histogram.count, 100)
+
+    def test_instrumented_service_times_sync_and_async_calls(self):
+        service = instrument(Service(), 'jupiter', registry=self.registry)
+        self.assertEqual(service.lookup(2), 4)
+        self.assertEqual(asyncio.run(service.fetch(2)), 3)
+        self.assertEqual(self.registry.histogram('barkbot_call_seconds', service='jupiter', method='lookup').count, 1)
+        self.assertEqual(self.registry.histogram('barkbot_call_seconds', service='jupiter', method='fetch').count, 1)
+
+    def test_render_prometheus(self):
+        with self.registry.span('barkbot_handler_seconds', handler='refresh_balance'):
+            pass
+        self.registry.register_gauge('barkbot_queue_depth', lambda: 3, queue='referral_accrual')
+        text = self.registry.render()
+        self.assertIn('# TYPE barkbot_handler_seconds histogram', text)
+        self.assertIn('barkbot_handler_seconds_bucket{handler="refresh_balance",le="+Inf"} 1', text)
+        self.assertIn('barkbot_handler_seconds_quantile{handler="refresh_balance",quantile="0.99"}', text)
+        self.assertIn('barkbot_queue_depth{queue="referral_accrual"} 3', text)
+
+    def test_span_overhead_is_small_relative_to_handler_time(self):
+        # A typical handler spends milliseconds on the network; a span must
+        # cost well under 2% of that.
+        iterations = 20000
+        start = time.perf_counter()
+        for _ in range(iterations):
+            with self.registry.span('barkbot_handler_seconds', handler='refresh_balance'):
+                pass
+        per_span = (time.perf_counter() - start) / iterations
+        self.assertLess(per_span, 0.02 * 0.001)
+
+    def test_sampling_profiler_collects_stacks(self):
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start()
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            sum(range(1000))
+        profiler.stop()
+        self.assertIn('test_sampling_profiler_collects_stacks', profiler.collapsed())
+
+    def test_metrics_server_is_local_and_profile_is_opt_in(self):
+        profiler = SamplingProfiler()
+        profiler.samples['bot.py:main;bot.py:handle'] = 3
+        with patch.object(instrumentation, 'profiler', profiler):
+            for expose_profile in (False, True):
+                server = start_metrics_server(0, expose_profile=expose_profile)
+                try:
+                    host, port = server.server_address
+                    self.assertEqual(host, '127.0.0.1')
+                    self.assertEqual(urlopen(f'http://{host}:{port}/metrics').status, 200)
+                    if expose_profile:
+                        self.assertIn(b'bot.py:handle 3', urlopen(f'http://{host}:{port}/profile').read())
+                    else:
+                        with self.assertRaises(HTTPError):
+                            urlopen(f'http://{host}:{port}/profile')
+                finally:
+                    server.shutdown()
+                    server.server_close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from portfolio import SOL_MINT, cost_basis_from_fills, fetch_prices, fetch_token_accounts, value_holdings, value_positions
+
+BARK_MINT = 'BARKhLzdWbyZiP3LNoD9boy7MrAy4CVXEToDyYGeEBKF'
+USDC_MINT = 'EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v'
+OWNER = '9tV5oXSkPzYBwZJCnreMA4Q2NYZox7snJYEbxmFEaSac'
+
+def token_account(mint, amount, decimals):
+    parsed = {'info': {'mint': mint, 'tokenAmount': {'amount': str(amount), 'decimals': decimals}}}
+    return SimpleNamespace(account=SimpleNamespace(data=SimpleNamespace(parsed=parsed)))
+
+class TestPortfolio(unittest.TestCase):
+
+    def test_value_positions_matches_per_token_math(self):
+        wallet_index = np.array([0, 0, 1, 1, 1])
+        amounts = np.array([10.0, 5.0, 1.0, 2.0, 0.0])
+        prices = np.array([2.0, 4.0, np.nan, 3.0, 1.0])
+        costs = np.array([1.0, np.nan, 1.0, 3.0, 1.0])
+        result = value_positions(wallet_index, amounts, prices, costs)
+        np.testing.assert_allclose(result['value'], [20.0, 20.0, 0.0, 6.0, 0.0])
+        np.testing.assert_allclose(result['wallet_value'], [40.0, 6.0])
+        np.testing.assert_allclose(result['allocation'], [0.5, 0.5, 0.0, 1.0, 0.0])
+        self.assertEqual(result['pnl'][0], 10.0)
+        self.assertTrue(np.isnan(result['pnl_pct'][1]))
+        # The unpriced position has no PNL and is left out of the total
+        np.testing.assert_allclose(result['wallet_pnl'], [10.0, 0.0])
+
+    def test_value_holdings_across_wallets(self):
+        holdings = [{BARK_MINT: 1000.0, SOL_MINT: 1.0}, {USDC_MINT: 50.0}, {}]
+        prices = {BARK_MINT: 0.0001, SOL_MINT: 1.0, USDC_MINT: 0.006}
+        result = value_holdings(holdings, prices, {BARK_MINT: 0.00005, (1, USDC_MINT): 0.005})
+        np.testing.assert_allclose(result['wallet_value'], [1.1, 0.3, 0.0])
+        np.testing.assert_allclose(result['wallet_pnl'], [0.05, 0.05, 0.0])
+
+    def test_unknown_price_leaves_pnl_unknown(self):
+        result = value_positions([0], [10.0], [np.nan], [1.0])
+        self.assertTrue(np.isnan(result['pnl'][0]))
+        self.assertEqual(result['wallet_pnl'][0], 0.0)
+
+    def test_cost_basis_from_fills(self):
+        fills = [
+            {'mint': BARK_MINT, 'amount': 1.0, 'price': 0.0001, 'status': 'completed'},
+            {'mint': BARK_MINT, 'amount': 1.0, 'price': 0.0003, 'status': 'completed'},
+            {'mint': BARK_MINT, 'amount': 5.0, 'price': 0.1, 'status': 'failed'},
+            {'mint': USDC_MINT, 'amount': 1.0, 'price': 0.01, 'side': 'sell'},
+            {'date': '2024-01-01', 'amount': 2.0, 'status': 'completed'},
+        ]
+        basis = cost_basis_from_fills(fills)
+        self.assertEqual(list(basis), [BARK_MINT])
+        # 2 SOL bought 10000 + 3333.3 BARK
+        self.assertAlmostEqual(basis[BARK_MINT], 2.0 / (1.0 / 0.0001 + 1.0 / 0.0003))
+        self.assertEqual(cost_basis_from_fills([]), {})
+
+    def test_fetch_token_accounts_queries_each_program_once(self):
+        client = MagicMock()
+        client.get_token_accounts_by_owner_json_parsed.side_effect = [
+            SimpleNamespace(value=[token_account(USDC_MINT, 5000000, 6)]),
+            SimpleNamespace(value=[token_account(BARK_MINT, 1500, 3), token_account(BARK_MINT, 500, 3)]),
+        ]
+        balances = fetch_token_accounts(client, OWNER)
+        self.assertEqual(balances, {USDC_MINT: 5.0, BARK_MINT: 2.0})
+        self.assertEqual(client.get_token_accounts_by_owner_json_parsed.call_count, 2)
+
+    def test_fetch_prices_batches_requests(self):
+        session = MagicMock()
+        session.get.return_value.json.side_effect = lambda: {'data': {BARK_MINT: {'price': '0.0001'}, USDC_MINT: None}}
+        mints = [BARK_MINT, USDC_MINT] + [f'mint{i}' for i in range(150)]
+        prices = fetch_prices(mints, session=session)
+        self.assertEqual(session.get.call_count, 2)
+        self.assertEqual(prices, {BARK_MINT: 0.0001})
+
+if __name__ == '__main__':
+    unittest.main()
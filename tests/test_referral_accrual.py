@@ -0,0 +1,102 @@
+import random
+import time
+import unittest
+
+from referral_accrual import MemoryReferralLedger, ReferralAccrual, recompute_balances
+
+SOL_MINT = 'So11111111111111111111111111111111111111112'
+BARK_MINT = 'BARKhLzdWbyZiP3LNoD9boy7MrAy4CVXEToDyYGeEBKF'
+
+class TestReferralAccrual(unittest.TestCase):
+
+    def setUp(self):
+        self.referrers = {user_id: 1000 + user_id % 7 for user_id in range(50) if user_id % 3}
+        self.ledger = MemoryReferralLedger(self.referrers)
+        self.accrual = ReferralAccrual(self.ledger, reward_bps=2000, max_batch=97)
+
+    def test_incremental_flushes_match_full_recompute(self):
+        rng = random.Random(42)
+        events = []
+        for _ in range(20):
+            for _ in range(rng.randint(0, 500)):
+                event = (rng.randrange(50), rng.choice([SOL_MINT, BARK_MINT]), rng.randint(1, 10**7))
+                events.append(event)
+                self.accrual.record_fill(*event)
+            self.accrual.flush()
+        self.assertEqual(self.accrual.queue_depth(), 0)
+        self.assertEqual(self.ledger.balances, recompute_balances(events, self.referrers, 2000))
+
+    def test_failed_flush_keeps_events(self):
+        self.accrual.record_fill(1, SOL_MINT, 10000)
+        self.ledger.get_referrers = lambda telegram_ids: 1 / 0
+        with self.assertRaises(ZeroDivisionError):
+            self.accrual.flush()
+        self.assertEqual(self.accrual.queue_depth(), 1)
+
+    def pay(self, statuses):
+        # Fake payout: one transaction per balance, recorded before "sending"
+        def payout(balances, record):
+            sent = {}
+            for index, (key, amount) in enumerate(sorted(balances.items())):
+                signature = f'sig-{len(self.ledger.payouts)}'
+                record({key: amount}, signature, 1000)
+                sent[signature] = statuses[index]
+            return sent
+        return payout
+
+    def test_settle_marks_only_confirmed_balances(self):
+        self.accrual.payout = self.pay(['confirmed', 'failed'])
+        self.accrual.record_fill(1, SOL_MINT, 10000)
+        self.accrual.record_fill(2, BARK_MINT, 10000)
+        paid = self.accrual.settle()
+        self.assertEqual(paid, {(1001, SOL_MINT): 2000})
+        self.assertEqual(self.ledger.get_referral_balances(), {(1002, BARK_MINT): 2000})
+
+    def test_pending_payout_is_not_paid_twice(self):
+        self.accrual.payout = self.pay(['pending'])
+        self.accrual.record_fill(1, SOL_MINT, 10000)
+        self.assertEqual(self.accrual.settle(), {})
+        self.assertEqual(self.ledger.get_referral_balances(), {})
+        self.assertEqual(self.ledger.get_pending_referral_payouts(), {'sig-0': 1000})
+        # Next round: the earlier transfer turns out to have landed
+        self.accrual.check_payouts = lambda pending: {signature: 'confirmed' for signature in pending}
+        self.accrual.payout = lambda balances, record: self.fail("nothing is owed")
+        self.assertEqual(self.accrual.settle(), {(1001, SOL_MINT): 2000})
+        self.assertEqual(self.ledger.get_pending_referral_payouts(), {})
+
+    def test_failed_payout_is_released_and_paid_again(self):
+        self.accrual.payout = self.pay(['pending'])
+        self.accrual.record_fill(1, SOL_MINT, 10000)
+        self.accrual.settle()
+        self.accrual.check_payouts = lambda pending: {signature: 'failed' for signature in pending}
+        self.accrual.payout = self.pay(['confirmed'])
+        self.assertEqual(self.accrual.settle(), {(1001, SOL_MINT): 2000})
+        self.assertEqual(self.ledger.paid, {(1001, SOL_MINT): 2000})
+
+    def test_only_one_settlement_at_a_time(self):
+        self.accrual.record_fill(1, SOL_MINT, 10000)
+        other = ReferralAccrual(self.ledger, reward_bps=2000, payout=self.pay(['confirmed']))
+        def payout(balances, record):
+            # A second process settling concurrently finds the lock held
+            self.assertEqual(other.settle(), {})
+            return self.pay(['confirmed'])(balances, record)
+        self.accrual.payout = payout
+        self.assertEqual(self.accrual.settle(), {(1001, SOL_MINT): 2000})
+
+    def test_record_rejects_uncovered_amounts(self):
+        self.accrual.record_fill(1, SOL_MINT, 10000)
+        self.accrual.flush()
+        with self.assertRaises(ValueError):
+            self.ledger.record_referral_payouts({(1001, SOL_MINT): 2001}, 'sig', 1000)
+        self.assertEqual(self.ledger.get_referral_balances(), {(1001, SOL_MINT): 2000})
+
+    def test_record_fill_stays_under_a_millisecond(self):
+        fills = 100000
+        start = time.perf_counter()
+        for i in range(fills):
+            self.accrual.record_fill(i % 50, SOL_MINT, 5000)
+        per_fill = (time.perf_counter() - start) / fills
+        self.assertLess(per_fill, 0.001)
+
+if __name__ == '__main__':
+    unittest.main()
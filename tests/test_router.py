@@ -0,0 +1,72 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from router import PrefixTrie, Router
+
+class TestPrefixTrie(unittest.TestCase):
+
+    def test_longest_match(self):
+        trie = PrefixTrie()
+        trie.insert('help_', 'help')
+        trie.insert('help_trading', 'trading')
+        self.assertEqual(trie.longest_match('help_trading'), 'trading')
+        self.assertEqual(trie.longest_match('help_account'), 'help')
+        self.assertIsNone(trie.longest_match('withdraw_sol'))
+        self.assertEqual(len(trie), 2)
+
+class TestRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.router = Router()
+        self.start = MagicMock()
+        self.refresh = MagicMock()
+        self.withdraw = MagicMock()
+        self.help = MagicMock()
+        self.fallback = MagicMock()
+        self.router.command('start')(self.start)
+        self.router.text('🔄 Refresh')(self.refresh)
+        self.router.callback('withdraw_sol')(self.withdraw)
+        self.router.callback_prefix('help_')(self.help)
+        self.router.text_fallback(lambda message: len(message.text) == 44)(self.fallback)
+
+    def test_command_with_bot_name_and_args(self):
+        message = SimpleNamespace(text='/start@BarkBot ref123')
+        self.assertTrue(self.router.dispatch_message(message))
+        self.start.assert_called_once_with(message)
+
+    def test_exact_text(self):
+        message = SimpleNamespace(text='🔄 Refresh')
+        self.router.dispatch_message(message)
+        self.refresh.assert_called_once_with(message)
+
+    def test_callback_exact_and_prefix(self):
+        withdraw_call = SimpleNamespace(data='withdraw_sol')
+        help_call = SimpleNamespace(data='help_market')
+        self.router.dispatch_callback(withdraw_call)
+        self.router.dispatch_callback(help_call)
+        self.withdraw.assert_called_once_with(withdraw_call)
+        self.help.assert_called_once_with(help_call)
+
+    def test_fallback_only_when_no_route(self):
+        message = SimpleNamespace(text='9tV5oXSkPzYBwZJCnreMA4Q2NYZox7snJYEbxmFEaSac')
+        self.router.dispatch_message(message)
+        self.fallback.assert_called_once_with(message)
+        self.assertFalse(self.router.dispatch_message(SimpleNamespace(text='unknown')))
+        self.assertFalse(self.router.dispatch_callback(SimpleNamespace(data='unknown')))
+
+    def test_next_step_is_timed(self):
+        bot = MagicMock()
+        message = SimpleNamespace(text='yes')
+
+        def confirm_step(message, amount):
+            confirm_step.calls.append((message, amount))
+        confirm_step.calls = []
+        self.router.next_step(bot, message, confirm_step, 5)
+        step, amount = bot.register_next_step_handler.call_args.args[1:]
+        step(message, amount)
+        self.assertEqual(confirm_step.calls, [(message, 5)])
+        self.assertEqual(self.router.histogram(confirm_step).count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+from services import ServiceContainer
+
+class Client:
+    def __init__(self):
+        self.url = 'http://localhost'
+
+    def ping(self):
+        return 'pong'
+
+class TestServiceContainer(unittest.TestCase):
+
+    def setUp(self):
+        self.services = ServiceContainer()
+        self.factory = MagicMock(side_effect=Client)
+        self.client = self.services.register('client', self.factory)
+
+    def test_service_is_built_on_first_use_only(self):
+        self.assertFalse(self.services.is_built('client'))
+        self.factory.assert_not_called()
+        self.assertEqual(self.client.ping(), 'pong')
+        self.assertEqual(self.client.url, 'http://localhost')
+        self.factory.assert_called_once()
+
+    def test_concurrent_first_use_builds_once(self):
+        threads = [threading.Thread(target=self.client.ping) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.factory.assert_called_once()
+
+    def test_patching_through_lazy_proxy(self):
+        with patch.object(self.client, 'ping', return_value='patched'):
+            self.assertEqual(self.client.ping(), 'patched')
+        self.assertEqual(self.client.ping(), 'pong')
+
+    def test_startup_hooks_run_once_and_reset_after_fork(self):
+        hook = MagicMock()
+        self.services.on_startup(hook)
+        self.services.startup()
+        self.services.startup()
+        hook.assert_called_once()
+        self.client.ping()
+        self.services.reset()
+        self.assertFalse(self.services.is_built('client'))
+        self.services.startup()
+        self.assertEqual(hook.call_count, 2)
+
+    def test_leader_hooks_run_in_one_container_only(self):
+        with tempfile.TemporaryDirectory() as directory:
+            lock = os.path.join(directory, 'leader.lock')
+            leader, follower = ServiceContainer(leader_lock=lock), ServiceContainer(leader_lock=lock)
+            hooks = {leader: MagicMock(), follower: MagicMock()}
+            for container, hook in hooks.items():
+                container.on_startup(MagicMock())
+                container.on_leader_startup(hook)
+            leader.startup()
+            follower.startup()
+            hooks[leader].assert_called_once()
+            hooks[follower].assert_not_called()
+            # The lock goes with its holder; a restarted follower takes over
+            leader.reset()
+            follower.reset()
+            follower.startup()
+            hooks[follower].assert_called_once()
+            follower.reset()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from instrumentation import MetricsRegistry
+from shard_runtime import ERRORS, PROCESSED, ChatSerialExecutor, ShardedRuntime, chat_id_of, shard_for
+
+def message_update(update_id, chat_id, text='hi'):
+    return {'update_id': update_id, 'message': {'message_id': update_id, 'chat': {'id': chat_id}, 'from': {'id': chat_id}, 'text': text}}
+
+def recording_handler():
+    # Worker handler that appends every update it sees to a per-process file
+    path = os.path.join(os.environ['SHARD_TEST_DIR'], f"{os.getpid()}.jsonl")
+    lock = threading.Lock()
+
+    def handle(update):
+        if update['message']['text'] == 'fail':
+            raise ValueError('boom')
+        if update['message']['text'] == 'hang':
+            time.sleep(60)
+        time.sleep(0.001)
+        with lock, open(path, 'a') as out:
+            out.write(json.dumps([update['message']['chat']['id'], update['update_id']]) + '\n')
+    return handle
+
+class TestShardRouting(unittest.TestCase):
+
+    def test_chat_id_of_update_types(self):
+        self.assertEqual(chat_id_of(message_update(1, 42)), 42)
+        self.assertEqual(chat_id_of({'update_id': 2, 'callback_query': {'from': {'id': 7}, 'message': {'chat': {'id': 42}}}}), 42)
+        self.assertEqual(chat_id_of({'update_id': 3, 'callback_query': {'from': {'id': 7}}}), 7)
+        self.assertEqual(chat_id_of({'update_id': 4, 'inline_query': {'from': {'id': 9}, 'query': ''}}), 9)
+        self.assertIsNone(chat_id_of({'update_id': 5}))
+
+    def test_shard_for_is_stable_and_spreads_chats(self):
+        self.assertEqual(shard_for(123456789, 4), shard_for(123456789, 4))
+        self.assertEqual(shard_for(None, 4), 0)
+        counts = [0] * 4
+        for chat_id in range(1000, 5000):
+            counts[shard_for(chat_id, 4)] += 1
+        self.assertTrue(all(800 < count < 1200 for count in counts))
+
+    def test_chat_serial_executor_keeps_per_chat_order(self):
+        executor = ChatSerialExecutor(4)
+        seen = {}
+        for i in range(400):
+            chat_id = i % 10
+            executor.submit(chat_id, lambda chat_id, i: seen.setdefault(chat_id, []).append(i), chat_id, i)
+        executor.shutdown()
+        for chat_id, order in seen.items():
+            self.assertEqual(order, sorted(order))
+            self.assertEqual(len(order), 40)
+
+class TestShardedRuntime(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.environ['SHARD_TEST_DIR'] = self.tmpdir.name
+        self.runtime = ShardedRuntime(3, handler_factory=recording_handler, threads=4, start_method='fork').start()
+
+    def tearDown(self):
+        self.runtime.stop()
+        self.tmpdir.cleanup()
+        del os.environ['SHARD_TEST_DIR']
+
+    def records(self):
+        by_pid = {}
+        for name in os.listdir(self.tmpdir.name):
+            with open(os.path.join(self.tmpdir.name, name)) as records:
+                by_pid[name] = [json.loads(line) for line in records]
+        return by_pid
+
+    def test_updates_are_partitioned_and_ordered_per_chat(self):
+        for update_id in range(300):
+            self.runtime.dispatch(message_update(update_id, 1000 + update_id % 12))
+        self.runtime.dispatch(message_update(300, 5, 'fail'))
+        self.assertTrue(self.runtime.wait_idle(timeout=30))
+
+        chats_by_pid = {}
+        for pid, records in self.records().items():
+            per_chat = {}
+            for chat_id, update_id in records:
+                per_chat.setdefault(chat_id, []).append(update_id)
+            for chat_id, update_ids in per_chat.items():
+                self.assertEqual(update_ids, sorted(update_ids))
+                self.assertEqual(len(update_ids), 25)
+            chats_by_pid[pid] = set(per_chat)
+        all_chats = [chat for chats in chats_by_pid.values() for chat in chats]
+        self.assertEqual(len(all_chats), len(set(all_chats)))
+        self.assertEqual(len(all_chats), 12)
+
+        status = self.runtime.shard_status()
+        self.assertEqual(sum(shard['processed'] for shard in status), 300)
+        self.assertEqual(sum(shard['errors'] for shard in status), 1)
+        self.assertTrue(all(shard['healthy'] and shard['queue_depth'] == 0 for shard in status))
+
+    def test_dead_worker_is_restarted_and_metrics_exposed(self):
+        registry = MetricsRegistry()
+        self.runtime.register_metrics(registry)
+        self.runtime.processes[1].kill()
+        self.runtime.processes[1].join()
+        self.runtime.supervise()
+        self.assertEqual(self.runtime.restarts[1], 1)
+        self.runtime.dispatch(message_update(1, next(chat for chat in range(1000) if shard_for(chat, 3) == 1)))
+        self.assertTrue(self.runtime.wait_idle(timeout=30))
+        rendered = registry.render()
+        self.assertIn('barkbot_shard_restarts{shard="1"} 1', rendered)
+        self.assertIn('barkbot_shard_queue_depth{shard="0"} 0', rendered)
+
+    def test_restart_counts_in_flight_updates_as_errors(self):
+        chat_id = next(chat for chat in range(1000) if shard_for(chat, 3) == 2)
+        self.runtime.dispatch(message_update(1, chat_id, 'hang'))
+        deadline = time.monotonic() + 10
+        while self.runtime.queues[2].qsize() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.runtime.processes[2].kill()
+        self.runtime.processes[2].join()
+        self.runtime.supervise()
+        self.assertEqual(self.runtime.queue_depth(2), 0)
+        self.assertEqual(self.runtime.stat(2, ERRORS), 1)
+        # The replacement reads the queue the killed worker was waiting on
+        self.runtime.dispatch(message_update(2, chat_id))
+        self.assertTrue(self.runtime.wait_idle(timeout=30))
+        self.assertEqual(self.runtime.stat(2, PROCESSED), 1)
+
+    def test_reset_moves_waiting_updates_to_a_fresh_queue(self):
+        runtime = ShardedRuntime(2, handler_factory=recording_handler, start_method='fork')
+        chat_id = next(chat for chat in range(1000) if shard_for(chat, 2) == 0)
+        for update_id in range(5):
+            runtime.dispatch(message_update(update_id, chat_id))
+        old = runtime.queues[0]
+        runtime.reset_shard(0)
+        self.assertIsNot(runtime.queues[0], old)
+        self.assertEqual([runtime.queues[0].get(timeout=1)['update_id'] for _ in range(5)], list(range(5)))
+        self.assertEqual(runtime.stat(0, ERRORS), 0)
+
+if __name__ == '__main__':
+    unittest.main()
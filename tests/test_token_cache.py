@@ -0,0 +1,166 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+from solders.hash import Hash
+from solders.keypair import Keypair
+from solders.pubkey import Pubkey
+from solders.transaction import Transaction
+from solana.rpc.core import RPCException
+
+from instrumentation import MetricsRegistry
+from token_cache import TokenCache
+from withdrawal_engine import TOKEN_2022_PROGRAM_ID, TransferIntent, WithdrawalEngine, associated_token_address
+
+BARK_MINT = str(Pubkey.new_unique())
+
+def mint_account(decimals=6, fee_bps=None):
+    info = {'decimals': decimals, 'supply': '1000000000'}
+    if fee_bps is not None:
+        info['extensions'] = [{'extension': 'transferFeeConfig', 'state': {
+            'olderTransferFee': {'epoch': 0, 'maximumFee': 1000, 'transferFeeBasisPoints': 50},
+            'newerTransferFee': {'epoch': 600, 'maximumFee': 5000, 'transferFeeBasisPoints': fee_bps},
+        }}]
+    account = SimpleNamespace(owner=TOKEN_2022_PROGRAM_ID, data=SimpleNamespace(parsed={'info': info, 'type': 'mint'}))
+    return SimpleNamespace(value=account)
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'token_cache.json')
+        self.client = MagicMock()
+        self.client.get_account_info_json_parsed.return_value = mint_account(fee_bps=100)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_ata_is_derived_once(self):
+        cache = TokenCache()
+        owner = Pubkey.new_unique()
+        first = cache.ata(owner, BARK_MINT)
+        self.assertEqual(first, associated_token_address(owner, BARK_MINT))
+        self.assertEqual(cache.ata(str(owner), BARK_MINT), first)
+        self.assertEqual((cache.counters['ata_derivations'], cache.counters['ata_hits']), (1, 1))
+
+    def test_mint_info_is_cached_and_persisted(self):
+        registry = MetricsRegistry()
+        cache = TokenCache(self.path, registry=registry)
+        info = cache.mint_info(self.client, BARK_MINT)
+        self.assertEqual(info.decimals, 6)
+        self.assertEqual(info.program_id, str(TOKEN_2022_PROGRAM_ID))
+        self.assertIs(cache.mint_info(self.client, BARK_MINT), info)
+        self.assertEqual(cache.counters['rpc_reads'], 1)
+        self.assertIn('barkbot_token_cache_events{event="mint_hits"} 1', registry.render())
+
+        restarted = TokenCache(self.path)
+        self.assertEqual(restarted.mint_info(self.client, BARK_MINT).transfer_fee, info.transfer_fee)
+        self.assertEqual(restarted.counters['rpc_reads'], 0)
+        self.client.get_account_info_json_parsed.assert_called_once()
+
+    def test_stale_mint_info_is_refetched(self):
+        cache = TokenCache(mint_ttl=0)
+        cache.mint_info(self.client, BARK_MINT)
+        cache.mint_info(self.client, BARK_MINT)
+        self.assertEqual(cache.counters['rpc_reads'], 2)
+
+    def test_async_lookup_and_missing_mint(self):
+        client = MagicMock()
+        client.get_account_info_json_parsed = AsyncMock(side_effect=[mint_account(decimals=9), SimpleNamespace(value=None)])
+        cache = TokenCache()
+        self.assertEqual(asyncio.run(cache.mint_info_async(client, BARK_MINT)).decimals, 9)
+        self.assertEqual(asyncio.run(cache.mint_info_async(client, BARK_MINT)).decimals, 9)
+        with self.assertRaises(ValueError):
+            asyncio.run(cache.mint_info_async(client, str(Pubkey.new_unique())))
+
+    def test_transfer_fee(self):
+        info = TokenCache().mint_info(self.client, BARK_MINT)
+        self.assertEqual(info.fee(1001), 11)
+        self.assertEqual(info.fee(10**9), 5000)
+        self.assertEqual(info.fee(1001, epoch=10), 6)
+        self.client.get_account_info_json_parsed.return_value = mint_account()
+        self.assertEqual(TokenCache().mint_info(self.client, BARK_MINT).fee(10**9), 0)
+
+    def test_user_lookups_are_bounded_and_not_persisted(self):
+        cache = TokenCache(self.path, max_lookups=2)
+        mints = [str(Pubkey.new_unique()) for _ in range(3)]
+        for mint in mints:
+            cache.mint_info(self.client, mint, persist=False)
+        self.assertEqual(list(cache.lookups), mints[1:])
+        self.assertFalse(os.path.exists(self.path))
+        cache.mint_info(self.client, mints[2])
+        self.assertEqual(cache.counters['rpc_reads'], 3)
+        cache.mint_info(self.client, BARK_MINT)
+        self.assertEqual(list(TokenCache(self.path).mints), [BARK_MINT])
+
+    def test_current_epoch_is_cached(self):
+        self.client.get_epoch_info.return_value = SimpleNamespace(value=SimpleNamespace(epoch=599))
+        cache = TokenCache()
+        info = cache.mint_info(self.client, BARK_MINT)
+        self.assertEqual(info.fee(1001, cache.current_epoch(self.client)), 6)
+        self.assertEqual(info.fee_config(cache.current_epoch(self.client))['basis_points'], 50)
+        self.client.get_epoch_info.assert_called_once()
+
+class TestWithdrawalEngineWithCache(unittest.TestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.get_latest_blockhash = AsyncMock(return_value=SimpleNamespace(value=SimpleNamespace(blockhash=Hash.new_unique(), last_valid_block_height=1000)))
+        self.client.send_raw_transaction = AsyncMock()
+        self.client.confirm_transaction = AsyncMock(return_value=SimpleNamespace(value=[SimpleNamespace(err=None)]))
+        self.client.get_multiple_accounts = AsyncMock(side_effect=lambda keys: SimpleNamespace(value=[SimpleNamespace()] * len(keys)))
+        self.cache = TokenCache()
+        self.engine = WithdrawalEngine(self.client, cache=self.cache)
+        self.sender = Keypair()
+        self.recipient = Pubkey.new_unique()
+
+    def withdraw(self):
+        intent = TransferIntent(self.sender, self.recipient, 10**6, mint=BARK_MINT, decimals=6)
+        result = self.engine.execute([intent])[0]
+        sent = Transaction.from_bytes(self.client.send_raw_transaction.await_args.args[0])
+        return result, len(sent.message.instructions)
+
+    def test_known_recipient_account_is_not_created_again(self):
+        result, instructions = self.withdraw()
+        self.assertTrue(result.ok)
+        self.assertEqual(instructions, 3)
+        result, instructions = self.withdraw()
+        self.assertEqual(instructions, 2)
+        self.assertEqual(self.cache.counters['account_hits'], 1)
+        self.assertEqual(self.cache.counters['ata_derivations'], 2)
+        self.client.get_account_info_json_parsed.assert_not_called()
+        # Only the cached account is checked, in the blockhash round trip,
+        # and that check is the one read
+        self.assertEqual(self.client.get_multiple_accounts.await_count, 1)
+        self.assertEqual(self.cache.counters['rpc_reads'], 1)
+
+    def test_closed_recipient_account_is_created_again(self):
+        self.withdraw()
+        self.client.get_multiple_accounts.side_effect = lambda keys: SimpleNamespace(value=[None] * len(keys))
+        result, instructions = self.withdraw()
+        self.assertTrue(result.ok)
+        self.assertEqual(instructions, 3)
+        self.assertEqual(self.cache.counters['accounts_invalidated'], 1)
+
+    def test_failed_existence_check_keeps_the_create(self):
+        self.withdraw()
+        self.client.get_multiple_accounts.side_effect = RPCException('node is behind')
+        result, instructions = self.withdraw()
+        self.assertTrue(result.ok)
+        self.assertEqual(instructions, 3)
+
+    def test_failed_transfer_invalidates_account(self):
+        self.withdraw()
+        self.client.send_raw_transaction.side_effect = [RPCException('account closed'), None]
+        result, instructions = self.withdraw()
+        self.assertFalse(result.ok)
+        self.assertEqual(self.cache.counters['accounts_invalidated'], 1)
+        result, instructions = self.withdraw()
+        self.assertTrue(result.ok)
+        self.assertEqual(instructions, 3)
+
+if __name__ == '__main__':
+    unittest.main()
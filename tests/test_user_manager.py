@@ -0,0 +1,81 @@
+import os
+import sys
+import tempfile
+import unittest
+
+from cryptography.fernet import Fernet
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects import postgresql
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+from user_manager import ReferralBalance, UserManager
+
+SOL_MINT = 'So11111111111111111111111111111111111111112'
+
+class TestUserManager(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database_url = f"sqlite:///{os.path.join(self.directory.name, 'barkbot.db')}"
+        os.environ['DATABASE_URL'] = self.database_url
+        self.manager = UserManager(Fernet.generate_key())
+
+    def tearDown(self):
+        self.manager.engine.dispose()
+        self.directory.cleanup()
+
+    def test_migration_adds_referrer_column_to_existing_table(self):
+        engine = create_engine(self.database_url)
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, telegram_id INTEGER UNIQUE NOT NULL, "
+                                    "email VARCHAR NOT NULL, password VARCHAR NOT NULL, verified BOOLEAN, public_key VARCHAR, "
+                                    "private_key VARCHAR, rpc VARCHAR, slippage VARCHAR, priority VARCHAR)"))
+        engine.dispose()
+        self.manager.init_schema()
+        self.manager.init_schema()
+        self.manager.create_user(1, 'referrer@example.com', 'x')
+        self.manager.create_user(2, 'user@example.com', 'x', referrer_id=1)
+        self.assertEqual(self.manager.get_referrers({1, 2}), {2: 1})
+
+    def test_first_referrer_wins(self):
+        self.manager.init_schema()
+        for telegram_id in (1, 2, 3):
+            self.manager.create_user(telegram_id, f'{telegram_id}@example.com', 'x')
+        self.assertFalse(self.manager.set_referrer(3, 3))
+        self.assertFalse(self.manager.set_referrer(3, 99))
+        self.assertTrue(self.manager.set_referrer(3, 1))
+        self.assertFalse(self.manager.set_referrer(3, 2))
+        self.assertEqual(self.manager.get_referrers({3}), {3: 1})
+
+    def test_upsert_accumulates_on_conflict(self):
+        self.manager.init_schema()
+        self.manager.upsert_referral_balances({(1, SOL_MINT): 100, (2, SOL_MINT): 5})
+        self.manager.upsert_referral_balances({(1, SOL_MINT): 50})
+        self.assertEqual(self.manager.get_referral_balances(), {(1, SOL_MINT): 150, (2, SOL_MINT): 5})
+
+    def test_upsert_compiles_to_postgres_on_conflict(self):
+        statement = postgresql.insert(ReferralBalance).values([{'referrer_id': 1, 'mint': SOL_MINT, 'accrued': 1, 'paid': 0}])
+        statement = statement.on_conflict_do_update(
+            index_elements=[ReferralBalance.referrer_id, ReferralBalance.mint],
+            set_={'accrued': ReferralBalance.accrued + statement.excluded.accrued},
+        )
+        sql = str(statement.compile(dialect=postgresql.dialect()))
+        self.assertIn('ON CONFLICT (referrer_id, mint) DO UPDATE SET accrued = (referral_balances.accrued + excluded.accrued)', sql)
+
+    def test_payout_is_recorded_then_confirmed_or_released(self):
+        self.manager.init_schema()
+        self.manager.upsert_referral_balances({(1, SOL_MINT): 100, (2, SOL_MINT): 100})
+        self.manager.record_referral_payouts({(1, SOL_MINT): 100}, 'sig-a', 1000)
+        self.manager.record_referral_payouts({(2, SOL_MINT): 100}, 'sig-b', 1000)
+        self.assertEqual(self.manager.get_referral_balances(), {})
+        self.assertEqual(self.manager.get_pending_referral_payouts(), {'sig-a': 1000, 'sig-b': 1000})
+        with self.assertRaises(ValueError):
+            self.manager.record_referral_payouts({(1, SOL_MINT): 1}, 'sig-c', 1000)
+        self.assertEqual(self.manager.get_pending_referral_payouts(), {'sig-a': 1000, 'sig-b': 1000})
+        confirmed = self.manager.resolve_referral_payouts({'sig-a': 'confirmed', 'sig-b': 'failed'})
+        self.assertEqual(confirmed, {(1, SOL_MINT): 100})
+        self.assertEqual(self.manager.get_referral_balances(), {(2, SOL_MINT): 100})
+        self.assertEqual(self.manager.resolve_referral_payouts({'sig-a': 'confirmed'}), {})
+
+if __name__ == '__main__':
+    unittest.main()
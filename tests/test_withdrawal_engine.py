@@ -0,0 +1,136 @@
+import asyncio
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+from solders.hash import Hash
+from solders.keypair import Keypair
+from solders.pubkey import Pubkey
+from solders.transaction import Transaction
+from solders.transaction_status import TransactionConfirmationStatus
+from solana.rpc.core import RPCException
+
+from withdrawal_engine import (
+    CONFIRMED, FAILED, PACKET_DATA_SIZE, PENDING, TransferIntent, WithdrawalEngine, build_transaction, pack_intents,
+)
+
+BARK_MINT = Pubkey.new_unique()
+
+class TestPacking(unittest.TestCase):
+
+    def setUp(self):
+        self.treasury = Keypair()
+
+    def assert_batches_fit(self, intents, batches):
+        packed = [intent for batch in batches for intent in batch.intents]
+        self.assertEqual(sorted(map(id, packed)), sorted(map(id, intents)))
+        for batch in batches:
+            transaction = build_transaction(batch, Hash.new_unique())
+            self.assertEqual(len(bytes(transaction)), batch.size)
+            self.assertLessEqual(batch.size, PACKET_DATA_SIZE)
+
+    def test_sol_transfers_are_packed_densely(self):
+        intents = [TransferIntent(self.treasury, Pubkey.new_unique(), 1000 + i) for i in range(200)]
+        batches = pack_intents(intents)
+        self.assert_batches_fit(intents, batches)
+        self.assertGreaterEqual(min(len(batch.intents) for batch in batches[:-1]), 18)
+
+    def test_token_2022_transfers_are_packed_densely(self):
+        intents = [
+            TransferIntent(self.treasury, Pubkey.new_unique(), 10**6, mint=BARK_MINT, decimals=6, create_recipient_account=False)
+            for _ in range(100)
+        ]
+        batches = pack_intents(intents)
+        self.assert_batches_fit(intents, batches)
+        self.assertGreaterEqual(min(len(batch.intents) for batch in batches[:-1]), 15)
+
+    def test_senders_are_not_mixed(self):
+        other = Keypair()
+        intents = [TransferIntent(sender, Pubkey.new_unique(), 5000) for sender in (self.treasury, other) * 10]
+        batches = pack_intents(intents)
+        self.assertEqual(len(batches), 2)
+        for batch in batches:
+            self.assertTrue(all(intent.sender is batch.sender for intent in batch.intents))
+
+def confirmed_status(err=None):
+    return SimpleNamespace(value=[SimpleNamespace(err=err)])
+
+def sent_signature(client, call=0):
+    return Transaction.from_bytes(client.send_raw_transaction.await_args_list[call].args[0]).signatures[0]
+
+class TestWithdrawalEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.get_latest_blockhash = AsyncMock(return_value=SimpleNamespace(value=SimpleNamespace(blockhash=Hash.new_unique(), last_valid_block_height=1000)))
+        self.client.send_raw_transaction = AsyncMock()
+        self.client.confirm_transaction = AsyncMock(return_value=confirmed_status())
+        self.client.get_signature_statuses = AsyncMock(return_value=SimpleNamespace(value=[None]))
+        self.client.get_block_height = AsyncMock(return_value=SimpleNamespace(value=900))
+        self.engine = WithdrawalEngine(self.client, concurrency=1)
+
+    def test_results_map_back_to_intents(self):
+        self.client.send_raw_transaction.side_effect = [None, RPCException('insufficient funds')]
+        first, second = Keypair(), Keypair()
+        intents = [self.engine.submit(TransferIntent(sender, Pubkey.new_unique(), 5000)) for sender in (first, second, first)]
+        results = asyncio.run(self.engine.flush())
+        self.assertEqual([result.intent for result in results], intents)
+        self.assertEqual([result.signature for result in results], [sent_signature(self.client, 0), sent_signature(self.client, 1), sent_signature(self.client, 0)])
+        self.assertEqual([result.status for result in results], [CONFIRMED, FAILED, CONFIRMED])
+        self.assertIsInstance(results[1].error, RPCException)
+        self.client.get_latest_blockhash.assert_awaited_once()
+        self.client.get_signature_statuses.assert_not_awaited()
+        self.assertEqual(self.engine.queue, [])
+
+    def test_confirmation_failure_keeps_signature_and_is_pending(self):
+        self.client.confirm_transaction.side_effect = TimeoutError('confirmation timed out')
+        intent = TransferIntent(Keypair(), Pubkey.new_unique(), 5000)
+        result = asyncio.run(self.engine.flush([intent]))[0]
+        self.assertEqual(result.signature, sent_signature(self.client))
+        self.assertEqual(result.status, PENDING)
+        self.assertFalse(result.ok)
+        self.assertFalse(result.failed)
+        self.client.get_signature_statuses.assert_awaited_once()
+
+    def test_status_check_settles_unknown_outcomes(self):
+        self.client.send_raw_transaction.side_effect = TimeoutError('read timed out')
+        intent = TransferIntent(Keypair(), Pubkey.new_unique(), 5000)
+        landed = SimpleNamespace(err=None, confirmation_status=TransactionConfirmationStatus.Confirmed)
+        self.client.get_signature_statuses.return_value = SimpleNamespace(value=[landed])
+        result = asyncio.run(self.engine.flush([intent]))[0]
+        self.assertEqual(result.status, CONFIRMED)
+        self.assertIsNone(result.error)
+        # Never seen and past its blockhash: it can no longer land
+        self.client.get_signature_statuses.return_value = SimpleNamespace(value=[None])
+        self.client.get_block_height.return_value = SimpleNamespace(value=1001)
+        result = asyncio.run(self.engine.flush([intent]))[0]
+        self.assertTrue(result.failed)
+
+    def test_failed_on_chain_is_failed(self):
+        self.client.confirm_transaction.return_value = confirmed_status(err='InsufficientFundsForRent')
+        result = asyncio.run(self.engine.flush([TransferIntent(Keypair(), Pubkey.new_unique(), 5000)]))[0]
+        self.assertTrue(result.failed)
+        self.assertEqual(result.signature, sent_signature(self.client))
+
+    def test_signature_is_recorded_before_sending(self):
+        recorded = []
+        self.client.send_raw_transaction.side_effect = lambda *args, **kwargs: self.assertEqual(len(recorded), 1)
+        self.engine.execute([TransferIntent(Keypair(), Pubkey.new_unique(), 5000)], before_send=lambda batch, signature, height: recorded.append((signature, height)))
+        self.assertEqual(recorded, [(sent_signature(self.client), 1000)])
+        result = self.engine.execute([TransferIntent(Keypair(), Pubkey.new_unique(), 5000)], before_send=lambda *args: 1 / 0)[0]
+        self.assertTrue(result.failed)
+        self.assertEqual(self.client.send_raw_transaction.await_count, 1)
+
+    def test_execute_from_many_threads_shares_one_loop(self):
+        loops = set()
+        async def send(*args, **kwargs):
+            loops.add(id(asyncio.get_running_loop()))
+        self.client.send_raw_transaction.side_effect = send
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: self.engine.execute([TransferIntent(Keypair(), Pubkey.new_unique(), 5000)])[0], range(16)))
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(len(loops), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from withdrawal_engine import TOKEN_2022_PROGRAM_ID, associated_token_address, to_pubkey
+
+# Derivation and metadata cache for the transfer and swap paths. Associated
+# token addresses are derived locally once and memoized; mint info (decimals,
+# owning program, Token-2022 transfer fee) is cached in memory and in a JSON
+# file since it rarely changes; account existence is remembered with a TTL
+# and marked on create. A remembered account is only a hint: the withdrawal
+# engine confirms it still exists alongside its blockhash fetch before it
+# drops the create instruction. Mints users merely look up are kept in a
+# bounded in-memory map and never written to the file.
+
+# Epochs last about two days, so a minute-old epoch is current enough
+EPOCH_TTL = 60.0
+
+COUNTERS = (
+    'ata_hits', 'ata_derivations', 'mint_hits', 'mint_misses',
+    'account_hits', 'account_misses', 'accounts_marked', 'accounts_invalidated', 'rpc_reads',
+)
+
+
+class MintInfo:
+    def __init__(self, mint, decimals, program_id, transfer_fee=None, fetched_at=None):
+        self.mint = mint
+        self.decimals = decimals
+        self.program_id = program_id
+        # {'older': {...}, 'newer': {...}} with epoch, basis_points and maximum_fee
+        self.transfer_fee = transfer_fee
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+
+    def fee_config(self, epoch=None):
+        # The newer config applies from its epoch on; without an epoch, assume it does
+        if not self.transfer_fee:
+            return None
+        config = self.transfer_fee['newer']
+        if epoch is not None and epoch < config['epoch']:
+            config = self.transfer_fee['older']
+        return config
+
+    def fee(self, amount, epoch=None):
+        # Token-2022 withholds ceil(amount * bps / 10000), capped at the maximum fee
+        config = self.fee_config(epoch)
+        if config is None:
+            return 0
+        fee = -(-amount * config['basis_points'] // 10000)
+        return min(fee, config['maximum_fee'])
+
+    def to_json(self):
+        return {
+            'decimals': self.decimals, 'program_id': self.program_id,
+            'transfer_fee': self.transfer_fee, 'fetched_at': self.fetched_at,
+        }
+
+    @classmethod
+    def from_json(cls, mint, data):
+        return cls(mint, data['decimals'], data['program_id'], data.get('transfer_fee'), data.get('fetched_at'))
+
+
+def parse_mint_account(mint, account):
+    # account is the value of a jsonParsed getAccountInfo for the mint
+    if account is None:
+        raise ValueError(f"Mint {mint} not found")
+    info = account.data.parsed['info']
+    transfer_fee = None
+    for extension in info.get('extensions', []):
+        if extension.get('extension') == 'transferFeeConfig':
+            state = extension['state']
+            transfer_fee = {
+                key: {
+                    'epoch': int(state[field]['epoch']),
+                    'basis_points': int(state[field]['transferFeeBasisPoints']),
+                    'maximum_fee': int(state[field]['maximumFee']),
+                }
+                for key, field in (('older', 'olderTransferFee'), ('newer', 'newerTransferFee'))
+            }
+    return MintInfo(mint, int(info['decimals']), str(account.owner), transfer_fee)
+
+
+class TokenCache:
+    def __init__(self, path=None, mint_ttl=86400.0, exists_ttl=3600.0, registry=None, max_lookups=1000):
+        self.path = path
+        self.mint_ttl = mint_ttl
+        self.exists_ttl = exists_ttl
+        self.max_lookups = max_lookups
+        self.atas = {}
+        self.mints = {}
+        # Mints looked up for users, oldest first; memory only
+        self.lookups = OrderedDict()
+        self.accounts = {}
+        self.epoch = None
+        self.epoch_checked = 0.0
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+        if registry is not None:
+            for counter in COUNTERS:
+                registry.register_gauge('barkbot_token_cache_events', lambda counter=counter: self.counters[counter], event=counter)
+
+    def count(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    # Associated token addresses
+
+    def ata(self, owner, mint, token_program=TOKEN_2022_PROGRAM_ID):
+        key = (str(owner), str(mint), str(token_program))
+        address = self.atas.get(key)
+        if address is not None:
+            self.count('ata_hits')
+            return address
+        address = associated_token_address(owner, mint, token_program)
+        self.count('ata_derivations')
+        self.atas[key] = address
+        return address
+
+    # Mint info
+
+    def cached_mint(self, mint):
+        info = self.mints.get(str(mint)) or self.lookups.get(str(mint))
+        if info is not None and time.time() - info.fetched_at < self.mint_ttl:
+            self.count('mint_hits')
+            return info
+        self.count('mint_misses')
+        return None
+
+    def remember_mint(self, info, persist=True):
+        # persist=False for mints a user typed in: any string can be a mint,
+        # so those are capped at max_lookups and never saved
+        with self.lock:
+            if persist:
+                self.mints[info.mint] = info
+                self.lookups.pop(info.mint, None)
+            else:
+                self.lookups[info.mint] = info
+                self.lookups.move_to_end(info.mint)
+                while len(self.lookups) > self.max_lookups:
+                    self.lookups.popitem(last=False)
+        if persist:
+            self.save()
+        return info
+
+    def mint_info(self, client, mint, persist=True):
+        info = self.cached_mint(mint)
+        if info is None:
+            self.count('rpc_reads')
+            account = client.get_account_info_json_parsed(to_pubkey(mint)).value
+            info = self.remember_mint(parse_mint_account(str(mint), account), persist)
+        return info
+
+    async def mint_info_async(self, client, mint, persist=True):
+        info = self.cached_mint(mint)
+        if info is None:
+            self.count('rpc_reads')
+            account = (await client.get_account_info_json_parsed(to_pubkey(mint))).value
+            info = self.remember_mint(parse_mint_account(str(mint), account), persist)
+        return info
+
+    def current_epoch(self, client):
+        # For MintInfo.fee: the newer transfer fee only applies from its epoch
+        if self.epoch is None or time.monotonic() - self.epoch_checked > EPOCH_TTL:
+            self.count('rpc_reads')
+            self.epoch = client.get_epoch_info().value.epoch
+            self.epoch_checked = time.monotonic()
+        return self.epoch
+
+    # Account existence
+
+    def account_exists(self, address):
+        # True when the account is known to exist, None when unknown or stale
+        expires = self.accounts.get(str(address))
+        if expires is not None and expires > time.monotonic():
+            self.count('account_hits')
+            return True
+        self.count('account_misses')
+        return None
+
+    def mark_exists(self, address):
+        self.accounts[str(address)] = time.monotonic() + self.exists_ttl
+        self.count('accounts_marked')
+
+    def invalidate(self, address):
+        # After a failed transfer: the account may have been closed
+        if self.accounts.pop(str(address), None) is not None:
+            self.count('accounts_invalidated')
+
+    # Persistence
+
+    def load(self):
+        try:
+            with open(self.path) as cache_file:
+                data = json.load(cache_file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable token cache {self.path}: {e}")
+            return
+        for mint, info in data.get('mints', {}).items():
+            self.mints[mint] = MintInfo.from_json(mint, info)
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            data = {'mints': {mint: info.to_json() for mint, info in self.mints.items()}}
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(temporary, 'w') as cache_file:
+                    json.dump(data, cache_file, sort_keys=True)
+                # Atomic, so concurrent bot shards never read a partial file
+                os.replace(temporary, self.path)
+            except OSError as e:
+                logging.warning(f"Could not write token cache {self.path}: {e}")
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters, atas=len(self.atas), mints=len(self.mints), lookups=len(self.lookups), accounts=len(self.accounts))
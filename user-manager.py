@@ -16,6 +16,7 @@ class User(Base):
     rpc = Column(String)
     slippage = Column(String)
     priority = Column(String)
+    referrer_id = Column(Integer, index=True)
 
 class UserManager:
     def __init__(self, encryption_key):
@@ -74,6 +75,23 @@ class UserManager:
         session.close()
         return verification_code
     
+    def set_referrer(self, telegram_id, referrer_id):
+        # First referrer wins; returns False if the user is unknown, already
+        # referred, or the referrer does not exist
+        if referrer_id == telegram_id:
+            return False
+        session = self.Session()
+        try:
+            if not session.query(User.id).filter_by(telegram_id=referrer_id).first():
+                return False
+            updated = session.query(User).filter(
+                User.telegram_id == telegram_id, User.referrer_id.is_(None)
+            ).update({User.referrer_id: referrer_id})
+            session.commit()
+            return bool(updated)
+        finally:
+            session.close()
+    
     def verify_user(self, telegram_id):
         session = self.Session()
         user = session.query(User).filter_by(telegram_id=telegram_id).first()
@@ -0,0 +1,384 @@
+import asyncio
+import logging
+import threading
+
+from solders.compute_budget import set_compute_unit_limit
+from solders.hash import Hash
+from solders.instruction import AccountMeta, Instruction
+from solders.keypair import Keypair
+from solders.message import Message
+from solders.pubkey import Pubkey
+from solders.system_program import TransferParams, transfer
+from solders.transaction import Transaction
+
+import program_ids
+
+# Batched withdrawals. Transfer intents are queued, grouped by sender and
+# packed greedily into as few transactions as fit the packet size and
+# compute limits; batches are then signed and submitted in parallel and each
+# intent gets back the signature (or error) of the transaction that carried
+# it. One signature fee, blockhash fetch and confirmation per batch instead
+# of per transfer.
+#
+# A signature is fixed as soon as a batch is signed, so every result carries
+# it, including ones whose send or confirmation failed. A batch whose outcome
+# is unknown (the send timed out, or confirmation gave up) is reported as
+# pending rather than failed: it must not be retried until its signature
+# status shows it failed or its blockhash has expired.
+
+SYSTEM_PROGRAM_ID = Pubkey.from_string(program_ids.SYSTEM_PROGRAM_ID)
+TOKEN_PROGRAM_ID = Pubkey.from_string(program_ids.TOKEN_PROGRAM_ID)
+TOKEN_2022_PROGRAM_ID = Pubkey.from_string(program_ids.TOKEN_2022_PROGRAM_ID)
+ASSOCIATED_TOKEN_PROGRAM_ID = Pubkey.from_string(program_ids.ASSOCIATED_TOKEN_PROGRAM_ID)
+
+# Maximum serialized transaction size accepted by the cluster
+PACKET_DATA_SIZE = 1232
+MAX_COMPUTE_UNITS = 1400000
+# Keys per getMultipleAccounts call
+MULTIPLE_ACCOUNTS_BATCH_SIZE = 100
+
+# Conservative compute estimates per instruction
+COMPUTE_BUDGET_UNITS = 150
+SOL_TRANSFER_UNITS = 300
+TOKEN_TRANSFER_UNITS = 12000
+CREATE_ACCOUNT_UNITS = 35000
+
+TRANSFER_CHECKED = 12
+CREATE_IDEMPOTENT = 1
+
+# Withdrawal result states
+CONFIRMED = 'confirmed'
+SENT = 'sent'
+PENDING = 'pending'
+FAILED = 'failed'
+
+
+def to_pubkey(value):
+    return value if isinstance(value, Pubkey) else Pubkey.from_string(value)
+
+
+def associated_token_address(owner, mint, token_program=TOKEN_2022_PROGRAM_ID):
+    return Pubkey.find_program_address(
+        [bytes(to_pubkey(owner)), bytes(to_pubkey(token_program)), bytes(to_pubkey(mint))],
+        ASSOCIATED_TOKEN_PROGRAM_ID,
+    )[0]
+
+
+def transfer_checked(source, mint, destination, owner, amount, decimals, token_program=TOKEN_2022_PROGRAM_ID):
+    data = bytes([TRANSFER_CHECKED]) + amount.to_bytes(8, 'little') + bytes([decimals])
+    accounts = [
+        AccountMeta(source, is_signer=False, is_writable=True),
+        AccountMeta(mint, is_signer=False, is_writable=False),
+        AccountMeta(destination, is_signer=False, is_writable=True),
+        AccountMeta(owner, is_signer=True, is_writable=False),
+    ]
+    return Instruction(token_program, data, accounts)
+
+
+def create_associated_token_account_idempotent(payer, owner, mint, token_program=TOKEN_2022_PROGRAM_ID, address=None):
+    if address is None:
+        address = associated_token_address(owner, mint, token_program)
+    accounts = [
+        AccountMeta(payer, is_signer=True, is_writable=True),
+        AccountMeta(address, is_signer=False, is_writable=True),
+        AccountMeta(owner, is_signer=False, is_writable=False),
+        AccountMeta(mint, is_signer=False, is_writable=False),
+        AccountMeta(SYSTEM_PROGRAM_ID, is_signer=False, is_writable=False),
+        AccountMeta(token_program, is_signer=False, is_writable=False),
+    ]
+    return Instruction(ASSOCIATED_TOKEN_PROGRAM_ID, bytes([CREATE_IDEMPOTENT]), accounts)
+
+
+class TransferIntent:
+    # A single SOL (mint=None) or SPL/Token-2022 transfer; amount in base units
+    def __init__(self, sender, recipient, amount, mint=None, decimals=None,
+                 token_program=TOKEN_2022_PROGRAM_ID, create_recipient_account=True, reference=None):
+        if amount <= 0:
+            raise ValueError("Transfer amount must be positive")
+        if mint is not None and decimals is None:
+            raise ValueError("Token transfers require the mint decimals")
+        self.sender = sender
+        self.recipient = to_pubkey(recipient)
+        self.amount = int(amount)
+        self.mint = to_pubkey(mint) if mint is not None else None
+        self.decimals = decimals
+        self.token_program = to_pubkey(token_program)
+        self.create_recipient_account = create_recipient_account
+        self.reference = reference
+
+    def token_accounts(self, cache=None):
+        # Source and destination associated token accounts, memoized by the cache if given
+        derive = associated_token_address if cache is None else cache.ata
+        return (
+            derive(self.sender.pubkey(), self.mint, self.token_program),
+            derive(self.recipient, self.mint, self.token_program),
+        )
+
+    def instructions(self, cache=None):
+        owner = self.sender.pubkey()
+        if self.mint is None:
+            return [transfer(TransferParams(from_pubkey=owner, to_pubkey=self.recipient, lamports=self.amount))], SOL_TRANSFER_UNITS
+        source, destination = self.token_accounts(cache)
+        instructions = []
+        units = TOKEN_TRANSFER_UNITS
+        if self.create_recipient_account:
+            instructions.append(create_associated_token_account_idempotent(owner, self.recipient, self.mint, self.token_program, destination))
+            units += CREATE_ACCOUNT_UNITS
+        instructions.append(transfer_checked(source, self.mint, destination, owner, self.amount, self.decimals, self.token_program))
+        return instructions, units
+
+
+def transaction_size(instructions, payer):
+    message = Message.new_with_blockhash(instructions, payer, Hash.default())
+    # Compact-u16 signature count (one byte below 128) plus 64 bytes per signature
+    return 1 + 64 * message.header.num_required_signatures + len(bytes(message))
+
+
+class TransactionBatch:
+    def __init__(self, sender):
+        self.sender = sender
+        self.intents = []
+        self.instructions = []
+        self.compute_units = COMPUTE_BUDGET_UNITS
+        self.size = 0
+
+    def all_instructions(self, instructions=None, compute_units=None):
+        units = self.compute_units if compute_units is None else compute_units
+        return [set_compute_unit_limit(units)] + (self.instructions if instructions is None else instructions)
+
+
+def pack_intents(intents, max_size=PACKET_DATA_SIZE, max_compute_units=MAX_COMPUTE_UNITS, cache=None):
+    # Greedy first-fit per sender, preserving submission order within a sender
+    open_batches = {}
+    batches = []
+    for intent in intents:
+        payer = intent.sender.pubkey()
+        instructions, units = intent.instructions(cache)
+        batch = open_batches.get(payer)
+        if batch is not None:
+            candidate = batch.instructions + instructions
+            candidate_units = batch.compute_units + units
+            size = transaction_size(batch.all_instructions(candidate, candidate_units), payer)
+            if size <= max_size and candidate_units <= max_compute_units:
+                batch.intents.append(intent)
+                batch.instructions = candidate
+                batch.compute_units = candidate_units
+                batch.size = size
+                continue
+        batch = TransactionBatch(intent.sender)
+        batch.instructions = instructions
+        batch.compute_units += units
+        batch.size = transaction_size(batch.all_instructions(), payer)
+        if batch.size > max_size or batch.compute_units > max_compute_units:
+            raise ValueError("A single transfer does not fit in one transaction")
+        batch.intents.append(intent)
+        open_batches[payer] = batch
+        batches.append(batch)
+    return batches
+
+
+def build_transaction(batch, blockhash):
+    message = Message.new_with_blockhash(batch.all_instructions(), batch.sender.pubkey(), blockhash)
+    return Transaction([batch.sender], message, blockhash)
+
+
+class WithdrawalResult:
+    def __init__(self, intent, signature=None, error=None, status=None):
+        self.intent = intent
+        self.signature = signature
+        self.error = error
+        self.status = status or (FAILED if error is not None else CONFIRMED)
+
+    @property
+    def ok(self):
+        return self.status in (CONFIRMED, SENT)
+
+    @property
+    def pending(self):
+        # Outcome unknown: the transfer may still land, so it must not be retried yet
+        return self.status == PENDING
+
+    @property
+    def failed(self):
+        # Known not to have executed; safe to retry with a fresh blockhash
+        return self.status == FAILED
+
+
+class WithdrawalEngine:
+    def __init__(self, client, max_size=PACKET_DATA_SIZE, max_compute_units=MAX_COMPUTE_UNITS,
+                 concurrency=8, confirm=True, cache=None):
+        self.client = client
+        # Optional TokenCache: memoized ATAs, and no create instruction for
+        # recipient accounts already known to exist
+        self.cache = cache
+        self.max_size = max_size
+        self.max_compute_units = max_compute_units
+        self.concurrency = concurrency
+        self.confirm = confirm
+        self.queue = []
+        # The async client's connection pool belongs to one event loop, so all
+        # work runs on a single long-lived loop thread shared by every caller
+        self.loop = None
+        self.loop_lock = threading.Lock()
+
+    def submit(self, intent):
+        self.queue.append(intent)
+        return intent
+
+    async def send_batch(self, batch, blockhash, last_valid_block_height, semaphore, before_send=None):
+        from solana.rpc.commitment import Confirmed
+        from solana.rpc.core import RPCException
+        from solana.rpc.types import TxOpts
+
+        async with semaphore:
+            transaction = build_transaction(batch, blockhash)
+            signature = transaction.signatures[0]
+            if before_send is not None:
+                try:
+                    before_send(batch, signature, last_valid_block_height)
+                except Exception as e:
+                    # Not recorded, so not sent
+                    return signature, FAILED, e
+            try:
+                await self.client.send_raw_transaction(bytes(transaction), opts=TxOpts(skip_preflight=False, preflight_commitment=Confirmed))
+            except RPCException as e:
+                # Rejected by the node in preflight, so it was never forwarded
+                return signature, FAILED, e
+            except Exception as e:
+                # Timeouts and dropped connections: it may have been forwarded anyway
+                return signature, PENDING, e
+            if not self.confirm:
+                return signature, SENT, None
+            try:
+                response = await self.client.confirm_transaction(signature, Confirmed, last_valid_block_height=last_valid_block_height)
+            except Exception as e:
+                return signature, PENDING, e
+            status = response.value[0]
+            if status is not None and status.err is not None:
+                return signature, FAILED, RuntimeError(f"Transaction {signature} failed: {status.err}")
+            return signature, CONFIRMED, None
+
+    async def signature_states(self, signatures, last_valid_block_height):
+        # Settle unknown outcomes: landed, failed on chain, or never landed and
+        # now expired. Anything else is still pending.
+        from solana.rpc.commitment import Confirmed
+        from solders.transaction_status import TransactionConfirmationStatus
+
+        statuses = (await self.client.get_signature_statuses(list(signatures), search_transaction_history=True)).value
+        expired = (await self.client.get_block_height(Confirmed)).value > last_valid_block_height
+        states = {}
+        for signature, status in zip(signatures, statuses):
+            if status is None:
+                states[signature] = FAILED if expired else PENDING
+            elif status.err is not None:
+                states[signature] = FAILED
+            elif status.confirmation_status in (TransactionConfirmationStatus.Confirmed, TransactionConfirmationStatus.Finalized):
+                states[signature] = CONFIRMED
+            else:
+                states[signature] = PENDING
+        return states
+
+    async def existing_accounts(self, addresses):
+        # Which of the addresses exist on chain; none when the check fails, so
+        # every recipient account is created idempotently
+        addresses = list(dict.fromkeys(addresses))
+        if not addresses:
+            return set()
+        chunks = [addresses[i:i + MULTIPLE_ACCOUNTS_BATCH_SIZE] for i in range(0, len(addresses), MULTIPLE_ACCOUNTS_BATCH_SIZE)]
+        # One read per chunk; it rides along with the blockhash request, so it
+        # adds no round trip, but it is a read the cache did not save
+        if self.cache is not None:
+            self.cache.count('rpc_reads', len(chunks))
+        try:
+            responses = await asyncio.gather(*(self.client.get_multiple_accounts(chunk) for chunk in chunks))
+        except Exception as e:
+            logging.error(f"Error checking recipient token accounts: {e}")
+            return set()
+        return {
+            str(address)
+            for chunk, response in zip(chunks, responses)
+            for address, account in zip(chunk, response.value) if account is not None
+        }
+
+    async def flush(self, intents=None, before_send=None):
+        # before_send(batch, signature, last_valid_block_height) runs after a
+        # batch is signed and before it is sent, so callers can record the
+        # signature durably first
+        if intents is None:
+            intents, self.queue = self.queue, []
+        if not intents:
+            return []
+        known = []
+        if self.cache is not None:
+            known = [
+                intent for intent in intents
+                if intent.mint is not None and intent.create_recipient_account
+                and self.cache.account_exists(intent.token_accounts(self.cache)[1])
+            ]
+        # A cached account may have been closed since; it is checked in the
+        # same round trip as the blockhash, and recreated if it is gone
+        latest, existing = await asyncio.gather(
+            self.client.get_latest_blockhash(),
+            self.existing_accounts([intent.token_accounts(self.cache)[1] for intent in known]),
+        )
+        latest = latest.value
+        for intent in known:
+            destination = intent.token_accounts(self.cache)[1]
+            if str(destination) in existing:
+                intent.create_recipient_account = False
+            else:
+                self.cache.invalidate(destination)
+        batches = pack_intents(intents, self.max_size, self.max_compute_units, self.cache)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        outcomes = await asyncio.gather(
+            *(self.send_batch(batch, latest.blockhash, latest.last_valid_block_height, semaphore, before_send) for batch in batches)
+        )
+        unknown = [signature for signature, status, _ in outcomes if status == PENDING]
+        if unknown:
+            try:
+                states = await self.signature_states(unknown, latest.last_valid_block_height)
+            except Exception as e:
+                logging.error(f"Error checking withdrawal signature statuses: {e}")
+                states = {}
+            outcomes = [
+                (signature, states.get(signature, status), None if states.get(signature) == CONFIRMED else error)
+                for signature, status, error in outcomes
+            ]
+        results = {}
+        for batch, (signature, status, error) in zip(batches, outcomes):
+            if error is not None:
+                logging.error(f"Withdrawal batch {signature} of {len(batch.intents)} transfers is {status}: {error}")
+            for intent in batch.intents:
+                results[id(intent)] = WithdrawalResult(intent, signature=signature, error=error, status=status)
+        logging.info(f"Sent {len(intents)} transfers in {len(batches)} transactions")
+        results = [results[id(intent)] for intent in intents]
+        if self.cache is not None:
+            for result in results:
+                if result.intent.mint is None:
+                    continue
+                destination = result.intent.token_accounts(self.cache)[1]
+                if result.ok:
+                    self.cache.mark_exists(destination)
+                else:
+                    # The account may have been closed; create it again next time
+                    self.cache.invalidate(destination)
+        return results
+
+    def event_loop(self):
+        with self.loop_lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name='withdrawal-engine', daemon=True).start()
+        return self.loop
+
+    def run(self, coroutine, timeout=None):
+        # Run a coroutine on the engine's loop from any thread and wait for it
+        return asyncio.run_coroutine_threadsafe(coroutine, self.event_loop()).result(timeout)
+
+    def execute(self, intents=None, before_send=None):
+        return self.run(self.flush(intents, before_send))
+
+
+def keypair_from_secret(private_key):
+    # Wallet private keys are stored base58-encoded
+    return Keypair.from_base58_string(private_key)